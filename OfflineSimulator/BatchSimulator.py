@@ -0,0 +1,293 @@
+"""
+Batched version of the offline simulation environment. All sessions are advanced in lockstep, one mahimahi interval
+per iteration, with the exact same arithmetic as Environment.get_video_chunk so that the results stay comparable.
+"""
+
+import numpy as np
+
+from OfflineSimulator.OfflineSimulator import MILLISECONDS_IN_SECOND, B_IN_MB, BITS_IN_BYTE, EnvironmentState
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.VideoManifest import VideoManifest
+
+
+def pad_traces(all_cooked_time, all_cooked_bw):
+    """
+    Stacks traces of different length into two dimensional arrays
+    :param all_cooked_time: list of trace time stamps
+    :param all_cooked_bw: list of trace bandwidths
+    :return: cooked_time (n_traces,max_len), cooked_bw (n_traces,max_len), trace_len (n_traces,)
+    """
+    assert len(all_cooked_time) == len(all_cooked_bw)
+    trace_len = np.array([len(cooked_time) for cooked_time in all_cooked_time], dtype=np.int64)
+    cooked_time = np.zeros((len(trace_len), trace_len.max()))
+    cooked_bw = np.zeros((len(trace_len), trace_len.max()))
+    for trace_idx, length in enumerate(trace_len):
+        cooked_time[trace_idx, :length] = all_cooked_time[trace_idx]
+        cooked_bw[trace_idx, :length] = all_cooked_bw[trace_idx]
+    return cooked_time, cooked_bw, trace_len
+
+
+def download_chunks(cooked_time, cooked_bw, trace_len, trace_idx, mahimahi_ptr, last_mahimahi_time,
+                    video_chunk_size, packet_payload_portion):
+    """
+    Downloads one chunk per session over the mahimahi traces
+    :param cooked_time: padded trace time stamps (n_traces,max_len)
+    :param cooked_bw: padded trace bandwidths (n_traces,max_len)
+    :param trace_len: length of each trace
+    :param trace_idx: trace of each session
+    :param mahimahi_ptr: current trace pointer of each session
+    :param last_mahimahi_time: current trace time of each session
+    :param video_chunk_size: bytes to download per session
+    :param packet_payload_portion: scalar or one value per session
+    :return: delay in s (without rtt), updated mahimahi_ptr, updated last_mahimahi_time
+    """
+    mahimahi_ptr = np.array(mahimahi_ptr, dtype=np.int64)
+    last_mahimahi_time = np.array(last_mahimahi_time, dtype=float)
+    packet_payload_portion = np.broadcast_to(packet_payload_portion, mahimahi_ptr.shape)
+    delay = np.zeros(mahimahi_ptr.shape)
+    video_chunk_counter_sent = np.zeros(mahimahi_ptr.shape)
+    active = np.arange(len(mahimahi_ptr))
+    while len(active) > 0:
+        session_trace = trace_idx[active]
+        session_ptr = mahimahi_ptr[active]
+        session_portion = packet_payload_portion[active]
+        throughput = cooked_bw[session_trace, session_ptr] * B_IN_MB / BITS_IN_BYTE
+        duration = cooked_time[session_trace, session_ptr] - last_mahimahi_time[active]
+
+        packet_payload = throughput * duration * session_portion
+
+        finished = video_chunk_counter_sent[active] + packet_payload > video_chunk_size[active]
+        done = active[finished]
+        fractional_time = (video_chunk_size[done] - video_chunk_counter_sent[done]) / \
+                          throughput[finished] / session_portion[finished]
+        delay[done] += fractional_time
+        last_mahimahi_time[done] += fractional_time
+
+        pending = ~finished
+        active = active[pending]
+        video_chunk_counter_sent[active] += packet_payload[pending]
+        delay[active] += duration[pending]
+        last_mahimahi_time[active] = cooked_time[session_trace[pending], session_ptr[pending]]
+        mahimahi_ptr[active] += 1
+
+        # loop back in the beginning
+        # note: trace file starts with time 0
+        wrapped = active[mahimahi_ptr[active] >= trace_len[trace_idx[active]]]
+        mahimahi_ptr[wrapped] = 1
+        last_mahimahi_time[wrapped] = 0
+    return delay, mahimahi_ptr, last_mahimahi_time
+
+
+def drain_buffers(cooked_time, trace_len, trace_idx, mahimahi_ptr, last_mahimahi_time, sleep_time):
+    """
+    Skips the network for sleep_time ms per session
+    :return: the sleep time left over in the last interval (as returned by Environment), updated mahimahi_ptr,
+    updated last_mahimahi_time
+    """
+    mahimahi_ptr = np.array(mahimahi_ptr, dtype=np.int64)
+    last_mahimahi_time = np.array(last_mahimahi_time, dtype=float)
+    sleep_time = np.array(sleep_time, dtype=float)
+    active = np.flatnonzero(sleep_time > 0)
+    while len(active) > 0:
+        session_trace = trace_idx[active]
+        session_ptr = mahimahi_ptr[active]
+        duration = cooked_time[session_trace, session_ptr] - last_mahimahi_time[active]
+
+        finished = duration > sleep_time[active] / MILLISECONDS_IN_SECOND
+        done = active[finished]
+        last_mahimahi_time[done] += sleep_time[done] / MILLISECONDS_IN_SECOND
+
+        pending = ~finished
+        active = active[pending]
+        sleep_time[active] -= duration[pending] * MILLISECONDS_IN_SECOND
+        last_mahimahi_time[active] = cooked_time[session_trace[pending], session_ptr[pending]]
+        mahimahi_ptr[active] += 1
+
+        wrapped = active[mahimahi_ptr[active] >= trace_len[trace_idx[active]]]
+        mahimahi_ptr[wrapped] = 1
+        last_mahimahi_time[wrapped] = 0
+    return sleep_time, mahimahi_ptr, last_mahimahi_time
+
+
+class BatchEnvironment:
+    """
+    Holds the state of many sessions (one video, one trace per session) and advances all of them by one chunk per
+    call of get_video_chunk. A session that reaches the end of the video restarts on its own trace, it does not move
+    on to the next trace as Environment does.
+    """
+
+    def __init__(self,
+                 all_cooked_time,
+                 all_cooked_bw,
+                 video_information_csv,
+                 trace_indices=None,
+                 mahimahi_start_ptr=None,
+                 video_chunk_limit=None,
+                 BUFFER_THRESH=60.0 * MILLISECONDS_IN_SECOND,
+                 DRAIN_BUFFER_SLEEP_TIME=500.0,
+                 PACKET_PAYLOAD_PORTION=0.95,
+                 LINK_RTT=200,  # millisec,
+                 PACKET_SIZE=1500):
+        """
+        :param all_cooked_time: list of trace time stamps as returned by load_trace
+        :param all_cooked_bw: list of trace bandwidths as returned by load_trace
+        :param video_information_csv: path to the *_video_info file or a VideoManifest
+        :param trace_indices: trace of each session, defaults to one session per trace
+        :param mahimahi_start_ptr: trace pointer at which each session starts, defaults to 1
+        :param video_chunk_limit: number of chunks after which each session ends, defaults to TOTAL_VIDEO_CHUNCK
+        """
+        self.BUFFER_THRESH = BUFFER_THRESH
+        self.DRAIN_BUFFER_SLEEP_TIME = DRAIN_BUFFER_SLEEP_TIME
+        self.PACKET_PAYLOAD_PORTION = PACKET_PAYLOAD_PORTION
+        self.LINK_RTT = LINK_RTT
+        self.PACKET_SIZE = PACKET_SIZE
+        self.cooked_time, self.cooked_bw, self.trace_len = pad_traces(all_cooked_time, all_cooked_bw)
+        if trace_indices is None:
+            trace_indices = np.arange(len(self.trace_len))
+        self.trace_idx = np.array(trace_indices, dtype=np.int64)
+        self.n_sessions = len(self.trace_idx)
+
+        if isinstance(video_information_csv, VideoManifest):
+            self.manifest = video_information_csv
+        else:
+            self.manifest = get_video_manifest(video_information_csv)
+        self.byte_size_match = self.manifest.byte_size
+        self.vmaf_match = self.manifest.vmaf
+        self.bitrate_match = self.manifest.bitrate
+        self.seg_len_s = self.manifest.seg_len_s
+        self.max_quality_level = self.manifest.max_quality_level
+        self.TOTAL_VIDEO_CHUNCK = len(self.bitrate_match) - 1
+
+        if mahimahi_start_ptr is None:
+            mahimahi_start_ptr = 1
+        self.mahimahi_start_ptr = np.broadcast_to(np.asarray(mahimahi_start_ptr, dtype=np.int64),
+                                                  (self.n_sessions,)).copy()
+        assert (self.mahimahi_start_ptr >= 1).all() and \
+               (self.mahimahi_start_ptr < self.trace_len[self.trace_idx]).all(), 'Start pointer outside of the trace'
+        if video_chunk_limit is None:
+            video_chunk_limit = self.TOTAL_VIDEO_CHUNCK
+        self.video_chunk_limit = np.broadcast_to(np.asarray(video_chunk_limit, dtype=np.int64),
+                                                 (self.n_sessions,)).copy()
+        assert (self.video_chunk_limit >= 1).all() and (self.video_chunk_limit <= self.TOTAL_VIDEO_CHUNCK).all(), \
+            'Chunk limit outside of the video'
+        self.reset()
+
+    @classmethod
+    def from_snapshots(cls, environment, snapshots):
+        """
+        Forks an Environment into one session per snapshot, e.g. many hypothetical futures of the same session. Only
+        the traces the snapshots refer to are padded.
+        :param environment: Environment which provides traces, manifest and constants
+        :param snapshots: list of EnvironmentState as returned by Environment.snapshot
+        :return: BatchEnvironment, trace_idx of the sessions refers to the padded subset of traces
+        """
+        trace_ids = sorted(set(int(snapshot.trace_idx) for snapshot in snapshots))
+        trace_rows = {trace_id: row for row, trace_id in enumerate(trace_ids)}
+        batch_environment = cls([environment.all_cooked_time[trace_id] for trace_id in trace_ids],
+                                [environment.all_cooked_bw[trace_id] for trace_id in trace_ids],
+                                environment.manifest,
+                                trace_indices=[trace_rows[int(snapshot.trace_idx)] for snapshot in snapshots],
+                                BUFFER_THRESH=environment.BUFFER_THRESH,
+                                DRAIN_BUFFER_SLEEP_TIME=environment.DRAIN_BUFFER_SLEEP_TIME,
+                                PACKET_PAYLOAD_PORTION=environment.PACKET_PAYLOAD_PORTION,
+                                LINK_RTT=environment.LINK_RTT,
+                                PACKET_SIZE=environment.PACKET_SIZE)
+        batch_environment.restore(EnvironmentState(
+            trace_idx=batch_environment.trace_idx,
+            mahimahi_ptr=[snapshot.mahimahi_ptr for snapshot in snapshots],
+            last_mahimahi_time=[snapshot.last_mahimahi_time for snapshot in snapshots],
+            buffer_size=[snapshot.buffer_size for snapshot in snapshots],
+            video_chunk_counter=[snapshot.video_chunk_counter for snapshot in snapshots]))
+        return batch_environment
+
+    def reset(self):
+        self.video_chunk_counter = np.zeros(self.n_sessions, dtype=np.int64)
+        self.buffer_size = np.zeros(self.n_sessions)
+        self.mahimahi_ptr = self.mahimahi_start_ptr.copy()
+        self.last_mahimahi_time = self.cooked_time[self.trace_idx, self.mahimahi_ptr - 1]
+
+    def snapshot(self):
+        return EnvironmentState(trace_idx=self.trace_idx.copy(),
+                                mahimahi_ptr=self.mahimahi_ptr.copy(),
+                                last_mahimahi_time=self.last_mahimahi_time.copy(),
+                                buffer_size=self.buffer_size.copy(),
+                                video_chunk_counter=self.video_chunk_counter.copy())
+
+    def restore(self, snapshot):
+        """
+        :param snapshot: EnvironmentState with one entry per session, scalars are broadcast to all sessions
+        """
+        shape = (self.n_sessions,)
+        self.trace_idx = np.broadcast_to(np.asarray(snapshot.trace_idx, dtype=np.int64), shape).copy()
+        self.mahimahi_ptr = np.broadcast_to(np.asarray(snapshot.mahimahi_ptr, dtype=np.int64), shape).copy()
+        self.last_mahimahi_time = np.broadcast_to(np.asarray(snapshot.last_mahimahi_time, dtype=float), shape).copy()
+        self.buffer_size = np.broadcast_to(np.asarray(snapshot.buffer_size, dtype=float), shape).copy()
+        self.video_chunk_counter = np.broadcast_to(np.asarray(snapshot.video_chunk_counter, dtype=np.int64),
+                                                   shape).copy()
+
+    def get_vmaf(self, index, quality):
+        return self.vmaf_match[index, quality]
+
+    def get_bitrate(self, index, quality):
+        return self.bitrate_match[index, quality]
+
+    def get_video_chunk(self, quality):
+        """
+        :param quality: quality level of each session
+        :return: the same values as Environment.get_video_chunk, one entry per session
+        """
+        quality = np.asarray(quality, dtype=np.int64)
+        assert quality.shape == (self.n_sessions,)
+        assert (quality >= 0).all()
+
+        video_chunk_size = self.byte_size_match[self.video_chunk_counter, quality]
+
+        delay, self.mahimahi_ptr, self.last_mahimahi_time = download_chunks(
+            self.cooked_time, self.cooked_bw, self.trace_len, self.trace_idx, self.mahimahi_ptr,
+            self.last_mahimahi_time, video_chunk_size, self.PACKET_PAYLOAD_PORTION)
+
+        delay *= MILLISECONDS_IN_SECOND
+        delay += self.LINK_RTT
+
+        # rebuffer time
+        rebuf = np.maximum(delay - self.buffer_size, 0.0)
+
+        # update the buffer
+        self.buffer_size = np.maximum(self.buffer_size - delay, 0.0)
+
+        # add in the new chunk
+        self.buffer_size += self.seg_len_s[self.video_chunk_counter] * 1000.  # buffer size is in ms
+
+        # sleep if buffer gets too large
+        sleep_time = np.zeros(self.n_sessions)
+        exceeded = self.buffer_size > self.BUFFER_THRESH
+        drain_buffer_time = self.buffer_size[exceeded] - self.BUFFER_THRESH
+        sleep_time[exceeded] = np.ceil(drain_buffer_time / self.DRAIN_BUFFER_SLEEP_TIME) * \
+                               self.DRAIN_BUFFER_SLEEP_TIME
+        self.buffer_size[exceeded] -= sleep_time[exceeded]
+        sleep_time, self.mahimahi_ptr, self.last_mahimahi_time = drain_buffers(
+            self.cooked_time, self.trace_len, self.trace_idx, self.mahimahi_ptr, self.last_mahimahi_time,
+            sleep_time)
+
+        return_buffer_size = self.buffer_size.copy()
+
+        self.video_chunk_counter += 1
+        video_chunk_remain = self.video_chunk_limit - self.video_chunk_counter
+
+        end_of_video = self.video_chunk_counter >= self.video_chunk_limit
+        self.buffer_size[end_of_video] = 0
+        self.video_chunk_counter[end_of_video] = 0
+        self.mahimahi_ptr[end_of_video] = self.mahimahi_start_ptr[end_of_video]
+        self.last_mahimahi_time[end_of_video] = self.cooked_time[self.trace_idx[end_of_video],
+                                                                 self.mahimahi_ptr[end_of_video] - 1]
+
+        next_video_chunk_sizes = self.byte_size_match[self.video_chunk_counter]
+
+        return delay, \
+               sleep_time, \
+               return_buffer_size / MILLISECONDS_IN_SECOND, \
+               rebuf / MILLISECONDS_IN_SECOND, \
+               video_chunk_size, \
+               next_video_chunk_sizes, \
+               end_of_video, \
+               video_chunk_remain
@@ -0,0 +1,178 @@
+"""
+Calibration of the network parameters of the simulator (LINK_RTT, PACKET_PAYLOAD_PORTION) against the live sessions in
+Data/FeedbackResults. Every media download of a session (the urls in raw_dataframe.csv) is played again in the offline
+simulator on the trace of its session (the throttle log, see LiveReplay.throttle_log_to_trace), starting at the time
+its request was sent, and the simulated download time is compared with the recorded one. All downloads of all sessions
+and all payload portions of the grid are simulated together in one call of BatchSimulator.download_chunks, the RTT
+only adds a constant to the download time and is evaluated on the simulated transfer times without simulating again.
+
+The recorded download time is wait + receive of the HAR timings in raw_har_file.json, from the request being sent to
+the last byte, which is what the simulator models with the RTT and the transfer. timestamp_finish of raw_dataframe.csv
+is the total time of the HAR entry, it includes blocking, DNS, connect and send, and fitting against it would let
+LINK_RTT absorb the connection setup. Sessions without raw_har_file.json are skipped.
+
+DRAIN_BUFFER_SLEEP_TIME is not fitted: the downloads are anchored at their recorded start times, so the time the
+player waits between downloads doesn't change any download time.
+"""
+
+import glob
+import json
+import logging
+import os
+import sys
+from collections import namedtuple
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from OfflineSimulator.BatchSimulator import pad_traces, download_chunks
+from OfflineSimulator.LiveReplay import THROTTLE_LOG_NAME, throttle_log_to_trace
+from OfflineSimulator.OfflineSimulator import MILLISECONDS_IN_SECOND
+
+RAW_DATAFRAME_NAME = 'raw_dataframe.csv'
+RAW_HAR_NAME = 'raw_har_file.json'
+# HAR timings before the request is sent, the simulator has no connection setup
+SETUP_TIMINGS = ['blocked', 'dns', 'connect', 'send']
+LINK_RTT_GRID = np.arange(0., 401., 10.)  # millisec
+PACKET_PAYLOAD_PORTION_GRID = np.round(np.arange(0.70, 1.001, 0.01), 2)
+
+CalibrationResult = namedtuple('CalibrationResult', ['parameters', 'grid', 'downloads'])
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+def load_downloads(result_folder):
+    """
+    :param result_folder: folder of a live session with a throttle log, a raw_dataframe.csv and a raw_har_file.json
+    :return: cooked_time, cooked_bw of the session and a dataframe with one row per finished media download: the time
+    the request was sent in s since the first line of the throttle log, size in bytes and recorded download time in ms
+    (wait and receive of the HAR timings)
+    """
+    cooked_time, cooked_bw = throttle_log_to_trace(os.path.join(result_folder, THROTTLE_LOG_NAME))
+    throttle_start = pd.read_csv(os.path.join(result_folder, THROTTLE_LOG_NAME), sep='\t', header=None,
+                                 usecols=[0], nrows=1).values[0, 0]
+    # the media requests of the session, the HAR has every request of the page
+    media_urls = set(pd.read_csv(os.path.join(result_folder, RAW_DATAFRAME_NAME), usecols=['url'])['url'])
+    with open(os.path.join(result_folder, RAW_HAR_NAME), 'r') as har_file:
+        har_entries = json.load(har_file)
+    har_entries = [entry for entry in har_entries if entry['request']['url'] in media_urls and
+                   entry['response']['bodySize'] > 0]
+    # timings which don't apply are -1, ssl is part of connect
+    timings = pd.DataFrame([entry['timings'] for entry in har_entries],
+                           columns=SETUP_TIMINGS + ['wait', 'receive']).fillna(-1.).clip(lower=0.)
+    started = (pd.to_datetime(pd.Series([entry['startedDateTime'] for entry in har_entries], dtype=object), utc=True) -
+               pd.Timestamp('1970-01-01', tz='UTC')).dt.total_seconds().values
+    downloads = pd.DataFrame({'result_folder': result_folder,
+                              'start_s': started + timings[SETUP_TIMINGS].sum(axis=1).values /
+                                         MILLISECONDS_IN_SECOND - throttle_start,
+                              'size_byte': np.array([entry['response']['bodySize'] for entry in har_entries],
+                                                    dtype=np.float64),
+                              'measured_ms': (timings['wait'] + timings['receive']).values})
+    # only downloads which started while the network was throttled can be simulated
+    in_trace = (downloads['start_s'] >= 0) & (downloads['start_s'] < cooked_time[-1]) & \
+               (downloads['measured_ms'] > 0)
+    return cooked_time, cooked_bw, downloads[in_trace].reset_index(drop=True)
+
+
+def find_calibration_sessions(root='Data/FeedbackResults/'):
+    """
+    :return: sorted result folders below root with a throttle log, a raw_dataframe.csv and a raw_har_file.json
+    """
+    result_folders = []
+    for raw_dataframe in sorted(glob.glob(os.path.join(glob.escape(root), '**', RAW_DATAFRAME_NAME), recursive=True)):
+        result_folder = os.path.dirname(raw_dataframe)
+        if not os.path.isfile(os.path.join(result_folder, THROTTLE_LOG_NAME)):
+            continue
+        if not os.path.isfile(os.path.join(result_folder, RAW_HAR_NAME)):
+            logger.info('No HAR timings for %s' % result_folder)
+            continue
+        result_folders.append(result_folder)
+    return result_folders
+
+
+def simulate_transfer_times(cooked_time, cooked_bw, trace_len, trace_idx, start_s, size_byte,
+                            packet_payload_portions):
+    """
+    :param trace_idx: trace of every download
+    :param start_s: start of every download on its trace
+    :param size_byte: size of every download
+    :param packet_payload_portions: portions to simulate
+    :return: simulated download times in ms without the RTT (n_portions,n_downloads)
+    """
+    n_downloads = len(start_s)
+    n_portions = len(packet_payload_portions)
+    # interval p of a trace ends at cooked_time[p], the download starts in the interval which contains start_s
+    mahimahi_ptr = np.array([np.searchsorted(cooked_time[trace, :trace_len[trace]], start, side='right')
+                             for trace, start in zip(trace_idx, start_s)], dtype=np.int64)
+    delay, _, _ = download_chunks(cooked_time, cooked_bw, trace_len,
+                                  np.tile(trace_idx, n_portions),
+                                  np.tile(mahimahi_ptr, n_portions),
+                                  np.tile(start_s, n_portions),
+                                  np.tile(size_byte, n_portions),
+                                  np.repeat(packet_payload_portions, n_downloads))
+    return delay.reshape(n_portions, n_downloads) * MILLISECONDS_IN_SECOND
+
+
+def calibrate(root='Data/FeedbackResults/', link_rtt_grid=LINK_RTT_GRID,
+              packet_payload_portion_grid=PACKET_PAYLOAD_PORTION_GRID, loss='mae'):
+    """
+    Grid search over LINK_RTT and PACKET_PAYLOAD_PORTION
+    :param root: folder which is searched for live sessions
+    :param loss: 'mae' (mean absolute error) or 'rmse' of the download times, the parameters with the lowest loss
+    are returned
+    :return: CalibrationResult with the best parameters (keyword arguments of Environment and BatchEnvironment), the
+    loss of every grid point and the downloads with their recorded and simulated download times under the best
+    parameters
+    """
+    assert loss in ['mae', 'rmse'], 'Unknown loss %s' % loss
+    start_time = time()
+    all_cooked_time = []
+    all_cooked_bw = []
+    all_downloads = []
+    for result_folder in find_calibration_sessions(root):
+        cooked_time, cooked_bw, downloads = load_downloads(result_folder)
+        if len(downloads) == 0:
+            logger.info('No downloads to calibrate on in %s' % result_folder)
+            continue
+        all_cooked_time.append(cooked_time)
+        all_cooked_bw.append(cooked_bw)
+        all_downloads.append(downloads.assign(trace_idx=len(all_downloads)))
+    assert len(all_downloads) > 0, 'No live sessions with downloads below %s' % root
+    downloads = pd.concat(all_downloads, ignore_index=True)
+    cooked_time, cooked_bw, trace_len = pad_traces(all_cooked_time, all_cooked_bw)
+
+    link_rtt_grid = np.asarray(link_rtt_grid, dtype=np.float64)
+    packet_payload_portion_grid = np.asarray(packet_payload_portion_grid, dtype=np.float64)
+    transfer_ms = simulate_transfer_times(cooked_time, cooked_bw, trace_len, downloads['trace_idx'].values,
+                                          downloads['start_s'].values, downloads['size_byte'].values,
+                                          packet_payload_portion_grid)
+    # (n_portions,n_rtts,n_downloads)
+    error = transfer_ms[:, None, :] + link_rtt_grid[None, :, None] - downloads['measured_ms'].values[None, None, :]
+    grid = pd.DataFrame({'PACKET_PAYLOAD_PORTION': np.repeat(packet_payload_portion_grid, len(link_rtt_grid)),
+                         'LINK_RTT': np.tile(link_rtt_grid, len(packet_payload_portion_grid)),
+                         'mae': np.abs(error).mean(axis=2).ravel(),
+                         'rmse': np.sqrt((error ** 2).mean(axis=2)).ravel(),
+                         'bias': error.mean(axis=2).ravel()})
+    best = int(np.argmin(grid[loss].values))
+    best_portion, best_rtt = np.unravel_index(best, (len(packet_payload_portion_grid), len(link_rtt_grid)))
+    parameters = {'LINK_RTT': float(link_rtt_grid[best_rtt]),
+                  'PACKET_PAYLOAD_PORTION': float(packet_payload_portion_grid[best_portion])}
+    downloads['simulated_ms'] = transfer_ms[best_portion] + parameters['LINK_RTT']
+    logger.info('Calibrated on %d downloads of %d sessions: %s with %s %.1f ms, took %.2f' % (
+        len(downloads), len(all_downloads), parameters, loss, grid[loss].values[best], time() - start_time))
+    return CalibrationResult(parameters=parameters, grid=grid, downloads=downloads.drop(columns='trace_idx'))
+
+
+if __name__ == '__main__':
+    # python -m OfflineSimulator.Calibration Data/FeedbackResults/
+    calibration = calibrate(root=sys.argv[1] if len(sys.argv) > 1 else 'Data/FeedbackResults/')
+    logger.info('Environment parameters %s' % calibration.parameters)
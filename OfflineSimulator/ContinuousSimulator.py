@@ -0,0 +1,106 @@
+"""
+Offline simulation of providers which request byte ranges instead of chunks (YouTube, Facebook). The range mapper maps
+the playback time of every frame to a byte offset per quality level, a request covers range_request_s of playback from
+the current position. Downloads use the same trace walk and buffer model as Environment.
+"""
+
+import numpy as np
+
+from OfflineSimulator.ManifestRegistry import get_range_mapper
+from OfflineSimulator.OfflineSimulator import Environment, MILLISECONDS_IN_SECOND
+from OfflineSimulator.VideoManifest import RangeMapper
+
+
+class ContinuousEnvironment(Environment):
+
+    def __init__(self,
+                 all_cooked_time,
+                 all_cooked_bw,
+                 video_information_csv,
+                 video_range_mapper,
+                 range_request_s=5.,
+                 **environment_parameters):
+        """
+        :param video_information_csv: path to the *_video_info file or a VideoManifest, provides vmaf and bitrate
+        :param video_range_mapper: path to the *_video_info_range_mapper file or a RangeMapper
+        :param range_request_s: playback time covered by one request
+        :param environment_parameters: passed on to Environment (BUFFER_THRESH, LINK_RTT, ...)
+        """
+        super().__init__(all_cooked_time, all_cooked_bw, video_information_csv, **environment_parameters)
+        if isinstance(video_range_mapper, RangeMapper):
+            self.range_mapper = video_range_mapper
+        else:
+            self.range_mapper = get_range_mapper(video_range_mapper)
+        assert self.range_mapper.n_levels == self.max_quality_level + 1, 'Range mapper and video info do not match'
+        self.range_request_s = range_request_s
+        self.video_duration = self.range_mapper.video_duration
+        self.play_position_s = 0.
+        self.video_segment = 0
+        self.last_range = None
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.play_position_s = state.get('play_position_s', 0.)
+
+    def save_state(self):
+        state = super().save_state()
+        state['play_position_s'] = self.play_position_s
+        return state
+
+    def get_range(self, quality, play_position_s, range_request_s):
+        """
+        :return: t_start, t_end, byte_start, byte_end of the range covering range_request_s from play_position_s
+        """
+        time_s = self.range_mapper.time_s[quality]
+        byte_offset = self.range_mapper.byte_offset[quality]
+        frame_start = self.range_mapper.map_time_to_frame(play_position_s, quality)
+        frame_end = max(self.range_mapper.map_time_to_frame(play_position_s + range_request_s, quality),
+                        min(frame_start + 1, len(time_s) - 1))
+        return time_s[frame_start], time_s[frame_end], byte_offset[frame_start], byte_offset[frame_end]
+
+    def get_video_chunk(self, quality, range_request_s=None):
+        """
+        Downloads the next byte range
+        :param quality: quality level of the range
+        :param range_request_s: playback time covered by the range, defaults to range_request_s of the environment
+        :return: the same values as Environment.get_video_chunk, video_chunk_size is the size of the range and
+        video_chunk_remain the number of ranges left
+        """
+        assert quality >= 0
+        if range_request_s is None:
+            range_request_s = self.range_request_s
+
+        t_start, t_end, byte_start, byte_end = self.get_range(quality, self.play_position_s, range_request_s)
+        video_chunk_size = byte_end - byte_start
+
+        delay, sleep_time, rebuf = self.download_video(video_chunk_size, t_end - t_start)
+
+        return_buffer_size = self.buffer_size
+        self.last_range = (quality, t_start, t_end, byte_start, byte_end)
+        self.video_segment = min(np.searchsorted(self.manifest.time_s, t_start), self.manifest.n_chunks - 1)
+        self.play_position_s = t_end
+
+        self.video_chunk_counter += 1
+        video_chunk_remain = int(np.ceil((self.video_duration - self.play_position_s) / range_request_s))
+
+        end_of_video = False
+        if self.play_position_s >= self.video_duration:
+            end_of_video = True
+            self.buffer_size = 0
+            self.video_chunk_counter = 0
+            self.play_position_s = 0.
+            self.next_trace()
+
+        next_video_chunk_sizes = []
+        for level in range(self.max_quality_level + 1):
+            _, _, next_byte_start, next_byte_end = self.get_range(level, self.play_position_s, range_request_s)
+            next_video_chunk_sizes.append(next_byte_end - next_byte_start)
+
+        return delay, \
+               sleep_time, \
+               return_buffer_size / MILLISECONDS_IN_SECOND, \
+               rebuf / MILLISECONDS_IN_SECOND, \
+               video_chunk_size, \
+               next_video_chunk_sizes, \
+               end_of_video, \
+               video_chunk_remain
@@ -0,0 +1,147 @@
+"""
+FastMPC style decision tables. The robust MPC decision only depends on the chunk index, the last level, the buffer and
+the predicted bandwidth, the compiler solves the lookahead for every point of a buffer x bandwidth grid once per video
+and MPC looks the decisions up instead of solving them for every chunk of every trace.
+"""
+
+import json
+import logging
+import os
+from time import time
+
+import numpy as np
+
+from OfflineSimulator.LookaheadSolver import VectorizedLookahead
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.VideoManifest import VideoManifest
+
+BUFFER_GRID_S = np.linspace(0., 60., 61)
+BANDWIDTH_GRID_MBIT = np.geomspace(0.05, 100., 96)
+STATES_PER_BLOCK = 256  # keeps the node arrays of lookahead 5 with 6 levels at ~16 MB
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+def describe_reward_function(reward_function):
+    parameters = {key: value for key, value in vars(reward_function).items() if not key.startswith('_')}
+    return json.dumps({'name': type(reward_function).__name__, 'parameters': parameters}, sort_keys=True, default=str)
+
+
+class DecisionTable:
+
+    def __init__(self, decisions, buffer_grid, bandwidth_grid, lookahead, reward_function_description='',
+                 source_mtime_ns=0):
+        """
+        :param decisions: quality level per (chunk, last level, buffer grid point, bandwidth grid point)
+        :param buffer_grid: buffer values (as passed to the solver) of the grid
+        :param bandwidth_grid: predicted bandwidth in Mbit/s of the grid
+        """
+        self.decisions = decisions
+        self.buffer_grid = np.asarray(buffer_grid, dtype=float)
+        self.bandwidth_grid = np.asarray(bandwidth_grid, dtype=float)
+        self.lookahead = int(lookahead)
+        self.reward_function_description = str(reward_function_description)
+        self.source_mtime_ns = int(source_mtime_ns)
+        # values are mapped to the closest grid point, the bandwidth on a log scale
+        self.buffer_edges = (self.buffer_grid[1:] + self.buffer_grid[:-1]) / 2.
+        self.bandwidth_edges = np.sqrt(self.bandwidth_grid[1:] * self.bandwidth_grid[:-1])
+        self.n_checked = 0
+        self.n_agreed = 0
+
+    @property
+    def nbytes(self):
+        return self.decisions.nbytes + self.buffer_grid.nbytes + self.bandwidth_grid.nbytes
+
+    def lookup(self, video_chunk_counter, last_level, current_buffer, future_bandwidth):
+        buffer_index = np.searchsorted(self.buffer_edges, current_buffer)
+        bandwidth_index = np.searchsorted(self.bandwidth_edges, future_bandwidth)
+        return self.decisions[video_chunk_counter, last_level, buffer_index, bandwidth_index]
+
+    def record_check(self, table_level, exact_level):
+        self.n_checked += 1
+        self.n_agreed += int(table_level == exact_level)
+
+    def agreement(self):
+        if self.n_checked == 0:
+            return np.nan
+        return self.n_agreed / self.n_checked
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder != '' and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path + '.tmp', 'wb') as table_file:
+            np.savez_compressed(table_file, decisions=self.decisions, buffer_grid=self.buffer_grid,
+                                bandwidth_grid=self.bandwidth_grid, lookahead=self.lookahead,
+                                reward_function_description=self.reward_function_description,
+                                source_mtime_ns=self.source_mtime_ns)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as table_file:
+            return cls(table_file['decisions'], table_file['buffer_grid'], table_file['bandwidth_grid'],
+                       table_file['lookahead'], table_file['reward_function_description'],
+                       table_file['source_mtime_ns'])
+
+    def matches(self, reward_function, lookahead, buffer_grid, bandwidth_grid, source_mtime_ns):
+        return self.reward_function_description == describe_reward_function(reward_function) and \
+               self.lookahead == lookahead and \
+               self.source_mtime_ns == source_mtime_ns and \
+               np.array_equal(self.buffer_grid, buffer_grid) and \
+               np.array_equal(self.bandwidth_grid, bandwidth_grid)
+
+
+def compile_decision_table(video_information_csv, reward_function, lookahead, buffer_grid=BUFFER_GRID_S,
+                           bandwidth_grid=BANDWIDTH_GRID_MBIT):
+    """
+    Solves the lookahead for every chunk, last level and grid point
+    :param video_information_csv: path to the *_video_info file or a VideoManifest
+    :return: DecisionTable
+    """
+    start_time = time()
+    if isinstance(video_information_csv, VideoManifest):
+        manifest = video_information_csv
+    else:
+        manifest = get_video_manifest(video_information_csv)
+    assert manifest.n_levels <= np.iinfo(np.uint8).max
+    buffer_states, bandwidth_states = [grid.ravel() for grid in np.meshgrid(buffer_grid, bandwidth_grid,
+                                                                            indexing='ij')]
+    solver = VectorizedLookahead()
+    block_size = max(1, STATES_PER_BLOCK * 6 ** 5 // manifest.n_levels ** lookahead)
+    decisions = np.empty((manifest.n_chunks, manifest.n_levels, len(buffer_states)), dtype=np.uint8)
+    for video_chunk_counter in range(manifest.n_chunks):
+        for start in range(0, len(buffer_states), block_size):
+            decisions[video_chunk_counter, :, start:start + block_size] = solver.solve_states(
+                manifest, reward_function, lookahead, video_chunk_counter,
+                bandwidth_states[start:start + block_size], buffer_states[start:start + block_size])
+    decisions = decisions.reshape(manifest.n_chunks, manifest.n_levels, len(buffer_grid), len(bandwidth_grid))
+    source_mtime_ns = os.stat(manifest.path).st_mtime_ns if os.path.exists(manifest.path) else 0
+    logger.info('Compiled decision table for %s in %.2f s' % (manifest.path, time() - start_time))
+    return DecisionTable(decisions, buffer_grid, bandwidth_grid, lookahead,
+                         describe_reward_function(reward_function), source_mtime_ns)
+
+
+def load_decision_table(path, video_information_csv, reward_function, lookahead, buffer_grid=BUFFER_GRID_S,
+                        bandwidth_grid=BANDWIDTH_GRID_MBIT):
+    """
+    Loads the table from path, it is compiled (and saved) if it is missing or doesn't match the arguments
+    """
+    source_mtime_ns = os.stat(video_information_csv).st_mtime_ns
+    if os.path.exists(path):
+        decision_table = DecisionTable.load(path)
+        if decision_table.matches(reward_function, lookahead, buffer_grid, bandwidth_grid, source_mtime_ns):
+            return decision_table
+        logger.info('Decision table %s is stale' % path)
+    decision_table = compile_decision_table(video_information_csv, reward_function, lookahead, buffer_grid,
+                                            bandwidth_grid)
+    decision_table.save(path)
+    return decision_table
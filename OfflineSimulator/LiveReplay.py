@@ -0,0 +1,176 @@
+"""
+Counterfactual replay of the live sessions in Data/FeedbackResults. The throttle log of a session is the network the
+provider saw, it is turned into a trace. The quality levels the provider chose (inorder_dataframe.csv) and the
+decisions of MPC are both played over that trace in the offline simulator, so the provider and MPC are compared on the
+same network. All sessions of a video are simulated together in one BatchEnvironment.
+
+Result folders are named video_<video_id>_<trace id> (see MainMethods.RESULT_PATH_TEMPLATE), the video id is the
+longest id of the provider's video information which matches the folder name.
+"""
+
+import glob
+import logging
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from OfflineSimulator.BatchSimulator import BatchEnvironment
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.MonteCarlo import MPCPolicy, run_windows
+
+THROTTLE_LOG_NAME = 'throttle_logging.tc'
+INORDER_DATAFRAME_NAME = 'inorder_dataframe.csv'
+VIDEO_INFORMATION_SUFFIX = '_video_info'
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+def throttle_log_to_trace(path):
+    """
+    The throttle log has a line (unix time, bandwidth in Mbit/s) whenever the throttle changed and a last line when
+    it was stopped. In a trace interval p ends at cooked_time[p] and has bandwidth cooked_bw[p], so the bandwidth set
+    at a line holds for the interval which ends at the next line.
+    :return: cooked_time (s since the first line), cooked_bw (Mbit/s)
+    """
+    throttle_log = pd.read_csv(path, sep='\t', names=['time_stamp', 'bw_mbit'])
+    time_stamp = throttle_log['time_stamp'].values.astype(np.float64)
+    bw_mbit = throttle_log['bw_mbit'].values.astype(np.float64)
+    assert len(time_stamp) >= 2, '%s needs at least two lines' % path
+    cooked_time = time_stamp - time_stamp[0]
+    cooked_bw = np.concatenate([bw_mbit[:1], bw_mbit[:-1]])
+    return cooked_time, cooked_bw
+
+
+def recorded_levels(inorder_dataframe_csv, n_chunks):
+    """
+    :param n_chunks: number of chunks the simulator can play
+    :return: quality level per chunk (n_chunks,) and the number of chunks the session reached. If a chunk was
+    downloaded more than once the last download counts, chunks which weren't downloaded keep the level of the chunk
+    before them
+    """
+    recorded = pd.read_csv(inorder_dataframe_csv, usecols=['timestamp_start', 'n_segment', 'quality_level_chosen'])
+    recorded = recorded.sort_values('timestamp_start', kind='mergesort').drop_duplicates('n_segment', keep='last')
+    n_segment = recorded['n_segment'].values.astype(np.int64)
+    in_video = (n_segment >= 0) & (n_segment < n_chunks)
+    levels = np.full(n_chunks, -1, dtype=np.int64)
+    levels[n_segment[in_video]] = recorded['quality_level_chosen'].values[in_video].astype(np.int64)
+    filled = np.flatnonzero(levels >= 0)
+    if len(filled) == 0:
+        return levels, 0
+    # every chunk takes the level of the closest downloaded chunk before it (after it for the leading chunks)
+    previous = np.maximum(np.searchsorted(filled, np.arange(n_chunks), side='right') - 1, 0)
+    levels = levels[filled[previous]]
+    return levels, int(filled[-1]) + 1
+
+
+def find_video_information(result_folder, video_information_root='Data/VideoInformation/'):
+    """
+    :param result_folder: Data/FeedbackResults/<Provider>/<ScreenResolution>/<Model>/<ModelInstance>/video_<...>
+    :return: path of the *_video_info file of the session, None if there is none
+    """
+    provider = os.path.relpath(result_folder).split(os.sep)
+    provider = provider[provider.index('FeedbackResults') + 1] if 'FeedbackResults' in provider else provider[-5]
+    folder_name = os.path.basename(os.path.normpath(result_folder))
+    candidates = [os.path.basename(path)[:-len(VIDEO_INFORMATION_SUFFIX)] for path in
+                  glob.glob(os.path.join(glob.escape(video_information_root), provider + '_Info',
+                                         '*' + VIDEO_INFORMATION_SUFFIX))]
+    matches = [video_id for video_id in candidates if folder_name.startswith('video_%s_' % video_id)]
+    if len(matches) == 0:
+        return None
+    return os.path.join(video_information_root, provider + '_Info',
+                        max(matches, key=len) + VIDEO_INFORMATION_SUFFIX)
+
+
+def find_live_sessions(root='Data/FeedbackResults/', video_information_root='Data/VideoInformation/'):
+    """
+    :return: dataframe with the result folder and the video information of every session which has a throttle log
+    and an inorder_dataframe.csv
+    """
+    sessions = []
+    for throttle_log in sorted(glob.glob(os.path.join(glob.escape(root), '**', THROTTLE_LOG_NAME), recursive=True)):
+        result_folder = os.path.dirname(throttle_log)
+        if not os.path.isfile(os.path.join(result_folder, INORDER_DATAFRAME_NAME)):
+            continue
+        video_information_csv = find_video_information(result_folder, video_information_root)
+        if video_information_csv is None:
+            logger.info('No video information for %s' % result_folder)
+            continue
+        sessions.append((result_folder, video_information_csv))
+    return pd.DataFrame(sessions, columns=['result_folder', 'video_information_csv'])
+
+
+def replay_video_sessions(result_folders, video_information_csv, reward_function, mpc_parameters=None,
+                          **environment_parameters):
+    """
+    Replays the sessions of one video
+    :param mpc_parameters: keyword arguments of MonteCarlo.MPCPolicy (last_n_probes, lookahead, robust, ...)
+    :param environment_parameters: passed on to BatchEnvironment (LINK_RTT, PACKET_PAYLOAD_PORTION, ...)
+    :return: dataframe with one row per replayed session and the results of the provider and of MPC
+    """
+    manifest = get_video_manifest(video_information_csv)
+    n_chunks = manifest.n_chunks - 1
+    all_cooked_time = []
+    all_cooked_bw = []
+    all_levels = []
+    video_chunk_limit = []
+    replayed_folders = []
+    for result_folder in result_folders:
+        levels, n_recorded = recorded_levels(os.path.join(result_folder, INORDER_DATAFRAME_NAME), n_chunks)
+        if n_recorded == 0:
+            logger.info('No chunks recorded in %s' % result_folder)
+            continue
+        cooked_time, cooked_bw = throttle_log_to_trace(os.path.join(result_folder, THROTTLE_LOG_NAME))
+        all_cooked_time.append(cooked_time)
+        all_cooked_bw.append(cooked_bw)
+        all_levels.append(levels)
+        video_chunk_limit.append(n_recorded)
+        replayed_folders.append(result_folder)
+    if len(replayed_folders) == 0:
+        return pd.DataFrame()
+    all_levels = np.array(all_levels)
+    batch_environment = BatchEnvironment(all_cooked_time, all_cooked_bw, manifest,
+                                         video_chunk_limit=video_chunk_limit, **environment_parameters)
+
+    def recorded_policy(environment, observation):
+        return all_levels[np.arange(environment.n_sessions), environment.video_chunk_counter]
+
+    provider = run_windows(batch_environment, recorded_policy, reward_function, first_level=all_levels[:, 0])
+    mpc = run_windows(batch_environment, MPCPolicy(reward_function, **(mpc_parameters or {})), reward_function)
+    replay = pd.DataFrame({'result_folder': replayed_folders,
+                           'video_information_csv': video_information_csv,
+                           'n_chunks': provider['n_chunks'].values})
+    for name, results in [('provider', provider), ('mpc', mpc)]:
+        for column in ['qoe', 'mean_reward', 'rebuffer_s', 'mean_bitrate_mbit', 'mean_vmaf', 'n_switches']:
+            replay['%s_%s' % (name, column)] = results[column].values
+    return replay
+
+
+def replay_live_sessions(reward_function, root='Data/FeedbackResults/', video_information_root='Data/VideoInformation/',
+                         mpc_parameters=None, **environment_parameters):
+    """
+    Replays every live session below root, see replay_video_sessions
+    :return: dataframe with one row per session
+    """
+    start_time = time()
+    sessions = find_live_sessions(root, video_information_root)
+    replays = []
+    for video_information_csv, video_sessions in sessions.groupby('video_information_csv', sort=True):
+        replays.append(replay_video_sessions(video_sessions['result_folder'].tolist(), video_information_csv,
+                                             reward_function, mpc_parameters, **environment_parameters))
+    replays = [replay for replay in replays if len(replay) > 0]
+    if len(replays) == 0:
+        return pd.DataFrame()
+    replays = pd.concat(replays, ignore_index=True)
+    logger.info('Replayed %d live sessions of %d videos, took %.2f' % (
+        len(replays), replays['video_information_csv'].nunique(), time() - start_time))
+    return replays
@@ -0,0 +1,190 @@
+"""
+Vectorized version of MPC.solve_lookahead. The search tree is expanded one depth at a time, every node of a depth is
+one entry of a NumPy array, and the values are reduced back to the root with the same operations as the recursion
+(node value = reward + max over the values of its children), so decisions and values are identical.
+"""
+
+import numpy as np
+
+
+class VectorizedLookahead:
+
+    def __init__(self):
+        self.tables = {}
+
+    def get_tables(self, n_levels, depth):
+        """
+        :return: parent node and level of every node of the given depth, nodes are in the order of the recursion
+        """
+        if (n_levels, depth) not in self.tables:
+            self.tables[(n_levels, depth)] = (np.repeat(np.arange(n_levels ** depth), n_levels),
+                                              np.tile(np.arange(n_levels), n_levels ** depth))
+        return self.tables[(n_levels, depth)]
+
+    def solve(self, net_env, reward_function, lookahead, last_level, future_bandwidth, current_buffer):
+        """
+        Same arguments and return values as MPC.solve_lookahead with index=0
+        """
+        n_levels = net_env.max_quality_level + 1
+        depth = min(lookahead, net_env.manifest.n_chunks - net_env.video_chunk_counter)
+        if depth <= 0:
+            return 0, 0
+        current_iterator = max([net_env.video_chunk_counter - 1, 0])
+
+        all_rewards = []
+        buffer = np.array([current_buffer], dtype=float)
+        node_level = np.array([last_level])
+        for index in range(depth):
+            current_counter = net_env.video_chunk_counter + index
+            parent, next_level = self.get_tables(n_levels, index)
+            size_mbit = 8e-6 * net_env.byte_size_match[current_counter]
+            delay = (size_mbit / future_bandwidth)[next_level]
+            next_buffer = buffer[parent] - delay
+            # same as clamping negative buffers to 0 in the recursion, a nan buffer stays nan without rebuffering
+            rebuf = np.fmax(-next_buffer, 0.)
+            next_buffer = np.maximum(next_buffer, 0.)
+            next_buffer += net_env.manifest.seg_len_s[current_counter] * 1000.
+            all_rewards.append(reward_function.return_reward_batch(net_env.manifest, current_iterator,
+                                                                   node_level[parent], next_level, rebuf))
+            buffer = next_buffer
+            node_level = next_level
+
+        value = all_rewards[-1]
+        for rewards in all_rewards[-2::-1]:
+            value = rewards + value.reshape(-1, n_levels).max(axis=1)
+        return np.max(value), np.argmax(value)
+
+
+    def solve_states(self, manifest, reward_function, lookahead, video_chunk_counter, future_bandwidth,
+                     current_buffer):
+        """
+        Solves many (bandwidth, buffer) states of the same chunk at once and for every last level. The subtrees below
+        the first chunk don't depend on the last level, they are evaluated once.
+        :param manifest: VideoManifest
+        :param future_bandwidth: predicted bandwidth per state
+        :param current_buffer: buffer per state
+        :return: decisions (n_levels,n_states), the same as solve for every last level and state
+        """
+        n_levels = manifest.n_levels
+        future_bandwidth = np.asarray(future_bandwidth, dtype=float)[:, None]
+        n_states = len(future_bandwidth)
+        depth = min(lookahead, manifest.n_chunks - video_chunk_counter)
+        if depth <= 0:
+            return np.zeros((n_levels, n_states), dtype=np.int64)
+        current_iterator = max([video_chunk_counter - 1, 0])
+
+        all_rewards = []
+        first_rebuf = None
+        buffer = np.asarray(current_buffer, dtype=float)[:, None]
+        node_level = None
+        for index in range(depth):
+            current_counter = video_chunk_counter + index
+            parent, next_level = self.get_tables(n_levels, index)
+            size_mbit = 8e-6 * manifest.byte_size[current_counter]
+            delay = (size_mbit[None, :] / future_bandwidth)[:, next_level]
+            next_buffer = buffer[:, parent] - delay
+            rebuf = np.fmax(-next_buffer, 0.)
+            next_buffer = np.maximum(next_buffer, 0.)
+            next_buffer += manifest.seg_len_s[current_counter] * 1000.
+            if index == 0:
+                first_rebuf = rebuf
+            else:
+                all_rewards.append(reward_function.return_reward_batch(manifest, current_iterator,
+                                                                       node_level[parent][None, :],
+                                                                       next_level[None, :], rebuf))
+            buffer = next_buffer
+            node_level = next_level
+
+        # value of the subtree below every level of the first chunk
+        subtree_value = 0
+        if all_rewards:
+            value = all_rewards[-1]
+            for rewards in all_rewards[-2::-1]:
+                value = rewards + value.reshape(n_states, -1, n_levels).max(axis=2)
+            subtree_value = value.reshape(n_states, n_levels, n_levels).max(axis=2)
+
+        decisions = np.empty((n_levels, n_states), dtype=np.int64)
+        first_level = np.arange(n_levels)[None, :]
+        for last_level in range(n_levels):
+            value = reward_function.return_reward_batch(manifest, current_iterator, last_level, first_level,
+                                                        first_rebuf) + subtree_value
+            decisions[last_level] = np.argmax(value, axis=1)
+        return decisions
+
+
+class BranchAndBoundLookahead:
+    """
+    Exact depth first search with pruning for long horizons. The reward of the remaining chunks is bounded by the best
+    path through the rewards without rebuffering (admissible as long as rebuffering never increases the reward), a
+    branch is only cut if its bound is below the best value found by more than eps. Children are visited in the
+    order of their bounds, values and tie breaking are the same as in the recursion.
+    """
+
+    def __init__(self, eps=1e-6):
+        self.eps = eps
+        # nodes expanded by the last solve and by all solves since total_nodes_expanded was reset (MPC.evaluate_video
+        # resets it for every session)
+        self.nodes_expanded = 0
+        self.total_nodes_expanded = 0
+        self.fallback = VectorizedLookahead()
+
+    def solve(self, net_env, reward_function, lookahead, last_level, future_bandwidth, current_buffer):
+        """
+        Same arguments and return values as MPC.solve_lookahead with index=0, the number of expanded nodes is kept
+        in nodes_expanded
+        """
+        self.nodes_expanded = 0
+        n_levels = net_env.max_quality_level + 1
+        depth = min(lookahead, net_env.manifest.n_chunks - net_env.video_chunk_counter)
+        if depth <= 0:
+            return 0, 0
+        self.manifest = net_env.manifest
+        self.current_iterator = max([net_env.video_chunk_counter - 1, 0])
+        self.levels = np.arange(n_levels)
+        self.reward_function = reward_function
+        counters = net_env.video_chunk_counter + np.arange(depth)
+        self.delay = (8e-6 * net_env.byte_size_match[counters]) / future_bandwidth
+        self.seg_len_ms = net_env.manifest.seg_len_s[counters] * 1000.
+
+        no_rebuffer_reward = reward_function.return_reward_batch(self.manifest, self.current_iterator,
+                                                                 self.levels[:, None], self.levels[None, :], 0.)
+        if not np.isfinite(no_rebuffer_reward).all() or not np.isfinite(self.delay).all():
+            # nan values need the exact nan propagation of the exhaustive search
+            return self.fallback.solve(net_env, reward_function, lookahead, last_level, future_bandwidth,
+                                       current_buffer)
+        # best reward of the next k chunks without rebuffering, per level of the last chunk
+        self.bounds = [np.zeros(n_levels)]
+        for _ in range(depth):
+            self.bounds.append(np.max(no_rebuffer_reward + self.bounds[-1][None, :], axis=1))
+
+        values = self.expand(0, depth, last_level, current_buffer, -np.inf)
+        self.total_nodes_expanded += self.nodes_expanded
+        return np.max(values), np.argmax(values)
+
+    def expand(self, index, depth, last_level, current_buffer, alpha):
+        """
+        :param alpha: the exact values are only needed if the node can reach alpha
+        :return: values of the children, exact if the node reaches alpha, otherwise all of them are below alpha
+        """
+        self.nodes_expanded += 1
+        next_buffer = current_buffer - self.delay[index]
+        rebuf = np.fmax(-next_buffer, 0.)
+        next_buffer = np.maximum(next_buffer, 0.)
+        next_buffer += self.seg_len_ms[index]
+        rewards = self.reward_function.return_reward_batch(self.manifest, self.current_iterator, last_level,
+                                                           self.levels, rebuf)
+        if depth == 1:
+            return rewards + 0
+
+        bound = rewards + self.bounds[depth - 1]
+        values = np.full(len(rewards), -np.inf)
+        best = -np.inf
+        for next_level in np.argsort(-bound, kind='stable'):
+            threshold = max(alpha, best)
+            if bound[next_level] < threshold - self.eps:
+                break
+            child_values = self.expand(index + 1, depth - 1, next_level, next_buffer[next_level],
+                                       threshold - rewards[next_level] - self.eps)
+            values[next_level] = rewards[next_level] + np.max(child_values)
+            best = max(best, values[next_level])
+        return values
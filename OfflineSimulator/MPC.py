@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 from abc import abstractmethod
@@ -6,7 +7,13 @@ from time import time
 
 import numpy as np
 
+from OfflineSimulator.FastMPC import load_decision_table
+from OfflineSimulator.LookaheadSolver import VectorizedLookahead, BranchAndBoundLookahead
 from OfflineSimulator.OfflineSimulator import Environment, load_trace
+from OfflineSimulator.SessionCache import describe_mpc, file_digest
+from OfflineSimulator.SessionLog import CompletionLedger, SessionLogWriter, format_log_line, parse_log_line
+from OfflineSimulator.StageTimer import NULL_STAGE_TIMER, StageTimer
+from OfflineSimulator.ThroughputPredictor import make_predictor
 
 
 class RewardFunction:
@@ -15,6 +22,46 @@ class RewardFunction:
     def return_reward(self, enviroment_state):
         pass
 
+    def return_reward_batch(self, manifest, chunk_index, last_level, current_level, rebuffering):
+        """
+        Array interface, all arguments broadcast against each other. The last level refers to the chunk before
+        chunk_index (the same chunk indices as MPC.evaluate_video), the default builds the dict of return_reward from
+        the manifest arrays, reward functions which split into tensors override it
+        :param manifest: VideoManifest of the video
+        :param chunk_index: index of the current chunk
+        :param last_level: quality level of the previous chunk
+        :param current_level: quality level of the current chunk
+        :param rebuffering: rebuffering in s
+        :return: reward per element
+        """
+        last_index = np.maximum(np.asarray(chunk_index) - 1, 0)
+        enviroment_state = {'last_vmaf': manifest.vmaf[last_index, last_level],
+                            'current_vmaf': manifest.vmaf[chunk_index, current_level],
+                            'last_bitrate': manifest.bitrate[last_index, last_level],
+                            'current_bitrate': manifest.bitrate[chunk_index, current_level],
+                            'rebuffering': rebuffering,
+                            'chunk_len_s': manifest.seg_len_s[chunk_index]
+                            }
+        return self.return_reward(enviroment_state)
+
+    def get_reward_tensors(self, manifest):
+        """
+        :return: cached result of compute_reward_tensors for the manifest
+        """
+        cache = self.__dict__.setdefault('_reward_tensors', {})
+        if manifest.path not in cache or cache[manifest.path][0] is not manifest:
+            cache[manifest.path] = (manifest, self.compute_reward_tensors(manifest))
+        return cache[manifest.path][1]
+
+    def compute_reward_tensors(self, manifest):
+        raise NotImplementedError()
+
+    def __getstate__(self):
+        # the tensors are rebuilt on demand, e.g. after sending the reward function to a worker
+        state = self.__dict__.copy()
+        state.pop('_reward_tensors', None)
+        return state
+
 
 class BitrateQoE(RewardFunction):
 
@@ -31,6 +78,23 @@ class BitrateQoE(RewardFunction):
                                                     enviroment_state['last_bitrate']) * 1e-6
         return reward
 
+    def compute_reward_tensors(self, manifest):
+        """
+        :return: quality (n_chunks,n_levels) and smoothing penalty (n_chunks,last level,current level), evaluated
+        with the same operations as return_reward
+        """
+        last_bitrate = manifest.bitrate[np.maximum(np.arange(manifest.n_chunks) - 1, 0)]
+        quality = manifest.bitrate * 1e-6 * (manifest.seg_len_s / self.reference_len_chunk_s)[:, None]
+        smoothing_penalty = self.smoothing_penality * np.abs(manifest.bitrate[:, None, :] -
+                                                             last_bitrate[:, :, None]) * 1e-6
+        return quality, smoothing_penalty
+
+    def return_reward_batch(self, manifest, chunk_index, last_level, current_level, rebuffering):
+        quality, smoothing_penalty = self.get_reward_tensors(manifest)
+        return quality[chunk_index, current_level] \
+               - self.rebuffer_penalty * rebuffering \
+               - smoothing_penalty[chunk_index, last_level, current_level]
+
 
 class VMAFQoE(BitrateQoE):
     """
@@ -49,6 +113,12 @@ class VMAFQoE(BitrateQoE):
                                                     enviroment_state['last_vmaf'])
         return reward
 
+    def compute_reward_tensors(self, manifest):
+        last_vmaf = manifest.vmaf[np.maximum(np.arange(manifest.n_chunks) - 1, 0)]
+        quality = manifest.vmaf * (manifest.seg_len_s / self.reference_len_chunk_s)[:, None]
+        smoothing_penalty = self.smoothing_penality * np.abs(manifest.vmaf[:, None, :] - last_vmaf[:, :, None])
+        return quality, smoothing_penalty
+
 
 M_IN_K = 1000.0
 
@@ -73,14 +143,52 @@ class MPC:
                  reward_function: RewardFunction,
                  last_n_probes,
                  lookahead=5,
-                 robust=True):
+                 robust=True,
+                 trace_store=None,
+                 solver='vectorized',
+                 check_table=False,
+                 log_format='text',
+                 predictor='harmonic',
+                 predictor_parameters=None,
+                 timing=False,
+                 session_cache=None):
         """
         :param name: Name under which the results get saved eventually
         :param reward_function: For which reward function do we optimize
         :param last_n_probes: How many samples are included in the rate prediction
         :param lookahead: How far do we plan ahead
         :param robust: is the estimate robust (as defined in the original MPC paper)
+        :param predictor: throughput predictor, key of ThroughputPredictor.PREDICTORS ('harmonic', 'ewma',
+        'percentile'), the harmonic mean of the last 5 samples is the one of the original MPC
+        :param predictor_parameters: passed on to the predictor (window, alpha, percentile)
+        :param trace_store: TraceStore from which the traces are mapped instead of parsing them for every video
+        :param solver: 'vectorized' evaluates the whole lookahead tree with NumPy, 'recursive' is the original
+        solve_lookahead (needed for reward functions which can't handle arrays), 'branch_and_bound' prunes the tree
+        for long horizons, all of them give the same decisions. 'table' looks the decisions up in a precompiled
+        FastMPC table per video (Data/DecisionTables/), which is compiled on first use
+        :param check_table: solve every decision exactly as well and log how often the table agrees
+        :param log_format: 'text' writes one tab separated file per trace, 'npz' buffers the sessions and writes
+        columnar partitions (see SessionLog)
+        :param timing: time the stages of evaluate_video (setup, download, reward, log, prediction, solve), every
+        session is appended to stage_timings.jsonl of the result folder and stage_timer sums up all of them. With
+        solver='branch_and_bound' the record also holds the nodes the solver expanded in the session, which are
+        logged at the end of every session with or without timing
+        :param session_cache: SessionCache from which sessions played before with the same parameters, video and trace
+        are written instead of simulating them again, also if they were played under another name
         """
+        assert solver in ['vectorized', 'recursive', 'branch_and_bound', 'table'], 'Unknown solver %s' % solver
+        assert log_format in ['text', 'npz'], 'Unknown log format %s' % log_format
+        self.log_format = log_format
+        self.predictor = predictor
+        self.predictor_parameters = predictor_parameters if predictor_parameters is not None else {}
+        self.timing = timing
+        self.stage_timer = StageTimer() if timing else NULL_STAGE_TIMER
+        self.solver = solver
+        self.check_table = check_table
+        self.decision_table = None
+        self.vectorized_lookahead = VectorizedLookahead()
+        self.branch_and_bound_lookahead = BranchAndBoundLookahead()
+        self.trace_store = trace_store
         self.robust = robust
         self.last_n_probes = last_n_probes
         self.reward_function = reward_function
@@ -89,33 +197,28 @@ class MPC:
         self.log_path = 'Data/Results/%s/' % self.name
         if not exists(self.log_path):
             os.makedirs(self.log_path)
+        self.ledgers = {}
+        self.session_cache = session_cache
+        self.mpc_description = describe_mpc(self) if session_cache is not None else None
 
     def solve_lookahead(self, net_env, lookahead_to_go, last_level, future_bandwidth, index, current_buffer):
         current_counter = net_env.video_chunk_counter + index
-        if lookahead_to_go == 0 or current_counter >= len(net_env.byte_size_match):
+        if lookahead_to_go == 0 or current_counter >= net_env.manifest.n_chunks:
             return 0, 0
 
         reward_list = []
         for next_level in range(net_env.max_quality_level + 1):
-            size_mbit = 8e-6 * net_env.byte_size_match.iloc[current_counter, next_level]
+            size_mbit = 8e-6 * net_env.byte_size_match[current_counter, next_level]
             delay = size_mbit / future_bandwidth
             next_buffer = current_buffer - delay
             rebuf = 0
             if next_buffer < 0:
                 rebuf = np.abs(next_buffer)
                 next_buffer = 0
-            next_buffer += net_env.video_information_csv.seg_len_s[current_counter] * 1000.
+            next_buffer += net_env.manifest.seg_len_s[current_counter] * 1000.
             current_iterator = max([net_env.video_chunk_counter - 1, 0])
-            last_iterator = max([net_env.video_chunk_counter - 2, 0])
-
-            enviroment_state = {'last_vmaf': net_env.get_vmaf(last_iterator, last_level),
-                                'current_vmaf': net_env.get_vmaf(current_iterator, next_level),
-                                'last_bitrate': net_env.get_bitrate(last_iterator, last_level),
-                                'current_bitrate': net_env.get_bitrate(current_iterator, next_level),
-                                'rebuffering': rebuf,
-                                'chunk_len_s': net_env.video_information_csv.iloc[current_iterator].seg_len_s
-                                }
-            reward = self.reward_function.return_reward(enviroment_state)
+            reward = self.reward_function.return_reward_batch(net_env.manifest, current_iterator, last_level,
+                                                              next_level, rebuf)
 
             reward_return, _ = self.solve_lookahead(net_env, lookahead_to_go=lookahead_to_go - 1, last_level=next_level,
                                                     future_bandwidth=future_bandwidth,
@@ -125,6 +228,96 @@ class MPC:
             reward_list.append(reward + reward_return)
         return np.max(reward_list), np.argmax(reward_list)
 
+    def solve(self, net_env, last_level, future_bandwidth, current_buffer):
+        if self.solver == 'vectorized':
+            return self.vectorized_lookahead.solve(net_env, self.reward_function, self.lookahead, last_level=last_level,
+                                                   future_bandwidth=future_bandwidth, current_buffer=current_buffer)
+        if self.solver == 'table':
+            current_level = self.decision_table.lookup(net_env.video_chunk_counter, last_level, current_buffer,
+                                                       future_bandwidth)
+            if self.check_table:
+                _, exact_level = self.vectorized_lookahead.solve(net_env, self.reward_function, self.lookahead,
+                                                                 last_level=last_level,
+                                                                 future_bandwidth=future_bandwidth,
+                                                                 current_buffer=current_buffer)
+                self.decision_table.record_check(current_level, exact_level)
+            return None, current_level
+        if self.solver == 'branch_and_bound':
+            return self.branch_and_bound_lookahead.solve(net_env, self.reward_function, self.lookahead,
+                                                         last_level=last_level, future_bandwidth=future_bandwidth,
+                                                         current_buffer=current_buffer)
+        return self.solve_lookahead(net_env, self.lookahead, last_level=last_level,
+                                    future_bandwidth=future_bandwidth, index=0,
+                                    current_buffer=current_buffer)
+
+    def get_log_path(self, video_file, video_id, file_name):
+        """
+        :return: path of the log of the video played on the trace file_name
+        """
+        return self.log_path + video_file.split('/')[-2] + '/' + 'video_{video_id}_file_id_{file_name}'.format(
+            video_id=video_id, file_name=file_name)
+
+    def get_ledger(self, video_file, video_id, n_chunks):
+        """
+        :return: CompletionLedger of the result folder of the video, up to date and with the logs of the video written
+        before the ledger existed added
+        """
+        folder = self.log_path + video_file.split('/')[-2] + '/'
+        if folder not in self.ledgers:
+            self.ledgers[folder] = CompletionLedger(folder)
+        self.ledgers[folder].migrate('video_{video_id}_file_id_'.format(video_id=video_id), n_chunks)
+        return self.ledgers[folder]
+
+    def is_logged(self, log_path, ledger, session_log=None):
+        """
+        :return: True if the session of log_path doesn't have to be played again
+        """
+        session_name = os.path.basename(log_path)
+        return session_name in ledger or (session_log is not None and session_name in session_log.session_names)
+
+    def write_cached_session(self, log_path, lines, ledger, session_log=None):
+        """
+        Writes the log of a session taken from the session cache
+        """
+        if session_log is not None:
+            session_log.start_session(os.path.basename(log_path))
+            for line in lines:
+                session_log.add_chunk(*parse_log_line(line))
+            session_log.end_session()
+        else:
+            with open(log_path, 'w') as log_file:
+                log_file.write(''.join(lines) + '\n')
+            ledger.add(os.path.basename(log_path))
+
+    def next_session(self, net_env, all_file_names, video_file, video_id, ledger, session_log, manifest_digest,
+                     time_stamp, predictor):
+        """
+        Skips the traces whose session is logged already and writes the sessions which are in the session cache
+        :return: log path of the next session to play (None if there is none left), its key in the session cache,
+        time stamp and predictor after the sessions taken from the cache
+        """
+        while True:
+            log_path = self.get_log_path(video_file, video_id, all_file_names[net_env.trace_idx])
+            if self.is_logged(log_path, ledger, session_log):
+                net_env.trace_idx += 1
+            elif self.session_cache is None:
+                return log_path, None, time_stamp, predictor
+            else:
+                # the trace which is played is the one loaded in the environment
+                session_key = self.session_cache.session_key(self.mpc_description, manifest_digest,
+                                                             net_env.cooked_time, net_env.cooked_bw, time_stamp,
+                                                             predictor)
+                entry = self.session_cache.get(session_key)
+                if entry is None:
+                    return log_path, session_key, time_stamp, predictor
+                self.write_cached_session(log_path, entry['lines'], ledger, session_log)
+                logger.info('Took %s from the session cache' % os.path.basename(log_path))
+                time_stamp = entry['time_stamp']
+                predictor = entry['predictor']
+                net_env.next_trace()
+            if net_env.trace_idx >= len(all_file_names):
+                return None, None, time_stamp, predictor
+
     def evaluate_video(self, trace_path,
                        video_file, video_id, filter_traces=None):
         """
@@ -135,36 +328,56 @@ class MPC:
         :param filter_traces:
         :return:
         """
+        session_timer = StageTimer() if self.timing else NULL_STAGE_TIMER
+        stage_start = session_timer.start()
         current_log_path = self.log_path + video_file.split('/')[-2] + '/'
         if not os.path.exists(current_log_path):
             os.makedirs(current_log_path)
 
-        all_cooked_time, all_cooked_bw, all_file_names = load_trace(trace_path, filter_traces)
+        all_cooked_time, all_cooked_bw, all_file_names = load_trace(trace_path, filter_traces,
+                                                                trace_store=self.trace_store)
 
         net_env = Environment(all_cooked_time=all_cooked_time,
                               all_cooked_bw=all_cooked_bw, video_information_csv=video_file)
-
-        log_path = current_log_path + 'video_{video_id}_file_id_{file_name}'.format(
-            video_id=video_id, file_name=all_file_names[net_env.trace_idx])
-        while os.path.isfile(log_path) and len(open(log_path, 'r').read().split('\n')) >= len(
-                net_env.video_information_csv):
-            net_env.trace_idx += 1
-            if net_env.trace_idx >= len(all_file_names):
-                return
-            log_path = current_log_path + 'video_{video_id}_file_id_{file_name}'.format(
-                video_id=video_id, file_name=all_file_names[net_env.trace_idx])
-        if os.path.isfile(log_path):
-            os.remove(log_path)
-        log_file = open(log_path, 'w')
+        if self.solver == 'table':
+            self.decision_table = load_decision_table(
+                'Data/DecisionTables/%s/%s/%s.npz' % (self.name, video_file.split('/')[-2], video_id),
+                video_file, self.reward_function, self.lookahead)
+            logger.info('Decision table takes %.1f kB' % (self.decision_table.nbytes / 1e3))
+
+        ledger = self.get_ledger(video_file, video_id, net_env.manifest.n_chunks)
+        session_log = None
+        if self.log_format == 'npz':
+            session_log = SessionLogWriter(current_log_path, ledger=ledger)
+
+        manifest_digest = file_digest(video_file) if self.session_cache is not None else None
         time_stamp = 0
+        # the prediction errors are kept across videos, only the throughput samples are reset
+        predictor = make_predictor(self.predictor, robust=self.robust, **self.predictor_parameters)
+
+        log_path, session_key, time_stamp, predictor = self.next_session(net_env, all_file_names, video_file,
+                                                                         video_id, ledger, session_log,
+                                                                         manifest_digest, time_stamp, predictor)
+        if log_path is None:
+            if session_log is not None:
+                session_log.close()
+            return
+        session_lines = []
+        if session_log is not None:
+            session_log.start_session(os.path.basename(log_path))
+        else:
+            if os.path.isfile(log_path):
+                os.remove(log_path)
+            log_file = open(log_path, 'w')
+        stage_start = session_timer.stop('setup', stage_start)
         last_level = 0
         current_level = 0
         video_count = 0
-        past_errors = []
-        past_bandwidth_ests = []
-        throughput_memory = []
+        n_throughput_samples = 0
 
         start_time = time()
+        # nodes expanded by the branch and bound solver in the session
+        self.branch_and_bound_lookahead.total_nodes_expanded = 0
         while True:  # serve video forever
 
             # the action is from the last decision
@@ -173,104 +386,118 @@ class MPC:
             video_chunk_size, next_video_chunk_sizes, \
             end_of_video, video_chunk_remain = \
                 net_env.get_video_chunk(current_level)
+            stage_start = session_timer.stop('download', stage_start)
 
             time_stamp += delay  # in ms
             time_stamp += sleep_time  # in ms
 
             # reward is video quality - rebuffer penalty
             current_iterator = max([net_env.video_chunk_counter - 1, 0])
-            last_iterator = max([net_env.video_chunk_counter - 2, 0])
-
-            enviroment_state = {'last_vmaf': net_env.get_vmaf(last_iterator, last_level),
-                                'current_vmaf': net_env.get_vmaf(current_iterator, current_level),
-                                'last_bitrate': net_env.get_bitrate(last_iterator, last_level),
-                                'current_bitrate': net_env.get_bitrate(current_iterator, current_level),
-                                'rebuffering': rebuf,
-                                'chunk_len_s': net_env.video_information_csv.iloc[current_iterator].seg_len_s
-                                }
-            reward = self.reward_function.return_reward(enviroment_state)
+            reward = self.reward_function.return_reward_batch(net_env.manifest, current_iterator, last_level,
+                                                              current_level, rebuf)
+            stage_start = session_timer.stop('reward', stage_start)
 
             last_level = current_level
 
             # log time_stamp, current_level, buffer_size, reward
-            log_file.write(str(time_stamp / M_IN_K) + '\t' +
-                           str(net_env.get_bitrate(current_iterator, current_level)) + '\t' +
-                           str(net_env.get_vmaf(current_iterator, current_level)) + '\t' +
-                           str(buffer_size) + '\t' +
-                           str(rebuf) + '\t' +
-                           str(video_chunk_size) + '\t' +
-                           str(net_env.video_information_csv.iloc[current_iterator].seg_len_s) + '\t' +
-                           str(delay) + '\t' +
-                           str(current_level) + '\t' +
-                           str(reward) + '\n')
+            log_values = (time_stamp / M_IN_K,
+                          net_env.get_bitrate(current_iterator, current_level),
+                          net_env.get_vmaf(current_iterator, current_level),
+                          buffer_size,
+                          rebuf,
+                          video_chunk_size,
+                          net_env.manifest.seg_len_s[current_iterator],
+                          delay,
+                          current_level,
+                          reward)
+            if session_log is not None:
+                session_log.add_chunk(*log_values)
+            else:
+                log_file.write(format_log_line(log_values))
+            if session_key is not None:
+                session_lines.append(format_log_line(log_values))
+            stage_start = session_timer.stop('log', stage_start)
 
             # --------------------------------------------------------------------------------
             # Keep a history of the data
 
-            throughput_memory.append((8e-6 * video_chunk_size) / (delay / M_IN_K))
-
-            curr_error = 0  # defualt assumes that this is the first request so error is 0 since we have never predicted bandwidth
-            if (len(past_bandwidth_ests) > 0):
-                bw_estimate = throughput_memory[-1]
-                curr_error = abs(past_bandwidth_ests[-1] - bw_estimate) / float(bw_estimate)
-            past_errors.append(curr_error)
-
-            past_bandwidths = throughput_memory[-5:]
-            while past_bandwidths[0] == 0.0:
-                past_bandwidths = past_bandwidths[1:]  # Mbit/s
-
-            bandwidth_sum = 0
-            for past_val in past_bandwidths:
-                bandwidth_sum += (1 / float(past_val))
-            harmonic_bandwidth = 1.0 / (bandwidth_sum / len(past_bandwidths))
-
-            error_pos = -5
-            if (len(past_errors) < 5):
-                error_pos = -len(past_errors)
-            max_error = float(max(past_errors[error_pos:]))
-            if self.robust:
-                future_bandwidth = harmonic_bandwidth / (1 + max_error)  # robustMPC here
-            else:
-                future_bandwidth = harmonic_bandwidth
-            past_bandwidth_ests.append(harmonic_bandwidth)
+            throughput = (8e-6 * video_chunk_size) / (delay / M_IN_K)
+            n_throughput_samples += 1
+            predictor.update(throughput)
+            future_bandwidth = predictor.predict()[0]
+            stage_start = session_timer.stop('prediction', stage_start)
 
-            if len(throughput_memory) <= self.last_n_probes:
+            if n_throughput_samples <= self.last_n_probes:
                 # --------------- Startup behaviour
                 current_video_bitrates_mbit = [net_env.get_bitrate(net_env.video_chunk_counter, i) * 1e-6 for i in
                                                range(net_env.max_quality_level + 1)]
-                current_level = [rate <= throughput_memory[-1] for rate in current_video_bitrates_mbit]
+                current_level = [rate <= throughput for rate in current_video_bitrates_mbit]
                 current_level = sum(current_level) - 1
                 current_level = max([current_level, 0])
             else:
-                _, current_level = self.solve_lookahead(net_env, self.lookahead, last_level=current_level,
-                                                        future_bandwidth=future_bandwidth, index=0,
-                                                        current_buffer=buffer_size)
+                _, current_level = self.solve(net_env, last_level=current_level, future_bandwidth=future_bandwidth,
+                                              current_buffer=buffer_size)
             current_level = int(current_level)
+            stage_start = session_timer.stop('solve', stage_start)
             if end_of_video:
-                logger.info('Finished watching video,took %.2f' % (time() - start_time))
+                if self.solver == 'branch_and_bound':
+                    logger.info('Finished watching video,took %.2f, expanded %d nodes' % (
+                        time() - start_time, self.branch_and_bound_lookahead.total_nodes_expanded))
+                else:
+                    logger.info('Finished watching video,took %.2f' % (time() - start_time))
+                if self.solver == 'table' and self.check_table:
+                    logger.info('Decision table agrees with the exact solution in %.4f of %d decisions' % (
+                        self.decision_table.agreement(), self.decision_table.n_checked))
                 start_time = time()
-                throughput_memory = []
-
-                log_file.write('\n')
-                log_file.close()
+                predictor.reset()
+                n_throughput_samples = 0
+
+                if session_log is not None:
+                    session_log.end_session()
+                else:
+                    log_file.write('\n')
+                    log_file.close()
+                    ledger.add(os.path.basename(log_path))
+                if session_key is not None:
+                    self.session_cache.put(session_key, session_lines, time_stamp, predictor)
+                stage_start = session_timer.stop('log', stage_start)
+                if self.timing:
+                    self.stage_timer.merge(session_timer)
+                    logger.info('Stage times %s' % session_timer.format())
+                    session_timing = {'session': os.path.basename(log_path),
+                                      'stages': session_timer.summary()['stages']}
+                    if self.solver == 'branch_and_bound':
+                        session_timing['nodes_expanded'] = self.branch_and_bound_lookahead.total_nodes_expanded
+                    with open(current_log_path + 'stage_timings.jsonl', 'a') as timing_file:
+                        timing_file.write(json.dumps(session_timing) + '\n')
+                    session_timer = StageTimer()
+                    stage_start = session_timer.start()
 
                 last_level = 0
                 current_level = 0  # use the default action here
+                self.branch_and_bound_lookahead.total_nodes_expanded = 0
 
                 video_count += 1
 
                 if video_count > len(all_file_names):
                     break
 
-                log_path = current_log_path + 'video_{video_id}_file_id_{file_name}'.format(
-                    video_id=video_id, file_name=all_file_names[net_env.trace_idx])
-                while os.path.isfile(log_path) and len(open(log_path, 'r').read().split('\n')) >= len(
-                        net_env.video_information_csv) - 5:
-                    net_env.trace_idx += 1
-                    if net_env.trace_idx >= len(all_file_names):
-                        return
-                    log_path = current_log_path + 'video_{video_id}_file_id_{file_name}'.format(
-                        video_id=video_id, file_name=all_file_names[net_env.trace_idx])
-                if os.path.isfile(log_path):
-                    os.remove(log_path)
-                log_file = open(log_path, 'w')
+                log_path, session_key, time_stamp, predictor = self.next_session(net_env, all_file_names, video_file,
+                                                                                 video_id, ledger, session_log,
+                                                                                 manifest_digest, time_stamp,
+                                                                                 predictor)
+                if log_path is None:
+                    if session_log is not None:
+                        session_log.close()
+                    return
+                session_lines = []
+                if session_log is not None:
+                    session_log.start_session(os.path.basename(log_path))
+                else:
+                    if os.path.isfile(log_path):
+                        os.remove(log_path)
+                    log_file = open(log_path, 'w')
+                stage_start = session_timer.stop('setup', stage_start)
+
+        if session_log is not None:
+            session_log.close()
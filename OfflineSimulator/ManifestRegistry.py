@@ -0,0 +1,82 @@
+"""
+Process wide registry of parsed video information. Files are keyed by their path and parsed again only if their mtime
+changed, the least recently used entries are evicted once the registry is full. The returned objects are shared
+between all users and must be treated as read only.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from OfflineSimulator.VideoManifest import VideoManifest, RangeMapper, load_quality_mapper
+
+MAX_REGISTRY_ENTRIES = 512  # All files under Data/VideoInformation fit
+
+
+class ManifestRegistry:
+
+    def __init__(self, max_entries=MAX_REGISTRY_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()  # The traffic controllers parse from their throttle threads
+        self.n_parsed = 0
+        self.n_hits = 0
+
+    def get(self, parser, path):
+        """
+        :param parser: callable which parses the file at path
+        :param path: path of the file
+        :return: the parsed file
+        """
+        key = (parser, os.path.abspath(path))
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self.lock:
+            if key in self.entries and self.entries[key][0] == mtime_ns:
+                self.entries.move_to_end(key)
+                self.n_hits += 1
+                return self.entries[key][1]
+        parsed = parser(path)
+        self.n_parsed += 1
+        self.add(parser, path, parsed, mtime_ns=mtime_ns)
+        return parsed
+
+    def add(self, parser, path, parsed, mtime_ns=None):
+        """
+        Registers an already parsed file, by default under the current mtime of path
+        """
+        key = (parser, os.path.abspath(path))
+        if mtime_ns is None:
+            mtime_ns = os.stat(path).st_mtime_ns
+        with self.lock:
+            self.entries[key] = (mtime_ns, parsed)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def video_manifest(self, video_information_csv):
+        return self.get(VideoManifest, video_information_csv)
+
+    def quality_mapper(self, video_quality_mapper):
+        return self.get(load_quality_mapper, video_quality_mapper)
+
+    def range_mapper(self, video_range_mapper):
+        return self.get(RangeMapper, video_range_mapper)
+
+
+MANIFEST_REGISTRY = ManifestRegistry()
+
+
+def get_video_manifest(video_information_csv):
+    return MANIFEST_REGISTRY.video_manifest(video_information_csv)
+
+
+def get_quality_mapper(video_quality_mapper):
+    return MANIFEST_REGISTRY.quality_mapper(video_quality_mapper)
+
+
+def get_range_mapper(video_range_mapper):
+    return MANIFEST_REGISTRY.range_mapper(video_range_mapper)
@@ -0,0 +1,264 @@
+"""
+Monte Carlo evaluation over trace windows. Instead of one session per trace starting at the beginning of the trace,
+many sessions are drawn per trace with a random start offset and a random number of chunks, all of them are simulated
+together in a BatchEnvironment.
+"""
+
+import logging
+from statistics import NormalDist
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from OfflineSimulator.BatchSimulator import BatchEnvironment
+from OfflineSimulator.LookaheadSolver import VectorizedLookahead
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.ThroughputPredictor import make_predictor
+from OfflineSimulator.VideoManifest import VideoManifest
+
+M_IN_K = 1000.0
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+def sample_windows(trace_len, n_windows_per_trace, min_chunks, max_chunks, seed=0):
+    """
+    Draws the sessions, the same seed always gives the same windows
+    :param trace_len: length of each trace
+    :param n_windows_per_trace: sessions drawn per trace
+    :param min_chunks: shortest session in chunks
+    :param max_chunks: longest session in chunks
+    :return: trace_indices, mahimahi_start_ptr, video_chunk_limit (one entry per session)
+    """
+    trace_len = np.asarray(trace_len, dtype=np.int64)
+    assert (trace_len >= 2).all(), 'Traces need at least two samples'
+    rng = np.random.default_rng(seed)
+    trace_indices = np.repeat(np.arange(len(trace_len)), n_windows_per_trace)
+    # note: trace file starts with time 0, a session can start at any of the following samples
+    mahimahi_start_ptr = 1 + rng.integers(0, trace_len[trace_indices] - 1)
+    video_chunk_limit = rng.integers(min_chunks, max_chunks + 1, size=len(trace_indices))
+    return trace_indices, mahimahi_start_ptr, video_chunk_limit
+
+
+class RateBasedPolicy:
+    """
+    Vectorized version of the startup behaviour of MPC, picks the highest bitrate below the predicted throughput (by
+    default the harmonic mean of the last throughput samples)
+    """
+
+    def __init__(self, last_n_probes=5, predictor='harmonic', predictor_parameters=None):
+        """
+        :param predictor: key of ThroughputPredictor.PREDICTORS
+        :param predictor_parameters: passed on to the predictor, defaults to a window of last_n_probes samples
+        """
+        self.last_n_probes = last_n_probes
+        self.predictor_name = predictor
+        self.predictor_parameters = predictor_parameters if predictor_parameters is not None else {
+            'window': last_n_probes}
+        self.predictor = None
+
+    def reset(self, n_sessions, first_level=0):
+        self.predictor = make_predictor(self.predictor_name, n_sessions=n_sessions, **self.predictor_parameters)
+
+    def __call__(self, batch_environment, observation):
+        throughput = (8e-6 * observation['video_chunk_size']) / (observation['delay'] / M_IN_K)
+        self.predictor.update(throughput)
+        predicted_bandwidth = self.predictor.predict()
+        self.predictor.reset(observation['end_of_video'])
+
+        current_video_bitrates_mbit = batch_environment.bitrate_match[batch_environment.video_chunk_counter] * 1e-6
+        current_level = (current_video_bitrates_mbit <= predicted_bandwidth[:, None]).sum(axis=1) - 1
+        return np.maximum(current_level, 0)
+
+
+class MPCPolicy:
+    """
+    Vectorized version of the decisions of MPC.evaluate_video (startup behaviour for the first last_n_probes chunks,
+    then the lookahead on the robust throughput prediction). The sessions of a batch play in lockstep, the sessions
+    at the same chunk are solved together with VectorizedLookahead.solve_states.
+    """
+
+    def __init__(self, reward_function, last_n_probes=5, lookahead=5, robust=True, predictor='harmonic',
+                 predictor_parameters=None):
+        """
+        :param reward_function: reward function MPC optimizes
+        :param predictor: key of ThroughputPredictor.PREDICTORS, the same defaults as MPC
+        :param predictor_parameters: passed on to the predictor
+        """
+        self.reward_function = reward_function
+        self.last_n_probes = last_n_probes
+        self.lookahead = lookahead
+        self.robust = robust
+        self.predictor_name = predictor
+        self.predictor_parameters = predictor_parameters if predictor_parameters is not None else {}
+        self.solver = VectorizedLookahead()
+        self.predictor = None
+        self.n_throughput_samples = None
+        self.current_level = None
+
+    def reset(self, n_sessions, first_level=0):
+        """
+        :param first_level: quality level of the first chunk per session, the lookahead starts from it
+        """
+        self.predictor = make_predictor(self.predictor_name, n_sessions=n_sessions, robust=self.robust,
+                                        **self.predictor_parameters)
+        self.n_throughput_samples = np.zeros(n_sessions, dtype=np.int64)
+        self.current_level = np.broadcast_to(np.asarray(first_level, dtype=np.int64), (n_sessions,)).copy()
+
+    def __call__(self, batch_environment, observation):
+        throughput = (8e-6 * observation['video_chunk_size']) / (observation['delay'] / M_IN_K)
+        self.n_throughput_samples += 1
+        self.predictor.update(throughput)
+        future_bandwidth = self.predictor.predict()
+
+        video_chunk_counter = batch_environment.video_chunk_counter
+        current_video_bitrates_mbit = batch_environment.bitrate_match[video_chunk_counter] * 1e-6
+        next_level = np.maximum((current_video_bitrates_mbit <= throughput[:, None]).sum(axis=1) - 1, 0)
+        planning = np.flatnonzero(self.n_throughput_samples > self.last_n_probes)
+        for chunk in np.unique(video_chunk_counter[planning]):
+            sessions = planning[video_chunk_counter[planning] == chunk]
+            decisions = self.solver.solve_states(batch_environment.manifest, self.reward_function, self.lookahead,
+                                                 int(chunk), future_bandwidth[sessions],
+                                                 observation['buffer_size'][sessions])
+            next_level[sessions] = decisions[self.current_level[sessions], np.arange(len(sessions))]
+
+        ended = observation['end_of_video']
+        self.predictor.reset(ended)
+        self.n_throughput_samples[ended] = 0
+        next_level[ended] = 0
+        self.current_level = next_level
+        return next_level.copy()
+
+
+def run_windows(batch_environment, policy, reward_function, first_level=None):
+    """
+    Plays every session of the batch once until its chunk limit
+    :param batch_environment: BatchEnvironment
+    :param policy: callable(batch_environment, observation) -> quality level per session, reset(n_sessions,
+    first_level) is called first if the policy has it
+    :param reward_function: RewardFunction, evaluated with return_reward_batch and the same chunk indices as
+    MPC.evaluate_video
+    :param first_level: quality level of the first chunk per session, defaults to 0 as in MPC.evaluate_video. The
+    first chunk counts as its own previous chunk
+    :return: dataframe with one row per session
+    """
+    n_sessions = batch_environment.n_sessions
+    if first_level is None:
+        first_level = 0
+    current_level = np.broadcast_to(np.asarray(first_level, dtype=np.int64), (n_sessions,)).copy()
+    last_level = current_level.copy()
+    if hasattr(policy, 'reset'):
+        policy.reset(n_sessions, current_level.copy())
+    batch_environment.reset()
+    active = np.ones(n_sessions, dtype=bool)
+    qoe = np.zeros(n_sessions)
+    rebuffer_s = np.zeros(n_sessions)
+    bitrate_sum = np.zeros(n_sessions)
+    vmaf_sum = np.zeros(n_sessions)
+    n_switches = np.zeros(n_sessions, dtype=np.int64)
+    n_chunks = np.zeros(n_sessions, dtype=np.int64)
+
+    while active.any():
+        delay, sleep_time, buffer_size, rebuf, \
+        video_chunk_size, next_video_chunk_sizes, \
+        end_of_video, video_chunk_remain = batch_environment.get_video_chunk(current_level)
+
+        current_iterator = np.maximum(batch_environment.video_chunk_counter - 1, 0)
+        reward = reward_function.return_reward_batch(batch_environment.manifest, current_iterator, last_level,
+                                                     current_level, rebuf)
+
+        qoe[active] += reward[active]
+        rebuffer_s[active] += rebuf[active]
+        bitrate_sum[active] += batch_environment.get_bitrate(current_iterator, current_level)[active]
+        vmaf_sum[active] += batch_environment.get_vmaf(current_iterator, current_level)[active]
+        n_switches[active] += (current_level != last_level)[active]
+        n_chunks[active] += 1
+        active &= ~end_of_video
+
+        last_level = current_level
+        observation = {'delay': delay,
+                       'sleep_time': sleep_time,
+                       'buffer_size': buffer_size,
+                       'rebuf': rebuf,
+                       'video_chunk_size': video_chunk_size,
+                       'next_video_chunk_sizes': next_video_chunk_sizes,
+                       'end_of_video': end_of_video,
+                       'video_chunk_remain': video_chunk_remain}
+        current_level = np.asarray(policy(batch_environment, observation), dtype=np.int64)
+        current_level[end_of_video] = 0  # use the default action here
+
+    return pd.DataFrame({'trace_idx': batch_environment.trace_idx,
+                         'mahimahi_start_ptr': batch_environment.mahimahi_start_ptr,
+                         'n_chunks': n_chunks,
+                         'qoe': qoe,
+                         'mean_reward': qoe / n_chunks,
+                         'rebuffer_s': rebuffer_s,
+                         'mean_bitrate_mbit': bitrate_sum / n_chunks * 1e-6,
+                         'mean_vmaf': vmaf_sum / n_chunks,
+                         'n_switches': n_switches})
+
+
+def confidence_interval(values, confidence=0.95):
+    """
+    Normal approximation of the confidence interval of the mean
+    :return: mean, lower bound, upper bound
+    """
+    values = np.asarray(values, dtype=float)
+    mean = values.mean()
+    if len(values) < 2:
+        return mean, np.nan, np.nan
+    z = NormalDist().inv_cdf(0.5 + confidence / 2.)
+    half_width = z * values.std(ddof=1) / np.sqrt(len(values))
+    return mean, mean - half_width, mean + half_width
+
+
+def summarize_windows(sessions, columns=('mean_reward', 'rebuffer_s', 'mean_bitrate_mbit', 'mean_vmaf'),
+                      confidence=0.95, by_trace=True):
+    """
+    :param sessions: dataframe returned by run_windows
+    :param by_trace: windows of the same trace are correlated, average them per trace before computing the interval
+    :return: dataframe with mean, lower and upper bound per column
+    """
+    if by_trace:
+        sessions = sessions.groupby('trace_idx')[list(columns)].mean()
+    summary = {column: confidence_interval(sessions[column], confidence) for column in columns}
+    return pd.DataFrame(summary, index=['mean', 'lower', 'upper']).T
+
+
+def monte_carlo(all_cooked_time, all_cooked_bw, video_information_csv, policy, reward_function,
+                n_windows_per_trace=32, min_chunks=10, max_chunks=None, seed=0, **environment_parameters):
+    """
+    Samples and plays n_windows_per_trace sessions on every trace
+    :param video_information_csv: path to the *_video_info file or a VideoManifest
+    :param max_chunks: defaults to the whole video
+    :param environment_parameters: passed on to BatchEnvironment (BUFFER_THRESH, LINK_RTT, ...)
+    :return: dataframe with one row per session
+    """
+    start_time = time()
+    trace_len = [len(cooked_time) for cooked_time in all_cooked_time]
+    if isinstance(video_information_csv, VideoManifest):
+        manifest = video_information_csv
+    else:
+        manifest = get_video_manifest(video_information_csv)
+    if max_chunks is None:
+        max_chunks = manifest.n_chunks - 1
+    min_chunks = min(min_chunks, max_chunks)
+    trace_indices, mahimahi_start_ptr, video_chunk_limit = sample_windows(trace_len, n_windows_per_trace,
+                                                                          min_chunks, max_chunks, seed=seed)
+    batch_environment = BatchEnvironment(all_cooked_time, all_cooked_bw, manifest,
+                                         trace_indices=trace_indices,
+                                         mahimahi_start_ptr=mahimahi_start_ptr,
+                                         video_chunk_limit=video_chunk_limit,
+                                         **environment_parameters)
+    sessions = run_windows(batch_environment, policy, reward_function)
+    logger.info('Played %d windows on %d traces, took %.2f' % (len(sessions), len(trace_len), time() - start_time))
+    return sessions
@@ -4,17 +4,45 @@ https://github.com/hongzimao/pensieve
 
 """
 
+import bisect
+import copy
 import os
+from collections import namedtuple
 
 import numpy as np
-import pandas as pd
+
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.VideoManifest import VideoManifest
 
 MILLISECONDS_IN_SECOND = 1000.0
 B_IN_MB = 1000000.0
 BITS_IN_BYTE = 8.0
 
-def load_trace(cooked_trace_folder, keep_traces=None):
+# Everything that changes while a session is simulated, buffer_size is in ms
+EnvironmentState = namedtuple('EnvironmentState', ['trace_idx', 'mahimahi_ptr', 'last_mahimahi_time',
+                                                   'buffer_size', 'video_chunk_counter'])
+
+def parse_trace_file(file_path):
+    cooked_time = []
+    cooked_bw = []
+    with open(file_path, 'rb') as f:
+        for line in f:
+            parse = line.split()
+            cooked_time.append(float(parse[0]))
+            cooked_bw.append(float(parse[1]))
+    return cooked_time, cooked_bw
+
+
+def load_trace(cooked_trace_folder, keep_traces=None, trace_store=None):
+    """
+    :param cooked_trace_folder: folder containing the traces
+    :param keep_traces: if given only these file names are loaded
+    :param trace_store: TraceStore from which the traces are mapped instead of being parsed, if it contains them
+    :return: time stamps, bandwidths and file names of the traces
+    """
     cooked_files = os.listdir(cooked_trace_folder)
+    if keep_traces is not None:
+        keep_traces = set(keep_traces)
     all_cooked_time = []
     all_cooked_bw = []
     all_file_names = []
@@ -22,20 +50,128 @@ def load_trace(cooked_trace_folder, keep_traces=None):
         if keep_traces is not None and cooked_file not in keep_traces:
             continue
         file_path = cooked_trace_folder + cooked_file
-        cooked_time = []
-        cooked_bw = []
-        # print file_path
-        with open(file_path, 'rb') as f:
-            for line in f:
-                parse = line.split()
-                cooked_time.append(float(parse[0]))
-                cooked_bw.append(float(parse[1]))
+        if trace_store is not None and file_path in trace_store:
+            cooked_time, cooked_bw = trace_store.get(file_path)
+        else:
+            cooked_time, cooked_bw = parse_trace_file(file_path)
         all_cooked_time.append(cooked_time)
         all_cooked_bw.append(cooked_bw)
         all_file_names.append(cooked_file)
 
     return all_cooked_time, all_cooked_bw, all_file_names
 
+
+class TraceIndex:
+    """
+    Cumulative deliverable bytes and time of a mahimahi trace. Interval p (= mahimahi_ptr) ends at cooked_time[p],
+    interval 1 is the one entered after looping back to the beginning of the trace and therefore starts at time 0.
+    Downloads and sleeps walk the first few intervals like the original loop, longer ones locate the interval in
+    which they end by binary search over the cumulative sums. The returned values are accumulated interval by
+    interval in the same order as the original loop so that they match it bit for bit.
+    """
+    SHORT_WALK = 16  # intervals walked in python before using the index, >= 1 so that it starts on a boundary
+
+    def __init__(self, cooked_time, cooked_bw):
+        self.cooked_time = np.asarray(cooked_time, dtype=float)
+        self.n_intervals = len(self.cooked_time) - 1
+        self.throughput = np.asarray(cooked_bw, dtype=float) * B_IN_MB / BITS_IN_BYTE
+        self.interval_start = np.zeros(len(self.cooked_time))
+        self.interval_start[2:] = self.cooked_time[1:-1]
+        self.interval_duration = self.cooked_time - self.interval_start
+        self.interval_duration[0] = 0
+        self.interval_bytes = self.throughput * self.interval_duration
+        self.cumulative_bytes = np.cumsum(self.interval_bytes)
+        self.cumulative_time = np.cumsum(self.interval_duration)
+        assert self.cumulative_bytes[-1] > 0, 'The trace has no capacity'
+        # python floats are faster for the element wise walk
+        self.cooked_time_list = self.cooked_time.tolist()
+        self.throughput_list = self.throughput.tolist()
+        self.cumulative_bytes_list = self.cumulative_bytes.tolist()
+        self.cumulative_time_list = self.cumulative_time.tolist()
+
+    def intervals_to_cover(self, cumulative, mahimahi_ptr, amount):
+        """
+        Estimates how many intervals starting at mahimahi_ptr are needed to accumulate amount
+        """
+        laps, rest = divmod(cumulative[mahimahi_ptr - 1] + amount, cumulative[-1])
+        position = bisect.bisect_left(cumulative, rest)
+        return max([int(laps) * self.n_intervals + position - mahimahi_ptr + 1, 1])
+
+    def next_ptrs(self, mahimahi_ptr, n_ptrs):
+        if mahimahi_ptr + n_ptrs <= self.n_intervals + 1:
+            return np.arange(mahimahi_ptr, mahimahi_ptr + n_ptrs)
+        return (mahimahi_ptr - 1 + np.arange(n_ptrs)) % self.n_intervals + 1
+
+    def download(self, mahimahi_ptr, last_mahimahi_time, video_chunk_size, packet_payload_portion):
+        """
+        :return: delay in s (without rtt), mahimahi_ptr and last_mahimahi_time after the download
+        """
+        delay = 0.0
+        video_chunk_counter_sent = 0
+        for _ in range(self.SHORT_WALK):
+            throughput = self.throughput_list[mahimahi_ptr]
+            duration = self.cooked_time_list[mahimahi_ptr] - last_mahimahi_time
+            packet_payload = throughput * duration * packet_payload_portion
+            if video_chunk_counter_sent + packet_payload > video_chunk_size:
+                fractional_time = (video_chunk_size - video_chunk_counter_sent) / \
+                                  throughput / packet_payload_portion
+                return delay + fractional_time, mahimahi_ptr, last_mahimahi_time + fractional_time
+            video_chunk_counter_sent += packet_payload
+            delay += duration
+            last_mahimahi_time = self.cooked_time_list[mahimahi_ptr]
+            mahimahi_ptr += 1
+            if mahimahi_ptr > self.n_intervals:
+                mahimahi_ptr = 1
+                last_mahimahi_time = 0
+
+        n_ptrs = self.intervals_to_cover(self.cumulative_bytes_list, mahimahi_ptr,
+                                         (video_chunk_size - video_chunk_counter_sent) / packet_payload_portion)
+        while True:
+            ptrs = self.next_ptrs(mahimahi_ptr, n_ptrs + 2)
+            sent = np.add.accumulate(np.append(video_chunk_counter_sent,
+                                               self.interval_bytes[ptrs] * packet_payload_portion))
+            finished = sent[1:] > video_chunk_size
+            if finished.any():
+                break
+            # the estimate can fall short by rounding
+            n_ptrs = 2 * n_ptrs + 2
+        last_interval = np.argmax(finished)
+        mahimahi_ptr = ptrs[last_interval]
+        fractional_time = (video_chunk_size - sent[last_interval]) / \
+                          self.throughput[mahimahi_ptr] / packet_payload_portion
+        delay = np.add.accumulate(np.append(delay, self.interval_duration[ptrs[:last_interval]]))[-1]
+        return delay + fractional_time, mahimahi_ptr, self.interval_start[mahimahi_ptr] + fractional_time
+
+    def drain(self, mahimahi_ptr, last_mahimahi_time, sleep_time):
+        """
+        :return: sleep time left in the last interval (in ms), mahimahi_ptr and last_mahimahi_time after sleeping
+        """
+        for _ in range(self.SHORT_WALK):
+            duration = self.cooked_time_list[mahimahi_ptr] - last_mahimahi_time
+            if duration > sleep_time / MILLISECONDS_IN_SECOND:
+                return sleep_time, mahimahi_ptr, last_mahimahi_time + sleep_time / MILLISECONDS_IN_SECOND
+            sleep_time -= duration * MILLISECONDS_IN_SECOND
+            last_mahimahi_time = self.cooked_time_list[mahimahi_ptr]
+            mahimahi_ptr += 1
+            if mahimahi_ptr > self.n_intervals:
+                mahimahi_ptr = 1
+                last_mahimahi_time = 0
+
+        n_ptrs = self.intervals_to_cover(self.cumulative_time_list, mahimahi_ptr, sleep_time / MILLISECONDS_IN_SECOND)
+        while True:
+            ptrs = self.next_ptrs(mahimahi_ptr, n_ptrs + 2)
+            durations = self.interval_duration[ptrs]
+            remaining = np.subtract.accumulate(np.append(sleep_time, durations * MILLISECONDS_IN_SECOND))
+            finished = durations > remaining[:-1] / MILLISECONDS_IN_SECOND
+            if finished.any():
+                break
+            n_ptrs = 2 * n_ptrs + 2
+        last_interval = np.argmax(finished)
+        sleep_time = remaining[last_interval]
+        mahimahi_ptr = ptrs[last_interval]
+        return sleep_time, mahimahi_ptr, self.interval_start[mahimahi_ptr] + sleep_time / MILLISECONDS_IN_SECOND
+
+
 class Environment:
     def __init__(self,
                  all_cooked_time,
@@ -54,6 +190,7 @@ class Environment:
         self.PACKET_SIZE = PACKET_SIZE
         self.all_cooked_time = all_cooked_time
         self.all_cooked_bw = all_cooked_bw
+        self.all_trace_index = {}
 
         self.video_chunk_counter = 0
         self.buffer_size = 0
@@ -62,6 +199,7 @@ class Environment:
         self.trace_idx = 0
         self.cooked_time = self.all_cooked_time[self.trace_idx]
         self.cooked_bw = self.all_cooked_bw[self.trace_idx]
+        self.trace_index = self.get_trace_index(self.trace_idx)
 
         self.mahimahi_start_ptr = 1
         # randomize the start point of the trace
@@ -69,38 +207,38 @@ class Environment:
         self.mahimahi_ptr = self.mahimahi_start_ptr
         self.last_mahimahi_time = self.cooked_time[self.mahimahi_ptr - 1]
 
-        def extract_sorted(key_str, column):
-            column = list(filter(lambda c: key_str in c, column))
-            column = sorted(column,
-                            key=lambda c: np.array(c.split('_')[0].split('x')).astype(float).prod()
-                            )
-            return column
-
-        self.video_information_csv = pd.read_csv(video_information_csv, index_col=0)
-        self.video_information_csv['time_s'] = self.video_information_csv.seg_len_s.cumsum()
-        self.byte_size_match = extract_sorted('byte', self.video_information_csv.columns)
-        self.byte_size_match = self.video_information_csv[self.byte_size_match]
-        self.vmaf_match = extract_sorted('vmaf', self.video_information_csv.columns)
-        self.vmaf_match = self.video_information_csv[self.vmaf_match]
-        self.bitrate_match = extract_sorted('bitrate', self.video_information_csv.columns)
-        self.bitrate_match = self.video_information_csv[self.bitrate_match]
-        self.max_quality_level = self.byte_size_match.shape[1] - 1
-        self.video_duration = self.video_information_csv.seg_len_s.sum()
+        if isinstance(video_information_csv, VideoManifest):
+            self.manifest = video_information_csv
+        else:
+            self.manifest = get_video_manifest(video_information_csv)
+        self.video_information_csv = self.manifest.video_information_csv
+        self.byte_size_match = self.manifest.byte_size
+        self.vmaf_match = self.manifest.vmaf
+        self.bitrate_match = self.manifest.bitrate
+        self.max_quality_level = self.manifest.max_quality_level
+        self.video_duration = self.manifest.video_duration
         self.TOTAL_VIDEO_CHUNCK = len(self.bitrate_match) - 1
 
 
+    def get_trace_index(self, trace_idx):
+        if trace_idx not in self.all_trace_index:
+            self.all_trace_index[trace_idx] = TraceIndex(self.all_cooked_time[trace_idx],
+                                                         self.all_cooked_bw[trace_idx])
+        return self.all_trace_index[trace_idx]
+
     def get_vmaf(self,index,quality):
         assert len(self.vmaf_match) > index,'Index is to big %d %d' % (len(self.vmaf_match),index)
-        return self.vmaf_match.iloc[index,quality]
+        return self.vmaf_match[index, quality]
 
     def get_bitrate(self,index,quality):
         assert len(self.bitrate_match) > index,'Index is to big'
-        return self.bitrate_match.iloc[index,quality]
+        return self.bitrate_match[index, quality]
 
     def set_state(self, state):
         self.trace_idx = state['trace_idx']
         self.cooked_time = self.all_cooked_time[self.trace_idx]
         self.cooked_bw = self.all_cooked_bw[self.trace_idx]
+        self.trace_index = self.get_trace_index(self.trace_idx)
         self.video_chunk_counter = state['video_chunk_counter']
         self.mahimahi_ptr = state['mahimahi_ptr']
         self.buffer_size = state['buffer_size']
@@ -113,41 +251,52 @@ class Environment:
                 'video_chunk_counter': self.video_chunk_counter,
                 'last_mahimahi_time': self.last_mahimahi_time}
 
-    def get_video_chunk(self, quality):
-
-        assert quality >= 0
-
-        video_chunk_size = self.byte_size_match.iloc[self.video_chunk_counter, quality]
+    def snapshot(self):
+        return EnvironmentState(trace_idx=self.trace_idx,
+                                mahimahi_ptr=self.mahimahi_ptr,
+                                last_mahimahi_time=self.last_mahimahi_time,
+                                buffer_size=self.buffer_size,
+                                video_chunk_counter=self.video_chunk_counter)
+
+    def restore(self, snapshot):
+        self.set_state(snapshot._asdict())
+
+    def fork(self, snapshot=None):
+        """
+        Shallow copy which shares traces, trace indices and manifest with this environment, only the session state is
+        its own
+        :param snapshot: state of the fork, defaults to the current state
+        :return: Environment
+        """
+        forked = copy.copy(self)
+        if snapshot is not None:
+            forked.restore(snapshot)
+        return forked
+
+    def next_trace(self):
+        self.trace_idx += 1
+        if self.trace_idx >= len(self.all_cooked_time):
+            self.trace_idx = 0
 
-        # use the delivery opportunity in mahimahi
-        delay = 0.0  # in ms
-        video_chunk_counter_sent = 0  # in bytes
-
-        while True:  # download video chunk over mahimahi
-            throughput = self.cooked_bw[self.mahimahi_ptr] \
-                         * B_IN_MB / BITS_IN_BYTE
-            duration = self.cooked_time[self.mahimahi_ptr] \
-                       - self.last_mahimahi_time
-
-            packet_payload = throughput * duration * self.PACKET_PAYLOAD_PORTION
+        self.cooked_time = self.all_cooked_time[self.trace_idx]
+        self.cooked_bw = self.all_cooked_bw[self.trace_idx]
+        self.trace_index = self.get_trace_index(self.trace_idx)
 
-            if video_chunk_counter_sent + packet_payload > video_chunk_size:
-                fractional_time = (video_chunk_size - video_chunk_counter_sent) / \
-                                  throughput / self.PACKET_PAYLOAD_PORTION
-                delay += fractional_time
-                self.last_mahimahi_time += fractional_time
-                break
+        # randomize the start point of the video
+        # note: trace file starts with time 0
 
-            video_chunk_counter_sent += packet_payload
-            delay += duration
-            self.last_mahimahi_time = self.cooked_time[self.mahimahi_ptr]
-            self.mahimahi_ptr += 1
+        self.mahimahi_ptr = self.mahimahi_start_ptr
+        self.last_mahimahi_time = self.cooked_time[self.mahimahi_ptr - 1]
 
-            if self.mahimahi_ptr >= len(self.cooked_bw):
-                # loop back in the beginning
-                # note: trace file starts with time 0
-                self.mahimahi_ptr = 1
-                self.last_mahimahi_time = 0
+    def download_video(self, video_chunk_size, seg_len_s):
+        """
+        Downloads video_chunk_size bytes over the trace, adds seg_len_s of video to the buffer and drains the buffer
+        if it gets too large
+        :return: delay, sleep_time and rebuffer time in ms
+        """
+        # use the delivery opportunity in mahimahi
+        delay, self.mahimahi_ptr, self.last_mahimahi_time = self.trace_index.download(
+            self.mahimahi_ptr, self.last_mahimahi_time, video_chunk_size, self.PACKET_PAYLOAD_PORTION)
 
         delay *= MILLISECONDS_IN_SECOND
         delay += self.LINK_RTT
@@ -159,7 +308,7 @@ class Environment:
         self.buffer_size = np.maximum(self.buffer_size - delay, 0.0)
 
         # add in the new chunk
-        self.buffer_size += self.video_information_csv.iloc[self.video_chunk_counter].seg_len_s * 1000. # buffer size is in ms
+        self.buffer_size += seg_len_s * 1000. # buffer size is in ms
         # sleep if buffer gets too large
         sleep_time = 0
         if self.buffer_size > self.BUFFER_THRESH:
@@ -170,22 +319,18 @@ class Environment:
             sleep_time = np.ceil(drain_buffer_time / self.DRAIN_BUFFER_SLEEP_TIME) * \
                          self.DRAIN_BUFFER_SLEEP_TIME
             self.buffer_size -= sleep_time
+            sleep_time, self.mahimahi_ptr, self.last_mahimahi_time = self.trace_index.drain(
+                self.mahimahi_ptr, self.last_mahimahi_time, sleep_time)
+        return delay, sleep_time, rebuf
 
-            while True:
-                duration = self.cooked_time[self.mahimahi_ptr] \
-                           - self.last_mahimahi_time
-                if duration > sleep_time / MILLISECONDS_IN_SECOND:
-                    self.last_mahimahi_time += sleep_time / MILLISECONDS_IN_SECOND
-                    break
-                sleep_time -= duration * MILLISECONDS_IN_SECOND
-                self.last_mahimahi_time = self.cooked_time[self.mahimahi_ptr]
-                self.mahimahi_ptr += 1
-
-                if self.mahimahi_ptr >= len(self.cooked_bw):
-                    # loop back in the beginning
-                    # note: trace file starts with time 0
-                    self.mahimahi_ptr = 1
-                    self.last_mahimahi_time = 0
+    def get_video_chunk(self, quality):
+
+        assert quality >= 0
+
+        video_chunk_size = self.byte_size_match[self.video_chunk_counter, quality]
+
+        delay, sleep_time, rebuf = self.download_video(video_chunk_size,
+                                                       self.manifest.seg_len_s[self.video_chunk_counter])
 
         # the "last buffer size" return to the controller
         # Note: in old version of dash the lowest buffer is 0.
@@ -201,23 +346,9 @@ class Environment:
             end_of_video = True
             self.buffer_size = 0
             self.video_chunk_counter = 0
+            self.next_trace()
 
-            self.trace_idx += 1
-            if self.trace_idx >= len(self.all_cooked_time):
-                self.trace_idx = 0
-
-            self.cooked_time = self.all_cooked_time[self.trace_idx]
-            self.cooked_bw = self.all_cooked_bw[self.trace_idx]
-
-            # randomize the start point of the video
-            # note: trace file starts with time 0
-
-            self.mahimahi_ptr = self.mahimahi_start_ptr
-            self.last_mahimahi_time = self.cooked_time[self.mahimahi_ptr - 1]
-
-        next_video_chunk_sizes = []
-        for i in range(self.max_quality_level + 1):
-            next_video_chunk_sizes.append(self.byte_size_match.iloc[self.video_chunk_counter, i])
+        next_video_chunk_sizes = list(self.byte_size_match[self.video_chunk_counter])
 
         return delay, \
                sleep_time, \
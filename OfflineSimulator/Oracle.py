@@ -0,0 +1,136 @@
+"""
+Offline oracle: a player which knows the trace in advance. Dynamic programming over the chunks, the state after a chunk
+is its quality level, the buffer and the position on the trace (trace pointer and time). All states of all traces are
+advanced together with the exact trace walk of BatchSimulator, and every state keeps the buffer and trace position of
+the best trajectory which ends in it, so the returned trajectory replays to exactly the returned QoE.
+
+Trajectories of a session which end with the same level, the same trace pointer, in the same buffer bucket and in the
+same bucket of the trace time are merged and only the one with the highest QoE so far is continued. Trajectories which
+end in the same state have the same future, so the merging only loses QoE when it merges trajectories which differ by
+less than a bucket in buffer or trace time. The returned QoE is that of a feasible trajectory, a lower bound of the
+optimal QoE, and it is the optimal QoE when the buckets are small enough that only equal states share a bucket. With
+larger buckets there is no guarantee that a smaller bucket gives a better trajectory, a different merge can go either
+way. Merging doesn't give an upper bound either when the merged state is made optimistic (highest QoE, largest buffer,
+earliest trace time): after the buffer is drained in steps of DRAIN_BUFFER_SLEEP_TIME a larger buffer can end up
+smaller.
+
+The rewards are computed with return_reward_batch of the reward function for the chunk that was downloaded and the one
+before it, the first chunk of a session is its own previous chunk. By default every chunk is scored with its own index
+as in QoEScoring, so the oracle QoE can be compared with score_sessions of logged sessions. MPC.evaluate_video and
+MonteCarlo.run_windows score the last chunk with the manifest entries of chunk 0 (the chunk counter wraps before the
+reward is computed), last_chunk_as_first scores it the same way so the oracle QoE can be compared with run_windows.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from OfflineSimulator.BatchSimulator import download_chunks, drain_buffers
+from OfflineSimulator.OfflineSimulator import MILLISECONDS_IN_SECOND
+
+OracleSolution = namedtuple('OracleSolution', ['qoe_lower_bound', 'levels', 'rebuffer_s', 'n_states'])
+
+
+class OfflineOracle:
+
+    def __init__(self, reward_function, buffer_bucket_ms=1000., time_bucket_ms=1000., last_chunk_as_first=False):
+        """
+        :param reward_function: RewardFunction whose QoE is maximized
+        :param buffer_bucket_ms: width of the buffer buckets
+        :param time_bucket_ms: width of the buckets of the trace time, trajectories at the same trace pointer and in
+        the same buffer and time buckets are merged
+        :param last_chunk_as_first: score the last chunk with the manifest entries of chunk 0 as MPC.evaluate_video and
+        MonteCarlo.run_windows do, instead of with its own
+        """
+        self.reward_function = reward_function
+        self.buffer_bucket_ms = buffer_bucket_ms
+        self.time_bucket_ms = time_bucket_ms
+        self.last_chunk_as_first = last_chunk_as_first
+
+    def solve(self, environment):
+        """
+        :param environment: BatchEnvironment with one session per trace (and its start pointer), all sessions with
+        the same number of chunks
+        :return: OracleSolution with the QoE of the best trajectory found (n_sessions,), a lower bound of the optimal
+        QoE, the quality level of every chunk (n_sessions,n_chunks) and the rebuffering in s of that trajectory, and
+        the number of states after every chunk (n_chunks,)
+        """
+        assert (environment.video_chunk_limit == environment.video_chunk_limit[0]).all(), \
+            'All sessions need the same number of chunks'
+        n_chunks = int(environment.video_chunk_limit[0])
+        n_sessions = environment.n_sessions
+        n_levels = environment.max_quality_level + 1
+
+        # every session starts with a single state, the level of the start state doesn't matter
+        session = np.arange(n_sessions)
+        level = np.zeros(n_sessions, dtype=np.int64)
+        value = np.zeros(n_sessions)
+        buffer_size = np.zeros(n_sessions)
+        mahimahi_ptr = environment.mahimahi_start_ptr.copy()
+        last_mahimahi_time = environment.cooked_time[environment.trace_idx, mahimahi_ptr - 1]
+        rebuffer = np.zeros(n_sessions)
+        # per chunk the index of the state before the chunk of every state after it, and the level of the chunk
+        parents = []
+        levels_of_states = []
+
+        for chunk in range(n_chunks):
+            # every state with every level of the next chunk
+            source = np.repeat(np.arange(len(session)), n_levels)
+            session = session[source]
+            last_level = level[source]
+            level = np.tile(np.arange(n_levels), len(value))
+            if chunk == 0:
+                last_level = level
+
+            video_chunk_size = environment.byte_size_match[chunk, level]
+            delay, next_ptr, next_time = download_chunks(
+                environment.cooked_time, environment.cooked_bw, environment.trace_len,
+                environment.trace_idx[session], mahimahi_ptr[source], last_mahimahi_time[source], video_chunk_size,
+                environment.PACKET_PAYLOAD_PORTION)
+            delay *= MILLISECONDS_IN_SECOND
+            delay += environment.LINK_RTT
+            rebuf = np.maximum(delay - buffer_size[source], 0.0)
+            next_buffer = np.maximum(buffer_size[source] - delay, 0.0)
+            next_buffer += environment.seg_len_s[chunk] * 1000.
+            sleep_time = np.zeros(len(source))
+            exceeded = next_buffer > environment.BUFFER_THRESH
+            sleep_time[exceeded] = np.ceil((next_buffer[exceeded] - environment.BUFFER_THRESH) /
+                                           environment.DRAIN_BUFFER_SLEEP_TIME) * environment.DRAIN_BUFFER_SLEEP_TIME
+            next_buffer[exceeded] -= sleep_time[exceeded]
+            _, next_ptr, next_time = drain_buffers(environment.cooked_time, environment.trace_len,
+                                                   environment.trace_idx[session], next_ptr, next_time, sleep_time)
+
+            rebuf_s = rebuf / MILLISECONDS_IN_SECOND
+            reward_index = 0 if self.last_chunk_as_first and chunk == n_chunks - 1 else chunk
+            next_value = value[source] + self.reward_function.return_reward_batch(environment.manifest, reward_index,
+                                                                                  last_level, level, rebuf_s)
+
+            # keep the best trajectory per reached state, sorted by state and by decreasing QoE within a state
+            keys = np.stack([session, level, next_ptr,
+                             (next_buffer // self.buffer_bucket_ms).astype(np.int64),
+                             (next_time * MILLISECONDS_IN_SECOND // self.time_bucket_ms).astype(np.int64)])
+            order = np.lexsort((-next_value,) + tuple(keys[::-1]))
+            keys = keys[:, order]
+            best = order[np.concatenate([[True], (keys[:, 1:] != keys[:, :-1]).any(axis=0)])]
+
+            session = session[best]
+            level = level[best]
+            value = next_value[best]
+            buffer_size = next_buffer[best]
+            mahimahi_ptr = next_ptr[best]
+            last_mahimahi_time = next_time[best]
+            rebuffer = rebuffer[source[best]] + rebuf_s[best]
+            parents.append(source[best])
+            levels_of_states.append(level)
+
+        # trace the best final state of every session back to the start
+        order = np.lexsort((-value, session))
+        state = order[np.concatenate([[True], session[order[1:]] != session[order[:-1]]])]
+        qoe_lower_bound = value[state]
+        rebuffer_s = rebuffer[state]
+        levels = np.zeros((n_sessions, n_chunks), dtype=np.int64)
+        for chunk in range(n_chunks - 1, -1, -1):
+            levels[:, chunk] = levels_of_states[chunk][state]
+            state = parents[chunk][state]
+        return OracleSolution(qoe_lower_bound=qoe_lower_bound, levels=levels, rebuffer_s=rebuffer_s,
+                              n_states=np.array([len(parent) for parent in parents]))
@@ -0,0 +1,172 @@
+"""
+Re-scores stored sessions under other reward functions without playing them again. The logs of MPC.evaluate_video
+(text logs and .npz partitions) and the inorder_dataframe.csv files of live sessions are loaded in bulk into one
+trajectory table with a row per chunk, which holds everything the reward functions look at. return_reward of the
+reward functions is applied to all chunks of all sessions at once and summed up per session.
+
+The previous chunk of a chunk is the one logged before it, the first chunk of a session is its own previous chunk (no
+smoothing penalty) as in evaluate_video. The rewards of evaluate_video are reproduced exactly, except for the last chunk
+of every session: evaluate_video compares it against the first chunk of the video, as the chunk counter of the
+environment has already wrapped around when the reward is computed.
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from OfflineSimulator.SessionLog import CompletionLedger, list_text_logs, read_session_log, read_text_logs, \
+    LEDGER_NAME, PARTITION_SUFFIX
+
+TRAJECTORY_COLUMNS = ['current_bitrate', 'current_vmaf', 'last_bitrate', 'last_vmaf', 'rebuffering', 'chunk_len_s']
+LIVE_COLUMNS = ['timestamp_start', 'bitrate_level', 'vmaf_level', 'previous_bitrate', 'previous_vmaf', 'seg_len_s',
+                'rebuffer_estimate_0']
+
+
+def session_starts(session):
+    """
+    :param session: categorical session column, the chunks of a session are contiguous
+    :return: index of the first chunk of every session
+    """
+    codes = np.asarray(session.cat.codes if hasattr(session, 'cat') else session)
+    if len(codes) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+
+
+def previous_chunk(values, starts):
+    """
+    :return: value of the previous chunk of the same session, the first chunk of a session keeps its own value
+    """
+    previous = np.empty_like(values)
+    previous[1:] = values[:-1]
+    previous[starts] = values[starts]
+    return previous
+
+
+def trajectories_from_session_log(session_log):
+    """
+    :param session_log: dataframe of read_session_log or read_text_logs
+    :return: trajectory table with one row per chunk
+    """
+    starts = session_starts(session_log['session'])
+    bitrate = session_log['bitrate'].values.astype(np.float64)
+    vmaf = session_log['vmaf'].values.astype(np.float64)
+    return pd.DataFrame({'session': session_log['session'].values,
+                         'current_bitrate': bitrate,
+                         'current_vmaf': vmaf,
+                         'last_bitrate': previous_chunk(bitrate, starts),
+                         'last_vmaf': previous_chunk(vmaf, starts),
+                         'rebuffering': session_log['rebuffer_s'].values,
+                         'chunk_len_s': session_log['seg_len_s'].values})
+
+
+def list_finished_text_logs(folder):
+    """
+    evaluate_video writes the text logs while it plays, a session which was interrupted leaves a partial log. Only the
+    logs in the CompletionLedger of their result folder are finished, folders written before the ledgers existed have
+    none and all of their logs are kept
+    :return: finished text logs in the folder and its subfolders
+    """
+    text_logs = list_text_logs(folder)
+    ledgers = {}
+    finished_text_logs = []
+    for text_log in text_logs:
+        result_folder = os.path.dirname(text_log)
+        if result_folder not in ledgers:
+            ledgers[result_folder] = CompletionLedger(result_folder) if os.path.isfile(
+                os.path.join(result_folder, LEDGER_NAME)) else None
+        if ledgers[result_folder] is None or os.path.basename(text_log) in ledgers[result_folder]:
+            finished_text_logs.append(text_log)
+    return finished_text_logs
+
+
+def load_offline_trajectories(folder):
+    """
+    :param folder: result folder (e.g. Data/Results/<name>/), searched recursively for finished text logs (see
+    list_finished_text_logs) and partitions
+    :return: trajectory table of all sessions, the session column is the path of the text log
+    """
+    columns = ['bitrate', 'vmaf', 'rebuffer_s', 'seg_len_s']
+    session_logs = [read_text_logs(list_finished_text_logs(folder), columns=columns)]
+    if len(glob.glob(os.path.join(glob.escape(folder), '**', '*' + PARTITION_SUFFIX), recursive=True)) > 0:
+        session_logs.append(read_session_log(folder, columns=columns))
+    session_log = pd.concat([session_log.assign(session=session_log['session'].astype(str)) for session_log in
+                             session_logs], ignore_index=True)
+    session_log['session'] = pd.Categorical(session_log['session'],
+                                            categories=pd.unique(session_log['session']))
+    return trajectories_from_session_log(session_log)
+
+
+def load_live_trajectories(paths):
+    """
+    :param paths: inorder_dataframe.csv files or folder which is searched recursively for them
+    :return: trajectory table of all sessions, the session column is the folder of the csv
+    """
+    if isinstance(paths, str):
+        if os.path.isdir(paths):
+            paths = sorted(glob.glob(os.path.join(glob.escape(paths), '**', 'inorder_dataframe.csv'),
+                                     recursive=True))
+        else:
+            paths = [paths]
+    live_sessions = []
+    for path in paths:
+        live_session = pd.read_csv(path, usecols=lambda column: column in LIVE_COLUMNS)
+        live_session = live_session.sort_values('timestamp_start', kind='mergesort')
+        live_session['session'] = os.path.dirname(path)
+        live_sessions.append(live_session)
+    if len(live_sessions) == 0:
+        return pd.DataFrame({column: np.array([], dtype=np.float64) for column in ['session'] + TRAJECTORY_COLUMNS})
+    live_sessions = pd.concat(live_sessions, ignore_index=True, sort=False)
+    current_bitrate = live_sessions['bitrate_level'].values.astype(np.float64)
+    current_vmaf = live_sessions['vmaf_level'].values.astype(np.float64)
+    # the controller sets the previous quality to 0 if nothing was downloaded before the chunk
+    first_chunk = (live_sessions['previous_bitrate'].values == 0) & (live_sessions['previous_vmaf'].values == 0)
+    return pd.DataFrame({'session': pd.Categorical(live_sessions['session'],
+                                                   categories=pd.unique(live_sessions['session'])),
+                         'current_bitrate': current_bitrate,
+                         'current_vmaf': current_vmaf,
+                         'last_bitrate': np.where(first_chunk, current_bitrate,
+                                                  live_sessions['previous_bitrate'].values.astype(np.float64)),
+                         'last_vmaf': np.where(first_chunk, current_vmaf,
+                                               live_sessions['previous_vmaf'].values.astype(np.float64)),
+                         # the rebuffering is unknown for chunks the buffer estimate didn't reach
+                         'rebuffering': live_sessions['rebuffer_estimate_0'].fillna(0.).values,
+                         'chunk_len_s': live_sessions['seg_len_s'].values.astype(np.float64)})
+
+
+def score_chunks(trajectories, reward_function):
+    """
+    :param trajectories: trajectory table
+    :param reward_function: RewardFunction, return_reward is called once with arrays of all chunks
+    :return: reward per chunk
+    """
+    # the columns are named like the keys of the enviroment state
+    enviroment_state = {column: trajectories[column].values for column in TRAJECTORY_COLUMNS}
+    return np.broadcast_to(reward_function.return_reward(enviroment_state), (len(trajectories),))
+
+
+def score_sessions(trajectories, reward_functions):
+    """
+    :param trajectories: trajectory table
+    :param reward_functions: dict of name to RewardFunction
+    :return: dataframe with one row per session, the QoE (sum of the rewards) and mean reward per chunk for every
+    reward function and the totals the rewards are built from
+    """
+    starts = session_starts(trajectories['session'])
+    n_chunks = np.diff(np.append(starts, len(trajectories)))
+    sessions = pd.DataFrame({'n_chunks': n_chunks}, index=pd.Index(
+        np.asarray(trajectories['session'].values)[starts], name='session'))
+    if len(starts) == 0:
+        return sessions
+    for name, reward_function in reward_functions.items():
+        qoe = np.add.reduceat(score_chunks(trajectories, reward_function), starts)
+        sessions['qoe_%s' % name] = qoe
+        sessions['qoe_per_chunk_%s' % name] = qoe / n_chunks
+    sessions['rebuffer_s'] = np.add.reduceat(trajectories['rebuffering'].values, starts)
+    sessions['mean_bitrate'] = np.add.reduceat(trajectories['current_bitrate'].values, starts) / n_chunks
+    sessions['mean_vmaf'] = np.add.reduceat(trajectories['current_vmaf'].values, starts) / n_chunks
+    sessions['n_switches'] = np.add.reduceat(
+        (trajectories['current_bitrate'].values != trajectories['last_bitrate'].values).astype(np.int64), starts)
+    return sessions
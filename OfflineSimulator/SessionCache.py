@@ -0,0 +1,146 @@
+"""
+Content addressed cache of the sessions played by MPC.evaluate_video, shared by all MPC configurations. A session is
+stored under a hash of everything its log depends on: the parameters of the MPC (reward function and its weights,
+lookahead, robust, last_n_probes, predictor and solver), the contents of the video information file and of the trace,
+and the state the session starts in (time stamp and throughput predictor, both carry over from the previous video).
+A session played before is written from the cache instead of being simulated again, no matter under which name the
+MPC is run. The cache is bounded in size, the least recently used sessions are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+from OfflineSimulator.FastMPC import describe_reward_function
+
+# change whenever the simulation changes in a way which changes the logs
+CACHE_VERSION = 1
+ENTRY_SUFFIX = '.session'
+
+
+def describe_mpc(mpc):
+    """
+    :return: JSON string with the parameters of the MPC which change the decisions
+    """
+    return json.dumps({'cache_version': CACHE_VERSION,
+                       'reward_function': describe_reward_function(mpc.reward_function),
+                       'lookahead': mpc.lookahead,
+                       'robust': mpc.robust,
+                       'last_n_probes': mpc.last_n_probes,
+                       'predictor': mpc.predictor,
+                       'predictor_parameters': mpc.predictor_parameters,
+                       # the exact solvers all take the same decisions, the decision tables are approximate
+                       'solver': 'table' if mpc.solver == 'table' else 'exact'}, sort_keys=True, default=str)
+
+
+def file_digest(path):
+    with open(path, 'rb') as content_file:
+        return hashlib.sha256(content_file.read()).hexdigest()
+
+
+class SessionCache:
+
+    def __init__(self, folder='Data/SessionCache/', max_bytes=2 * 1024 ** 3):
+        """
+        :param folder: folder of the cached sessions, one file per session
+        :param max_bytes: size of the cache above which the least recently used sessions are evicted
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        # size of the folder as far as this process knows, None until it has been listed
+        self.n_bytes = None
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __getstate__(self):
+        # every process keeps its own counters
+        state = self.__dict__.copy()
+        state['n_bytes'] = None
+        state['n_hits'] = 0
+        state['n_misses'] = 0
+        return state
+
+    def get_entry_path(self, key):
+        return os.path.join(self.folder, key + ENTRY_SUFFIX)
+
+    def session_key(self, mpc_description, manifest_digest, cooked_time, cooked_bw, time_stamp, predictor):
+        """
+        :param mpc_description: describe_mpc of the MPC
+        :param manifest_digest: file_digest of the video information file
+        :param cooked_time: time stamps of the trace the session is played on
+        :param cooked_bw: bandwidths of the trace the session is played on
+        :param time_stamp: time stamp in ms at the start of the session
+        :param predictor: ThroughputPredictor at the start of the session
+        :return: key of the session
+        """
+        session_hash = hashlib.sha256()
+        session_hash.update(mpc_description.encode())
+        session_hash.update(manifest_digest.encode())
+        session_hash.update(np.ascontiguousarray(cooked_time, dtype=np.float64).tobytes())
+        session_hash.update(np.ascontiguousarray(cooked_bw, dtype=np.float64).tobytes())
+        session_hash.update(repr(float(time_stamp)).encode())
+        session_hash.update(pickle.dumps(predictor, protocol=pickle.HIGHEST_PROTOCOL))
+        return session_hash.hexdigest()
+
+    def get(self, key):
+        """
+        :return: dict with the log lines, the time stamp and the predictor at the end of the session, None if the
+        session isn't cached
+        """
+        entry_path = self.get_entry_path(key)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                entry = pickle.load(entry_file)
+            # the modification time is the last use
+            os.utime(entry_path)
+        except FileNotFoundError:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        return entry
+
+    def put(self, key, lines, time_stamp, predictor):
+        """
+        :param lines: lines of the text log of the session
+        :param time_stamp: time stamp in ms at the end of the session
+        :param predictor: ThroughputPredictor at the end of the session
+        """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        entry_path = self.get_entry_path(key)
+        data = pickle.dumps({'lines': lines, 'time_stamp': time_stamp, 'predictor': predictor},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        with open(entry_path + '.tmp', 'wb') as entry_file:
+            entry_file.write(data)
+        os.replace(entry_path + '.tmp', entry_path)
+        if self.n_bytes is not None:
+            self.n_bytes += len(data)
+        if self.n_bytes is None or self.n_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used sessions until the cache fits into max_bytes
+        """
+        entries = []
+        for file_name in os.listdir(self.folder):
+            if not file_name.endswith(ENTRY_SUFFIX):
+                continue
+            try:
+                entry_stat = os.stat(os.path.join(self.folder, file_name))
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+            entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, file_name))
+        self.n_bytes = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, file_name in sorted(entries):
+            if self.n_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, file_name))
+            except FileNotFoundError:
+                pass
+            self.n_bytes -= entry_size
@@ -0,0 +1,337 @@
+"""
+Columnar alternative to the tab separated logs of MPC.evaluate_video. The chunks of whole sessions are buffered and
+written as one compressed .npz partition with one typed array per column, a session is only written once it is
+complete. Every column is a separate member of the archive, the reader only decompresses the columns it is asked for.
+The finished sessions of a result folder are recorded in an append only ledger, so deciding whether a session has to
+be played doesn't need to open any log.
+"""
+
+import glob
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+# same columns and order as the text logs of MPC.evaluate_video
+LOG_COLUMNS = ['time_stamp_s', 'bitrate', 'vmaf', 'buffer_size_s', 'rebuffer_s', 'video_chunk_size', 'seg_len_s',
+               'delay_ms', 'quality', 'reward']
+LOG_DTYPES = {'time_stamp_s': np.float64,
+              'bitrate': np.float64,
+              'vmaf': np.float64,
+              'buffer_size_s': np.float64,
+              'rebuffer_s': np.float64,
+              'video_chunk_size': np.int64,
+              'seg_len_s': np.float64,
+              'delay_ms': np.float64,
+              'quality': np.int16,
+              'reward': np.float64}
+PARTITION_SUFFIX = '.sessions.npz'
+LEDGER_NAME = 'completed_sessions'
+MIGRATED_MARKER = '#migrated '
+
+
+class SessionLogWriter:
+
+    def __init__(self, folder, ledger=None, sessions_per_partition=1000):
+        """
+        :param folder: folder of the partitions (e.g. Data/Results/<name>/<provider>/)
+        :param ledger: CompletionLedger to which the sessions are added once their partition is written
+        :param sessions_per_partition: buffered sessions after which a partition is written
+        """
+        self.folder = folder
+        self.ledger = ledger
+        self.sessions_per_partition = sessions_per_partition
+        self.session_name = None
+        self.session_rows = []
+        self.session_names = []
+        self.session_columns = []
+
+    def start_session(self, session_name):
+        self.session_name = session_name
+        self.session_rows = []
+
+    def add_chunk(self, *values):
+        """
+        :param values: one value per entry of LOG_COLUMNS
+        """
+        self.session_rows.append(values)
+
+    def end_session(self):
+        columns = list(zip(*self.session_rows))
+        self.session_columns.append([np.asarray(column, dtype=LOG_DTYPES[name]) for name, column in
+                                     zip(LOG_COLUMNS, columns)])
+        self.session_names.append(self.session_name)
+        self.session_name = None
+        self.session_rows = []
+        if len(self.session_names) >= self.sessions_per_partition:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the completed sessions into a new partition, named after its first session
+        """
+        if len(self.session_names) == 0:
+            return
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        arrays = {name: np.concatenate([columns[i] for columns in self.session_columns]) for i, name in
+                  enumerate(LOG_COLUMNS)}
+        arrays['session_names'] = np.array(self.session_names)
+        arrays['session_lengths'] = np.array([len(columns[0]) for columns in self.session_columns], dtype=np.int64)
+        partition_path = os.path.join(self.folder, self.session_names[0] + PARTITION_SUFFIX)
+        with open(partition_path + '.tmp', 'wb') as partition_file:
+            np.savez_compressed(partition_file, **arrays)
+        os.replace(partition_path + '.tmp', partition_path)
+        if self.ledger is not None:
+            self.ledger.add(*self.session_names)
+        self.session_names = []
+        self.session_columns = []
+
+    def close(self):
+        self.flush()
+
+
+class CompletionLedger:
+    """
+    Append only file with the name of every finished session of a result folder, one per line. Sessions are appended
+    with a single write in append mode once they are complete, several processes can share the ledger. Lines starting
+    with MIGRATED_MARKER record for which prefixes the logs written before the ledger existed have been added.
+    """
+
+    def __init__(self, folder):
+        """
+        :param folder: result folder (e.g. Data/Results/<name>/<provider>/)
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, LEDGER_NAME)
+        self.sessions = set()
+        self.migrated_prefixes = set()
+        self.offset = 0
+        self.refresh()
+
+    def __contains__(self, session_name):
+        return session_name in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def refresh(self):
+        """
+        Reads the lines appended since the last refresh
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as ledger_file:
+            ledger_file.seek(self.offset)
+            data = ledger_file.read()
+        # a line which is still being written is picked up by the next refresh
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode().splitlines():
+            if line.startswith(MIGRATED_MARKER):
+                self.migrated_prefixes.add(line[len(MIGRATED_MARKER):])
+            elif line != '':
+                self.sessions.add(line)
+        self.offset += end
+
+    def append(self, lines):
+        if len(lines) == 0:
+            return
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        ledger_fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(ledger_fd, ''.join(line + '\n' for line in lines).encode())
+        finally:
+            os.close(ledger_fd)
+        self.refresh()
+
+    def add(self, *session_names):
+        self.append(list(session_names))
+
+    def migrate(self, prefix, n_chunks):
+        """
+        Adds the sessions starting with prefix which were logged before the ledger existed, once per prefix. Text logs
+        count as finished with the line count check evaluate_video used before, npz sessions if they are in a partition
+        :param prefix: e.g. video_<video_id>_file_id_
+        :param n_chunks: number of chunks of the video
+        """
+        self.refresh()
+        if prefix in self.migrated_prefixes:
+            return
+        finished = set()
+        if os.path.isdir(self.folder):
+            finished.update(load_logged_sessions(self.folder, prefix))
+            for file_name in os.listdir(self.folder):
+                if not file_name.startswith(prefix) or file_name.endswith(PARTITION_SUFFIX) or \
+                        file_name.endswith('.tmp') or file_name in self.sessions:
+                    continue
+                with open(os.path.join(self.folder, file_name), 'r') as log_file:
+                    if len(log_file.read().split('\n')) >= n_chunks:
+                        finished.add(file_name)
+        self.append(sorted(finished - self.sessions) + [MIGRATED_MARKER + prefix])
+
+
+def list_partitions(folder, prefix=''):
+    return sorted(glob.glob(os.path.join(glob.escape(folder), glob.escape(prefix) + '*' + PARTITION_SUFFIX)))
+
+
+def load_logged_sessions(folder, prefix=''):
+    """
+    :return: names of the sessions in the partitions of the folder, only the session tables are read
+    """
+    logged_sessions = set()
+    for partition_path in list_partitions(folder, prefix):
+        with np.load(partition_path) as partition:
+            logged_sessions.update(partition['session_names'].tolist())
+    return logged_sessions
+
+
+def compact_partitions(folder, prefix='', sessions_per_partition=1000):
+    """
+    Merges the partitions of the folder which hold fewer than sessions_per_partition sessions (e.g. the single
+    session partitions of the jobs of a sweep) into partitions of sessions_per_partition sessions. A merged partition
+    is named after its first session and replaces the small partition of that session, the other small partitions are
+    removed once all merged partitions are written. A compaction which is interrupted leaves sessions in two
+    partitions, the next compaction keeps them only once.
+    :param prefix: only partitions starting with prefix
+    :return: number of partitions before and after the compaction
+    """
+    partition_paths = list_partitions(folder, prefix)
+    small_paths = []
+    written = set()
+    for partition_path in partition_paths:
+        with np.load(partition_path) as partition:
+            if len(partition['session_names']) < sessions_per_partition:
+                small_paths.append(partition_path)
+            else:
+                written.update(partition['session_names'].tolist())
+    if len(small_paths) < 2:
+        return len(partition_paths), len(partition_paths)
+
+    writer = SessionLogWriter(folder, sessions_per_partition=sessions_per_partition)
+    merged_paths = set()
+
+    def flush():
+        merged_paths.add(os.path.normpath(os.path.join(folder, writer.session_names[0] + PARTITION_SUFFIX)))
+        writer.flush()
+
+    for partition_path in small_paths:
+        with np.load(partition_path) as partition:
+            arrays = {name: partition[name] for name in LOG_COLUMNS}
+            ends = np.cumsum(partition['session_lengths'])
+            starts = ends - partition['session_lengths']
+            for session_name, start, end in zip(partition['session_names'].tolist(), starts, ends):
+                if session_name in written:
+                    continue
+                written.add(session_name)
+                writer.session_names.append(session_name)
+                writer.session_columns.append([arrays[name][start:end] for name in LOG_COLUMNS])
+                if len(writer.session_names) >= sessions_per_partition:
+                    flush()
+    if len(writer.session_names) > 0:
+        flush()
+    for partition_path in small_paths:
+        if os.path.normpath(partition_path) not in merged_paths:
+            os.remove(partition_path)
+    return len(partition_paths), len(list_partitions(folder, prefix))
+
+
+def read_session_log(paths, columns=None):
+    """
+    :param paths: partition, list of partitions or folder which is searched recursively for partitions
+    :param columns: subset of LOG_COLUMNS, defaults to all of them
+    :return: dataframe with one row per chunk and the session (path the text log would have) of every chunk
+    """
+    if isinstance(paths, str):
+        if os.path.isdir(paths):
+            paths = sorted(glob.glob(os.path.join(glob.escape(paths), '**', '*' + PARTITION_SUFFIX), recursive=True))
+        else:
+            paths = [paths]
+    if columns is None:
+        columns = LOG_COLUMNS
+    session_names = []
+    session_lengths = []
+    data = {column: [] for column in columns}
+    for path in paths:
+        with np.load(path) as partition:
+            session_names.append(np.array([os.path.join(os.path.dirname(path), session_name) for session_name in
+                                           partition['session_names']]))
+            session_lengths.append(partition['session_lengths'])
+            for column in columns:
+                data[column].append(partition[column])
+    session_names = np.concatenate(session_names) if session_names else np.array([], dtype=str)
+    session_lengths = np.concatenate(session_lengths) if session_lengths else np.array([], dtype=np.int64)
+    # an interrupted compaction leaves sessions in two partitions, the first one is kept as in compact_partitions
+    first = np.zeros(len(session_names), dtype=bool)
+    first[np.unique(session_names, return_index=True)[1]] = True
+    rows = np.repeat(first, session_lengths)
+    session_log = pd.DataFrame({'session': pd.Categorical.from_codes(
+        np.repeat(np.arange(first.sum()), session_lengths[first]), categories=session_names[first])})
+    for column in columns:
+        session_log[column] = np.concatenate(data[column])[rows] if data[column] else np.array(
+            [], dtype=LOG_DTYPES[column])
+    return session_log
+
+
+def format_log_line(values):
+    """
+    :param values: one value per entry of LOG_COLUMNS
+    :return: the line of the text log
+    """
+    return '\t'.join(str(value) for value in values) + '\n'
+
+
+def parse_log_line(line):
+    """
+    :return: the values of a line of the text log, typed as in the partitions
+    """
+    return [LOG_DTYPES[name](value) for name, value in zip(LOG_COLUMNS, line.rstrip('\n').split('\t'))]
+
+
+def read_text_log(path):
+    """
+    Reads a text log of MPC.evaluate_video into the same columns
+    """
+    return pd.read_csv(path, sep='\t', names=LOG_COLUMNS, dtype=LOG_DTYPES, float_precision='round_trip')
+
+
+def list_text_logs(folder):
+    """
+    :return: text logs of MPC.evaluate_video in the folder and its subfolders
+    """
+    return sorted(path for path in glob.glob(os.path.join(glob.escape(folder), '**', 'video_*'), recursive=True)
+                  if os.path.isfile(path) and not path.endswith(PARTITION_SUFFIX) and not path.endswith('.tmp'))
+
+
+def read_text_logs(paths, columns=None):
+    """
+    Reads many text logs with a single parser call, the logs are concatenated in memory first
+    :param paths: text logs or folder which is searched recursively for them
+    :param columns: subset of LOG_COLUMNS, defaults to all of them
+    :return: dataframe with the same layout as read_session_log
+    """
+    if isinstance(paths, str):
+        paths = list_text_logs(paths) if os.path.isdir(paths) else [paths]
+    if columns is None:
+        columns = LOG_COLUMNS
+    contents = []
+    session_lengths = np.zeros(len(paths), dtype=np.int64)
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as log_file:
+            content = log_file.read()
+        if content and not content.endswith(b'\n'):
+            content += b'\n'
+        # every line is a chunk, a finished log ends with an empty line
+        session_lengths[i] = content.count(b'\n') - content.count(b'\n\n')
+        contents.append(content)
+    if session_lengths.sum() > 0:
+        text_log = pd.read_csv(io.BytesIO(b''.join(contents)), sep='\t', names=LOG_COLUMNS, usecols=columns,
+                               dtype=LOG_DTYPES, float_precision='round_trip')
+    else:
+        text_log = pd.DataFrame({column: np.array([], dtype=LOG_DTYPES[column]) for column in columns})
+    session_log = pd.DataFrame({'session': pd.Categorical.from_codes(
+        np.repeat(np.arange(len(paths)), session_lengths), categories=list(paths))})
+    for column in columns:
+        session_log[column] = text_log[column].values
+    return session_log
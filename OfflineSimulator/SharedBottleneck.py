@@ -0,0 +1,253 @@
+"""
+Discrete event simulation of many players which share one mahimahi trace as bottleneck. The link capacity of the
+current trace interval is split between the downloading players by generalized processor sharing (fair share, or
+weighted fair share if the players have weights). Events (download finished, player wakes up after draining its
+buffer, trace interval ends) are kept in priority queues and the shares are tracked in virtual time, so each event
+costs O(log n_players).
+"""
+
+import heapq
+import logging
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.OfflineSimulator import MILLISECONDS_IN_SECOND, TraceIndex
+from OfflineSimulator.VideoManifest import VideoManifest
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+class Player:
+    """
+    State of one player. It exposes the same attributes as Environment (video_chunk_counter, manifest,
+    byte_size_match, max_quality_level, get_vmaf, get_bitrate) so that e.g. MPC.solve_lookahead can plan for it.
+    """
+
+    def __init__(self, player_id, manifest, weight=1.0, start_time=0.):
+        self.player_id = player_id
+        self.manifest = manifest
+        self.byte_size_match = manifest.byte_size
+        self.vmaf_match = manifest.vmaf
+        self.bitrate_match = manifest.bitrate
+        self.max_quality_level = manifest.max_quality_level
+        self.TOTAL_VIDEO_CHUNCK = manifest.n_chunks - 1
+        self.weight = weight
+        self.start_time = start_time
+
+        self.video_chunk_counter = 0
+        self.buffer_size = 0
+        self.video_count = 0
+        self.quality = None
+        self.video_chunk_size = None
+        self.request_time = None
+
+    def get_vmaf(self, index, quality):
+        return self.vmaf_match[index, quality]
+
+    def get_bitrate(self, index, quality):
+        return self.bitrate_match[index, quality]
+
+
+class SharedBottleneck:
+
+    def __init__(self,
+                 cooked_time,
+                 cooked_bw,
+                 video_information_csv,
+                 n_players=None,
+                 weights=None,
+                 start_times=None,
+                 BUFFER_THRESH=60.0 * MILLISECONDS_IN_SECOND,
+                 DRAIN_BUFFER_SLEEP_TIME=500.0,
+                 PACKET_PAYLOAD_PORTION=0.95,
+                 LINK_RTT=200,  # millisec,
+                 PACKET_SIZE=1500):
+        """
+        :param cooked_time: time stamps of the shared trace
+        :param cooked_bw: bandwidths of the shared trace
+        :param video_information_csv: path to the *_video_info file or a VideoManifest, or one of them per player
+        :param n_players: number of players, can be omitted if weights are given
+        :param weights: share of each player, defaults to equal shares
+        :param start_times: time in s (relative to the start of the trace) at which each player sends its first
+        request, defaults to 0
+        """
+        self.BUFFER_THRESH = BUFFER_THRESH
+        self.DRAIN_BUFFER_SLEEP_TIME = DRAIN_BUFFER_SLEEP_TIME
+        self.PACKET_PAYLOAD_PORTION = PACKET_PAYLOAD_PORTION
+        self.LINK_RTT = LINK_RTT
+        self.PACKET_SIZE = PACKET_SIZE
+        self.trace_index = TraceIndex(cooked_time, cooked_bw)
+
+        if weights is None:
+            weights = np.ones(n_players)
+        weights = np.asarray(weights, dtype=float)
+        assert (weights > 0).all(), 'Weights have to be positive'
+        n_players = len(weights)
+        if start_times is None:
+            start_times = np.zeros(n_players)
+        if not isinstance(video_information_csv, (list, tuple)):
+            video_information_csv = [video_information_csv] * n_players
+        assert len(video_information_csv) == n_players and len(start_times) == n_players
+
+        self.players = []
+        for player_id, (video_information, weight, start_time) in enumerate(zip(video_information_csv, weights,
+                                                                                start_times)):
+            if not isinstance(video_information, VideoManifest):
+                video_information = get_video_manifest(video_information)
+            self.players.append(Player(player_id, video_information, weight=float(weight),
+                                       start_time=self.trace_index.cooked_time_list[0] + float(start_time)))
+        self.n_players = n_players
+
+    def run(self, policy, max_videos=1, until=None):
+        """
+        Runs the simulation until every player has left or until the given time
+        :param policy: callable(player, chunk_information) -> quality level of the next chunk or None to leave.
+        chunk_information is None for the first request of a player, otherwise the tuple Environment.get_video_chunk
+        returns for the chunk the player just downloaded.
+        :param max_videos: players leave after watching this many videos
+        :param until: stop at this time in s (relative to the start of the trace)
+        :return: dataframe with one row per downloaded chunk
+        """
+        start_time = time()
+        trace_index = self.trace_index
+        cooked_time = trace_index.cooked_time_list
+        capacity = [throughput * self.PACKET_PAYLOAD_PORTION for throughput in trace_index.throughput_list]
+
+        # link state, the link starts in interval 1 at the first time stamp of the trace
+        mahimahi_ptr = 1
+        lap_offset = 0.
+        current_time = cooked_time[0]
+        virtual_time = 0.
+        active_weight = 0.
+        n_downloading = 0
+        downloading = []  # (virtual finish time, sequence, player)
+        waiting = [(player.start_time, player.player_id, player) for player in self.players]  # (wake up time, ...)
+        heapq.heapify(waiting)
+        sequence = 0
+        records = []
+
+        while downloading or waiting:
+            interval_end = lap_offset + cooked_time[mahimahi_ptr]
+            next_time = interval_end
+            event = 'interval'
+            if downloading and capacity[mahimahi_ptr] > 0:
+                finish_time = current_time + (downloading[0][0] - virtual_time) * active_weight / capacity[
+                    mahimahi_ptr]
+                if finish_time <= next_time:
+                    next_time = finish_time
+                    event = 'finish'
+            if waiting and waiting[0][0] < next_time:
+                next_time = waiting[0][0]
+                event = 'wake'
+            if until is not None and next_time > cooked_time[0] + until:
+                break
+
+            if event == 'finish':
+                virtual_time = downloading[0][0]
+            elif n_downloading > 0:
+                virtual_time += (next_time - current_time) * capacity[mahimahi_ptr] / active_weight
+            current_time = next_time
+
+            if event == 'interval':
+                mahimahi_ptr += 1
+                if mahimahi_ptr > trace_index.n_intervals:
+                    # loop back in the beginning
+                    # note: trace file starts with time 0
+                    mahimahi_ptr = 1
+                    lap_offset += cooked_time[-1]
+                continue
+
+            if event == 'wake':
+                _, _, player = heapq.heappop(waiting)
+                if player.quality is None:
+                    player.quality = policy(player, None)
+                    if player.quality is None:
+                        continue
+                player.video_chunk_size = player.byte_size_match[player.video_chunk_counter, player.quality]
+                player.request_time = current_time
+                heapq.heappush(downloading, (virtual_time + player.video_chunk_size / player.weight, sequence, player))
+                sequence += 1
+                n_downloading += 1
+                active_weight += player.weight
+                continue
+
+            # every download whose finish tag has been reached is done
+            while downloading and downloading[0][0] <= virtual_time:
+                _, _, player = heapq.heappop(downloading)
+                n_downloading -= 1
+                active_weight = active_weight - player.weight if n_downloading > 0 else 0.
+                chunk_information = self.finish_download(player, current_time)
+                records.append((player.player_id, player.video_count, current_time - cooked_time[0],
+                                player.quality) + chunk_information[:5] + (chunk_information[7],))
+                if chunk_information[6]:
+                    player.video_count += 1
+                player.quality = None
+                if player.video_count < max_videos:
+                    player.quality = policy(player, chunk_information)
+                if player.quality is not None:
+                    heapq.heappush(waiting, (current_time + chunk_information[1] / MILLISECONDS_IN_SECOND,
+                                             player.player_id, player))
+
+        logger.info('Simulated %d players and %d chunks up to %.2f s, took %.2f' % (
+            self.n_players, len(records), current_time - cooked_time[0], time() - start_time))
+        return pd.DataFrame(records, columns=['player', 'video', 'time_s', 'quality', 'delay_ms', 'sleep_time_ms',
+                                              'buffer_size_s', 'rebuffer_s', 'video_chunk_size',
+                                              'video_chunk_remain'])
+
+    def finish_download(self, player, current_time):
+        """
+        Same buffer bookkeeping as Environment.get_video_chunk
+        :return: the tuple Environment.get_video_chunk returns, the sleep time is the full time the player waits
+        """
+        delay = (current_time - player.request_time) * MILLISECONDS_IN_SECOND
+        delay += self.LINK_RTT
+
+        # rebuffer time
+        rebuf = np.maximum(delay - player.buffer_size, 0.0)
+
+        # update the buffer
+        player.buffer_size = np.maximum(player.buffer_size - delay, 0.0)
+
+        # add in the new chunk
+        player.buffer_size += player.manifest.seg_len_s[player.video_chunk_counter] * 1000.  # buffer size is in ms
+
+        # sleep if buffer gets too large
+        sleep_time = 0
+        if player.buffer_size > self.BUFFER_THRESH:
+            drain_buffer_time = player.buffer_size - self.BUFFER_THRESH
+            sleep_time = np.ceil(drain_buffer_time / self.DRAIN_BUFFER_SLEEP_TIME) * \
+                         self.DRAIN_BUFFER_SLEEP_TIME
+            player.buffer_size -= sleep_time
+
+        return_buffer_size = player.buffer_size
+
+        player.video_chunk_counter += 1
+        video_chunk_remain = player.TOTAL_VIDEO_CHUNCK - player.video_chunk_counter
+
+        end_of_video = False
+        if player.video_chunk_counter >= player.TOTAL_VIDEO_CHUNCK:
+            end_of_video = True
+            player.buffer_size = 0
+            player.video_chunk_counter = 0
+
+        next_video_chunk_sizes = list(player.byte_size_match[player.video_chunk_counter])
+
+        return delay, \
+               sleep_time, \
+               return_buffer_size / MILLISECONDS_IN_SECOND, \
+               rebuf / MILLISECONDS_IN_SECOND, \
+               player.video_chunk_size, \
+               next_video_chunk_sizes, \
+               end_of_video, \
+               video_chunk_remain
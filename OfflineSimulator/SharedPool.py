@@ -0,0 +1,192 @@
+"""
+Publishes the traces and the video manifests once into a single shared memory block so that simulation workers
+(e.g. a multiprocessing.Pool running MPC.evaluate_video) attach to them by name instead of loading their own copies.
+The owner creates the block, workers only get read only views on it.
+"""
+
+import logging
+import os
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from OfflineSimulator.ManifestRegistry import MANIFEST_REGISTRY, get_video_manifest
+from OfflineSimulator.TraceStore import TRACE_FOLDERS, concatenate_traces, list_trace_files
+from OfflineSimulator.VideoManifest import VideoManifest
+
+ARRAY_ALIGNMENT = 64
+MANIFEST_ARRAYS = ['byte_size', 'vmaf', 'bitrate', 'seg_len_s', 'time_s']
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+def pack_arrays(arrays):
+    """
+    Copies the arrays into a new shared memory block
+    :param arrays: dict of name -> array
+    :return: the shared memory block, layout name -> (offset, dtype, shape)
+    """
+    layout = {}
+    size = 0
+    for key, array in arrays.items():
+        size = -(-size // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+        layout[key] = (size, array.dtype.str, array.shape)
+        size += array.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for key, array in arrays.items():
+        offset, dtype, shape = layout[key]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = array
+    return shm, layout
+
+
+def view_arrays(shm, layout):
+    """
+    :return: dict of name -> read only view on the shared memory block
+    """
+    arrays = {}
+    for key, (offset, dtype, shape) in layout.items():
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[key] = array
+    return arrays
+
+
+class SharedPoolView:
+    """
+    Read only access to a published pool, can be used as trace_store of load_trace and MPC
+    """
+
+    def __init__(self, description, shm):
+        self.description = description
+        self.shm = shm
+        self.arrays = view_arrays(shm, description['layout'])
+        self.data = self.arrays['traces']
+        self.index = {'traces': description['traces']}
+        self.manifests = {}
+        for path, manifest_information in description['manifests'].items():
+            self.manifests[path] = VideoManifest.from_arrays(
+                path, *[self.arrays[(path, name)] for name in MANIFEST_ARRAYS], **manifest_information)
+
+    def __contains__(self, file_path):
+        return os.path.abspath(file_path) in self.index['traces']
+
+    def __len__(self):
+        return len(self.index['traces'])
+
+    def trace_files(self):
+        return sorted(self.index['traces'].keys())
+
+    def get(self, file_path):
+        """
+        :param file_path: path of the source trace
+        :return: zero copy views on the time stamps and the bandwidths of the trace
+        """
+        entry = self.index['traces'][os.path.abspath(file_path)]
+        offset, length = entry['offset'], entry['length']
+        return self.data[0, offset:offset + length], self.data[1, offset:offset + length]
+
+    def video_manifest(self, video_information_csv):
+        return self.manifests[os.path.abspath(video_information_csv)]
+
+    def register_manifests(self):
+        """
+        Puts the shared manifests into the process wide registry, Environment then picks them up by path
+        """
+        for path, manifest in self.manifests.items():
+            MANIFEST_REGISTRY.add(VideoManifest, path, manifest, mtime_ns=self.description['manifest_mtime_ns'][path])
+
+    def nbytes(self):
+        return self.shm.size
+
+    def close(self):
+        self.arrays = {}
+        self.data = None
+        self.manifests = {}
+        self.shm.close()
+
+
+class SharedPool(SharedPoolView):
+    """
+    Owner of the shared memory block, it has to outlive every worker and is unlinked on close
+    """
+
+    def __init__(self, trace_folders=None, video_information_csvs=(), trace_store=None):
+        """
+        :param trace_folders: folders which are walked for traces, defaults to TRACE_FOLDERS
+        :param video_information_csvs: paths to *_video_info files which are published as well
+        :param trace_store: TraceStore which is copied instead of parsing the trace folders
+        """
+        if trace_store is not None:
+            data, traces = trace_store.data, trace_store.index['traces']
+        else:
+            if trace_folders is None:
+                trace_folders = TRACE_FOLDERS
+            data, traces = concatenate_traces(list_trace_files(trace_folders))
+        arrays = {'traces': data}
+        manifests = {}
+        manifest_mtime_ns = {}
+        for video_information_csv in video_information_csvs:
+            path = os.path.abspath(video_information_csv)
+            manifest = get_video_manifest(path)
+            for name in MANIFEST_ARRAYS:
+                arrays[(path, name)] = getattr(manifest, name)
+            manifests[path] = {'video_duration': manifest.video_duration,
+                               'byte_size_columns': manifest.byte_size_columns,
+                               'vmaf_columns': manifest.vmaf_columns,
+                               'bitrate_columns': manifest.bitrate_columns}
+            manifest_mtime_ns[path] = os.stat(path).st_mtime_ns
+        shm, layout = pack_arrays(arrays)
+        description = {'name': shm.name,
+                       'layout': layout,
+                       'traces': traces,
+                       'manifests': manifests,
+                       'manifest_mtime_ns': manifest_mtime_ns}
+        super().__init__(description, shm)
+        logger.info('Published %d traces and %d manifests in %s (%.1f MB)' % (
+            len(traces), len(manifests), shm.name, shm.size / 1e6))
+
+    def close(self):
+        super().close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def attach_pool(description):
+    """
+    Attaches to a pool published by another process
+    :param description: SharedPool.description of the owner
+    :return: SharedPoolView
+    """
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=description['name'], track=False)
+    else:
+        # Workers started by multiprocessing share the resource tracker of the owner, registering again is a no op
+        shm = shared_memory.SharedMemory(name=description['name'])
+    return SharedPoolView(description, shm)
+
+
+WORKER_POOL = None
+
+
+def init_worker(description):
+    """
+    Initializer for multiprocessing.Pool, the attached pool is kept in WORKER_POOL and its manifests are registered so
+    that MPC(trace_store=WORKER_POOL) runs without reading a single trace or video file
+    """
+    global WORKER_POOL
+    WORKER_POOL = attach_pool(description)
+    WORKER_POOL.register_manifests()
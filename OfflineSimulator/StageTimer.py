@@ -0,0 +1,140 @@
+"""
+Per stage wall clock counters for the offline evaluation. A stage is timed from the end of the previous one, so timing
+a loop body costs one perf_counter call per stage. Every stage keeps its total, count, maximum and a histogram with
+four logarithmic bins per decade. NullStageTimer has the same interface and does nothing, it is used when timing is
+switched off.
+"""
+
+import json
+import math
+from time import perf_counter
+
+HISTOGRAM_MIN_S = 1e-7
+HISTOGRAM_BINS_PER_DECADE = 4
+HISTOGRAM_N_BINS = 8 * HISTOGRAM_BINS_PER_DECADE + 1  # 100 ns to 10 s, the last bin collects everything above
+
+
+def histogram_edges_s():
+    return [HISTOGRAM_MIN_S * 10 ** (i / HISTOGRAM_BINS_PER_DECADE) for i in range(HISTOGRAM_N_BINS)]
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.maxima = {}
+        self.histograms = {}
+
+    def start(self):
+        """
+        :return: start time of the first stage
+        """
+        return perf_counter()
+
+    def stop(self, stage, start_time):
+        """
+        Records the time since start_time for the stage
+        :return: start time of the next stage
+        """
+        now = perf_counter()
+        self.record(stage, now - start_time)
+        return now
+
+    def record(self, stage, elapsed_s):
+        if stage not in self.totals:
+            self.totals[stage] = 0.
+            self.counts[stage] = 0
+            self.maxima[stage] = 0.
+            self.histograms[stage] = [0] * HISTOGRAM_N_BINS
+        self.totals[stage] += elapsed_s
+        self.counts[stage] += 1
+        self.maxima[stage] = max(self.maxima[stage], elapsed_s)
+        if elapsed_s <= HISTOGRAM_MIN_S:
+            histogram_bin = 0
+        else:
+            histogram_bin = min(int(math.log10(elapsed_s / HISTOGRAM_MIN_S) * HISTOGRAM_BINS_PER_DECADE),
+                                HISTOGRAM_N_BINS - 1)
+        self.histograms[stage][histogram_bin] += 1
+
+    def merge(self, other):
+        """
+        Adds the counters of another StageTimer (e.g. of a session or of a worker)
+        """
+        if isinstance(other, dict):
+            other = StageTimer.from_summary(other)
+        for stage in other.totals:
+            if stage not in self.totals:
+                self.totals[stage] = 0.
+                self.counts[stage] = 0
+                self.maxima[stage] = 0.
+                self.histograms[stage] = [0] * HISTOGRAM_N_BINS
+            self.totals[stage] += other.totals[stage]
+            self.counts[stage] += other.counts[stage]
+            self.maxima[stage] = max(self.maxima[stage], other.maxima[stage])
+            self.histograms[stage] = [a + b for a, b in zip(self.histograms[stage], other.histograms[stage])]
+
+    def total_s(self):
+        return sum(self.totals.values())
+
+    def summary(self):
+        """
+        :return: JSON serializable dict with the counters of every stage
+        """
+        return {'histogram_edges_s': histogram_edges_s(),
+                'stages': {stage: {'total_s': self.totals[stage],
+                                   'count': self.counts[stage],
+                                   'mean_s': self.totals[stage] / self.counts[stage],
+                                   'max_s': self.maxima[stage],
+                                   'histogram': self.histograms[stage]} for stage in self.totals}}
+
+    @classmethod
+    def from_summary(cls, summary):
+        stage_timer = cls()
+        for stage, counters in summary['stages'].items():
+            stage_timer.totals[stage] = counters['total_s']
+            stage_timer.counts[stage] = counters['count']
+            stage_timer.maxima[stage] = counters['max_s']
+            stage_timer.histograms[stage] = list(counters['histogram'])
+        return stage_timer
+
+    def to_json(self, path=None):
+        """
+        :param path: file to write the summary to
+        :return: the summary as JSON string
+        """
+        summary = json.dumps(self.summary())
+        if path is not None:
+            with open(path, 'w') as json_file:
+                json_file.write(summary)
+        return summary
+
+    def format(self):
+        """
+        :return: one line with the share of every stage
+        """
+        total_s = self.total_s()
+        return ', '.join('%s %.1f ms (%.0f%%)' % (stage, self.totals[stage] * 1e3,
+                                                  100. * self.totals[stage] / total_s if total_s > 0 else 0.)
+                         for stage in self.totals)
+
+
+class NullStageTimer(StageTimer):
+    """
+    Timer which records nothing
+    """
+
+    def start(self):
+        return 0.
+
+    def stop(self, stage, start_time):
+        return 0.
+
+    def record(self, stage, elapsed_s):
+        pass
+
+    def merge(self, other):
+        pass
+
+
+NULL_STAGE_TIMER = NullStageTimer()
@@ -0,0 +1,203 @@
+"""
+Parallel sweep of MPC.evaluate_video over a grid of (MPC configuration, video, trace). Every job plays one video on
+one trace and writes the same log as evaluate_video, so the output of a job doesn't depend on the number of workers
+or on the order in which the jobs finish. With log_format='npz' every job writes its own partition, once all jobs ran
+the partitions of every result folder are merged into partitions of sessions_per_partition sessions. Jobs which are
+in the completion ledger are skipped, an interrupted sweep continues where it stopped. With a SessionCache in the
+configurations, jobs which were played before under another name are written from the cache. The traces and
+manifests are published once in a SharedPool and the workers are recycled after maxtasksperchild jobs, which keeps the
+memory of the pool bounded.
+"""
+
+import logging
+import multiprocessing
+import os
+from collections import namedtuple
+from time import time
+
+import pandas as pd
+
+from OfflineSimulator import SharedPool
+from OfflineSimulator.MPC import MPC
+from OfflineSimulator.ManifestRegistry import get_video_manifest
+from OfflineSimulator.SessionLog import compact_partitions
+from OfflineSimulator.StageTimer import StageTimer
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+SweepJob = namedtuple('SweepJob', ['job_idx', 'config_idx', 'video_information_csv', 'video_id', 'trace_folder',
+                                   'trace_file'])
+
+
+def expand_jobs(configs, video_information_csvs, trace_folder, trace_files=None):
+    """
+    :param configs: list of keyword arguments of MPC (name, reward_function, last_n_probes, ...)
+    :param video_information_csvs: paths to the *_video_info files
+    :param trace_folder: folder containing the traces, with trailing slash as for evaluate_video
+    :param trace_files: file names of the traces in trace_folder, defaults to all of them
+    :return: list of SweepJob in a fixed order
+    """
+    if trace_files is None:
+        trace_files = os.listdir(trace_folder)
+    jobs = []
+    for config_idx in range(len(configs)):
+        for video_information_csv in sorted(video_information_csvs):
+            video_id = os.path.basename(video_information_csv).replace('_video_info', '').strip()
+            for trace_file in sorted(trace_files):
+                jobs.append(SweepJob(len(jobs), config_idx, video_information_csv, video_id, trace_folder,
+                                     trace_file))
+    return jobs
+
+
+WORKER_CONFIGS = None
+WORKER_MPC = {}
+
+
+def init_sweep_worker(configs, pool_description=None):
+    """
+    Initializer of the sweep workers, the MPC instances are created once per worker and configuration
+    """
+    global WORKER_CONFIGS
+    WORKER_CONFIGS = configs
+    WORKER_MPC.clear()
+    if pool_description is not None:
+        SharedPool.init_worker(pool_description)
+
+
+def run_job(job):
+    """
+    :return: job, the time it took in s and the stage times of the job (None if the configuration doesn't time them)
+    """
+    start_time = time()
+    if job.config_idx not in WORKER_MPC:
+        config = dict(WORKER_CONFIGS[job.config_idx])
+        # the shared pool replaces the trace store of the configuration, without it the configuration keeps its own
+        if SharedPool.WORKER_POOL is not None or 'trace_store' not in config:
+            config['trace_store'] = SharedPool.WORKER_POOL
+        WORKER_MPC[job.config_idx] = MPC(**config)
+    mpc = WORKER_MPC[job.config_idx]
+    if mpc.timing:
+        mpc.stage_timer = StageTimer()
+    mpc.evaluate_video(trace_path=job.trace_folder, video_file=job.video_information_csv, video_id=job.video_id,
+                       filter_traces=[job.trace_file])
+    return job, time() - start_time, mpc.stage_timer.summary() if mpc.timing else None
+
+
+class SweepRunner:
+
+    def __init__(self,
+                 configs,
+                 video_information_csvs,
+                 trace_folder,
+                 trace_files=None,
+                 n_processes=None,
+                 maxtasksperchild=50,
+                 use_shared_pool=True,
+                 log_every=100,
+                 sessions_per_partition=1000):
+        """
+        :param configs: list of keyword arguments of MPC, every configuration needs its own name. With use_shared_pool
+        the workers map the traces from the shared pool, a trace_store in a configuration is only used without it
+        :param video_information_csvs: paths to the *_video_info files
+        :param trace_folder: folder containing the traces, with trailing slash as for evaluate_video
+        :param trace_files: file names of the traces in trace_folder, defaults to all of them
+        :param n_processes: number of workers, defaults to the number of cores
+        :param maxtasksperchild: jobs after which a worker is replaced by a fresh process
+        :param use_shared_pool: publish the traces and manifests in shared memory instead of loading them per worker
+        :param log_every: report the progress every log_every sessions
+        :param sessions_per_partition: sessions per partition after the compaction of configurations with
+        log_format='npz'
+        """
+        names = [config['name'] for config in configs]
+        assert len(set(names)) == len(names), 'Every configuration needs its own name'
+        self.configs = configs
+        self.video_information_csvs = video_information_csvs
+        self.trace_folder = trace_folder
+        self.n_processes = n_processes if n_processes is not None else os.cpu_count()
+        self.maxtasksperchild = maxtasksperchild
+        self.use_shared_pool = use_shared_pool
+        self.log_every = log_every
+        self.sessions_per_partition = sessions_per_partition
+        self.jobs = expand_jobs(configs, video_information_csvs, trace_folder, trace_files)
+        self.mpcs = [MPC(**config) for config in configs]
+        # stage times of all jobs of configurations with timing=True
+        self.stage_timer = StageTimer()
+
+    def get_log_path(self, job):
+        return self.mpcs[job.config_idx].get_log_path(job.video_information_csv, job.video_id, job.trace_file)
+
+    def pending_jobs(self):
+        """
+        :return: jobs which are not in the completion ledger of their result folder
+        """
+        ledgers = {}
+        pending_jobs = []
+        for job in self.jobs:
+            if (job.config_idx, job.video_information_csv) not in ledgers:
+                ledgers[(job.config_idx, job.video_information_csv)] = self.mpcs[job.config_idx].get_ledger(
+                    job.video_information_csv, job.video_id, get_video_manifest(job.video_information_csv).n_chunks)
+            if os.path.basename(self.get_log_path(job)) not in ledgers[(job.config_idx, job.video_information_csv)]:
+                pending_jobs.append(job)
+        return pending_jobs
+
+    def compact(self, jobs):
+        """
+        Merges the single session partitions which the jobs of configurations with log_format='npz' have written
+        """
+        folders = set()
+        for job in jobs:
+            if self.mpcs[job.config_idx].log_format == 'npz':
+                folders.add((os.path.dirname(self.get_log_path(job)), 'video_%s_file_id_' % job.video_id))
+        for folder, prefix in sorted(folders):
+            n_before, n_after = compact_partitions(folder, prefix, self.sessions_per_partition)
+            logger.info('Compacted %d partitions of %s into %d' % (n_before, folder + '/' + prefix, n_after))
+
+    def run(self):
+        """
+        Runs every pending job
+        :return: dataframe with one row per job run, in job order
+        """
+        jobs = self.pending_jobs()
+        logger.info('%d of %d sessions are pending' % (len(jobs), len(self.jobs)))
+        if len(jobs) == 0:
+            # an interrupted sweep may have left its partitions uncompacted
+            self.compact(self.jobs)
+            return pd.DataFrame(columns=list(SweepJob._fields) + ['duration_s'])
+
+        shared_pool = None
+        pool_description = None
+        if self.use_shared_pool:
+            shared_pool = SharedPool.SharedPool(trace_folders=[self.trace_folder], video_information_csvs=sorted(
+                set(job.video_information_csv for job in jobs)))
+            pool_description = shared_pool.description
+        records = []
+        start_time = time()
+        try:
+            with multiprocessing.Pool(self.n_processes, initializer=init_sweep_worker,
+                                      initargs=(self.configs, pool_description),
+                                      maxtasksperchild=self.maxtasksperchild) as pool:
+                for job, duration_s, stage_times in pool.imap_unordered(run_job, jobs):
+                    records.append(tuple(job) + (duration_s,))
+                    if stage_times is not None:
+                        self.stage_timer.merge(stage_times)
+                    if len(records) % self.log_every == 0 or len(records) == len(jobs):
+                        elapsed = time() - start_time
+                        sessions_per_s = len(records) / elapsed
+                        logger.info('%d/%d sessions, %.1f sessions/s, %.0f s left' % (
+                            len(records), len(jobs), sessions_per_s, (len(jobs) - len(records)) / sessions_per_s))
+        finally:
+            if shared_pool is not None:
+                shared_pool.close()
+        if len(self.stage_timer.totals) > 0:
+            logger.info('Stage times %s' % self.stage_timer.format())
+        self.compact(self.jobs)
+        return pd.DataFrame(records, columns=list(SweepJob._fields) + ['duration_s']).sort_values(
+            'job_idx').reset_index(drop=True)
@@ -0,0 +1,205 @@
+"""
+Incremental throughput predictors for MPC, the batched simulations and the live BWEstimator. Every predictor keeps
+its history in fixed size sliding windows, so an update costs the same no matter how long the session is, and handles
+n_sessions sessions at once (the scalar case is n_sessions=1). Samples and predictions are in Mbit/s.
+"""
+
+import warnings
+
+import numpy as np
+
+
+class SlidingWindow:
+    """
+    The last size samples of every session, ordered from the oldest to the newest sample. The window is shifted on
+    every push, which for the small windows of the predictors is cheaper than reordering it on every read.
+    """
+
+    def __init__(self, n_sessions, size):
+        self.values = np.zeros((n_sessions, size))
+        self.count = np.zeros(n_sessions, dtype=np.int64)
+        self.size = size
+        self.columns = np.arange(size)
+
+    def push(self, values):
+        self.values[:, :-1] = self.values[:, 1:]
+        self.values[:, -1] = values
+        self.count += 1
+
+    def clear(self, mask=None):
+        # the values are zeroed as well, so a cleared buffer doesn't depend on what it held before
+        if mask is None:
+            self.values[:] = 0.
+            self.count[:] = 0
+        else:
+            self.values[mask] = 0.
+            self.count[mask] = 0
+
+    def window(self):
+        """
+        :return: values (n_sessions,size) ordered from the oldest to the newest sample and which of them are filled
+        """
+        valid = self.columns[None, :] >= self.size - np.minimum(self.count, self.size)[:, None]
+        return self.values, valid
+
+
+class ThroughputPredictor:
+
+    def __init__(self, n_sessions=1):
+        self.n_sessions = n_sessions
+
+    def update(self, throughput):
+        """
+        :param throughput: measured throughput of the last download per session
+        """
+        raise NotImplementedError()
+
+    def predict(self):
+        """
+        :return: predicted throughput per session
+        """
+        raise NotImplementedError()
+
+    def reset(self, mask=None):
+        """
+        Forgets the samples of the sessions in mask (all of them by default), e.g. at the end of a video
+        """
+        raise NotImplementedError()
+
+
+class HarmonicMean(ThroughputPredictor):
+    """
+    Harmonic mean of the last window samples as in MPC, leading zero samples of the window are skipped. The sum is
+    accumulated from the oldest to the newest sample like the original list version, so the predictions are the same
+    bit for bit.
+    """
+
+    def __init__(self, n_sessions=1, window=5):
+        super().__init__(n_sessions)
+        self.samples = SlidingWindow(n_sessions, window)
+
+    def update(self, throughput):
+        self.samples.push(throughput)
+
+    def predict(self):
+        values, valid = self.samples.window()
+        valid &= np.logical_or.accumulate(values != 0., axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # accumulate adds the columns strictly in order, unlike sum
+            bandwidth_sum = np.add.accumulate(np.where(valid, 1. / values, 0.), axis=1)[:, -1]
+            return 1.0 / (bandwidth_sum / valid.sum(axis=1))
+
+    def reset(self, mask=None):
+        self.samples.clear(mask)
+
+
+class EWMA(ThroughputPredictor):
+    """
+    Exponentially weighted moving average, the first sample after a reset initializes it
+    """
+
+    def __init__(self, n_sessions=1, alpha=0.3):
+        """
+        :param alpha: weight of the newest sample
+        """
+        super().__init__(n_sessions)
+        self.alpha = alpha
+        self.average = np.full(n_sessions, np.nan)
+
+    def update(self, throughput):
+        throughput = np.broadcast_to(np.asarray(throughput, dtype=float), self.average.shape)
+        self.average = np.where(np.isnan(self.average), throughput,
+                                self.alpha * throughput + (1. - self.alpha) * self.average)
+
+    def predict(self):
+        return self.average.copy()
+
+    def reset(self, mask=None):
+        if mask is None:
+            self.average[:] = np.nan
+        else:
+            self.average[mask] = np.nan
+
+
+class SlidingPercentile(ThroughputPredictor):
+    """
+    Percentile of the last window samples, e.g. a low percentile as a conservative estimate
+    """
+
+    def __init__(self, n_sessions=1, window=5, percentile=50.):
+        super().__init__(n_sessions)
+        self.percentile = percentile
+        self.samples = SlidingWindow(n_sessions, window)
+
+    def update(self, throughput):
+        self.samples.push(throughput)
+
+    def predict(self):
+        values, valid = self.samples.window()
+        with warnings.catch_warnings():
+            # sessions without samples predict nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanpercentile(np.where(valid, values, np.nan), self.percentile, axis=1)
+
+    def reset(self, mask=None):
+        self.samples.clear(mask)
+
+
+class RobustDiscount(ThroughputPredictor):
+    """
+    RobustMPC: the prediction of the base predictor divided by 1 + the largest relative prediction error of the last
+    window samples. The error of a sample is measured against the undiscounted prediction made before it.
+    """
+
+    def __init__(self, predictor, window=5, reset_errors=False):
+        """
+        :param predictor: base ThroughputPredictor
+        :param reset_errors: forget the errors on reset as well, MPC.evaluate_video keeps them across videos
+        """
+        super().__init__(predictor.n_sessions)
+        self.predictor = predictor
+        self.reset_errors = reset_errors
+        self.errors = SlidingWindow(predictor.n_sessions, window)
+        self.last_prediction = np.full(predictor.n_sessions, np.nan)
+
+    def update(self, throughput):
+        throughput = np.asarray(throughput, dtype=float)
+        # no error for the first sample since nothing has been predicted yet
+        error = np.where(np.isnan(self.last_prediction), 0.,
+                         np.abs(self.last_prediction - throughput) / throughput)
+        self.errors.push(error)
+        self.predictor.update(throughput)
+        self.last_prediction = self.predictor.predict()
+
+    def predict(self):
+        values, valid = self.errors.window()
+        max_error = np.max(np.where(valid, values, -np.inf), axis=1)
+        return self.last_prediction / (1 + max_error)
+
+    def reset(self, mask=None):
+        self.predictor.reset(mask)
+        if self.reset_errors:
+            self.errors.clear(mask)
+            if mask is None:
+                self.last_prediction[:] = np.nan
+            else:
+                self.last_prediction[mask] = np.nan
+
+
+PREDICTORS = {'harmonic': HarmonicMean,
+              'ewma': EWMA,
+              'percentile': SlidingPercentile}
+
+
+def make_predictor(name, n_sessions=1, robust=False, **predictor_parameters):
+    """
+    :param name: key of PREDICTORS
+    :param robust: wrap the predictor in RobustDiscount
+    :param predictor_parameters: passed on to the predictor (window, alpha, percentile)
+    :return: ThroughputPredictor
+    """
+    assert name in PREDICTORS, 'Unknown predictor %s' % name
+    predictor = PREDICTORS[name](n_sessions=n_sessions, **predictor_parameters)
+    if robust:
+        predictor = RobustDiscount(predictor)
+    return predictor
@@ -0,0 +1,252 @@
+"""
+Compiled binary store of the mahimahi traces. All traces are concatenated into a single .npy file which is memory
+mapped on load, a .json index keeps offset, length and source mtime of every trace. The store is recompiled as soon as
+a source trace is added, removed or modified. Next to the store a .features.csv keeps statistics of every trace (mean,
+percentiles, coefficient of variation, outage time, duration), traces can be selected by them without loading any
+trace data.
+"""
+
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from OfflineSimulator.OfflineSimulator import parse_trace_file
+
+TRACE_FOLDERS = ['Data/Traces/']
+TRACE_STORE_PATH = 'Data/TraceStore/traces'
+FEATURES_SUFFIX = '.features.csv'
+FEATURE_PERCENTILES = {'p10_mbit': 10, 'p25_mbit': 25, 'median_mbit': 50, 'p75_mbit': 75, 'p90_mbit': 90}
+# bandwidth below which the link counts as down
+OUTAGE_MBIT = 0.1
+
+LOGGING_LEVEL = logging.INFO
+
+handler = logging.StreamHandler()
+handler.setLevel(LOGGING_LEVEL)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGING_LEVEL)
+logger.addHandler(handler)
+
+
+def list_trace_files(trace_folders):
+    """
+    Walks the trace folders recursively (e.g. Data/Traces/PAMTrace/)
+    :return: sorted absolute paths of all trace files
+    """
+    trace_files = []
+    for trace_folder in trace_folders:
+        for (dirpath, dirnames, filenames) in os.walk(trace_folder):
+            trace_files.extend([os.path.abspath(os.path.join(dirpath, f)) for f in filenames])
+    return sorted(trace_files)
+
+
+def concatenate_traces(trace_files, dtype='float64'):
+    """
+    Parses the traces into one array, row 0 holds the time stamps and row 1 the bandwidths
+    :param trace_files: absolute paths of the traces
+    :return: data (2,total_length), offset, length and source mtime of every trace
+    """
+    parsed_traces = [parse_trace_file(trace_file) for trace_file in trace_files]
+    lengths = [len(cooked_time) for cooked_time, _ in parsed_traces]
+    offsets = np.cumsum([0] + lengths)
+    data = np.empty((2, offsets[-1]), dtype=dtype)
+    traces = {}
+    for trace_file, (cooked_time, cooked_bw), offset, length in zip(trace_files, parsed_traces, offsets, lengths):
+        data[0, offset:offset + length] = cooked_time
+        data[1, offset:offset + length] = cooked_bw
+        traces[trace_file] = {'offset': int(offset),
+                              'length': int(length),
+                              'mtime_ns': os.stat(trace_file).st_mtime_ns}
+    return data, traces
+
+
+def compute_trace_features(data, traces, outage_mbit=OUTAGE_MBIT):
+    """
+    Statistics of all traces at once on the concatenated data. Interval p of a trace lasts from cooked_time[p-1] to
+    cooked_time[p] with bandwidth cooked_bw[p] (as in the simulator), all statistics are weighted with the duration of
+    the intervals. A percentile is the lowest bandwidth the trace stays at or below for that share of its duration.
+    :param data: (2,total_length) as written by concatenate_traces
+    :param traces: offset and length of every trace
+    :param outage_mbit: bandwidth below which the time counts as outage
+    :return: dataframe with one row per trace
+    """
+    trace_files = sorted(traces.keys())
+    offsets = np.array([traces[trace_file]['offset'] for trace_file in trace_files], dtype=np.int64)
+    lengths = np.array([traces[trace_file]['length'] for trace_file in trace_files], dtype=np.int64)
+    n_traces = len(trace_files)
+    trace_id = np.repeat(np.arange(n_traces), lengths)
+    positions = (np.concatenate([np.arange(offset, offset + length) for offset, length in zip(offsets, lengths)])
+                 if n_traces > 0 else np.array([], dtype=np.int64))
+    cooked_time = np.asarray(data[0], dtype=np.float64)[positions]
+    cooked_bw = np.asarray(data[1], dtype=np.float64)[positions]
+    starts = np.cumsum(lengths) - lengths
+
+    # the first sample of a trace only starts its first interval
+    duration = np.diff(cooked_time, prepend=cooked_time[:1])
+    duration[starts[lengths > 0]] = 0.
+    duration_s = np.bincount(trace_id, duration, minlength=n_traces)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_mbit = np.bincount(trace_id, duration * cooked_bw, minlength=n_traces) / duration_s
+        std_mbit = np.sqrt(np.bincount(trace_id, duration * (cooked_bw - mean_mbit[trace_id]) ** 2,
+                                       minlength=n_traces) / duration_s)
+        features = {'trace_file': trace_files,
+                    'n_samples': lengths,
+                    'duration_s': duration_s,
+                    'mean_mbit': mean_mbit,
+                    'std_mbit': std_mbit,
+                    'cv': std_mbit / mean_mbit}
+
+    # sorted by bandwidth within every trace, a percentile is where the accumulated duration reaches its share
+    order = np.lexsort((cooked_bw, trace_id))
+    accumulated = np.cumsum(duration[order])
+    accumulated_before = np.concatenate([[0.], accumulated])[starts]
+    last = np.maximum(starts + lengths - 1, 0)
+    for name, percentile in FEATURE_PERCENTILES.items():
+        position = np.searchsorted(accumulated, accumulated_before + duration_s * percentile / 100., side='left')
+        position = np.clip(position, starts, last)
+        features[name] = np.where(duration_s > 0, cooked_bw[order][position] if len(order) > 0 else np.nan, np.nan)
+    features['outage_s'] = np.bincount(trace_id, duration * (cooked_bw < outage_mbit), minlength=n_traces)
+    return pd.DataFrame(features)
+
+
+def write_trace_features(data, traces, store_path):
+    """
+    Computes the features of the traces and writes them next to the store
+    :return: the features
+    """
+    features = compute_trace_features(data, traces)
+    with open(store_path + FEATURES_SUFFIX + '.tmp', 'w') as features_file:
+        features.to_csv(features_file, index=False)
+    os.replace(store_path + FEATURES_SUFFIX + '.tmp', store_path + FEATURES_SUFFIX)
+    return features
+
+
+def compile_traces(trace_folders=None, store_path=TRACE_STORE_PATH, dtype='float64'):
+    """
+    Parses every trace once and writes the store
+    :param trace_folders: folders which are walked for traces
+    :param store_path: path of the store without extension
+    :param dtype: float64 keeps the simulation results identical to parsing the text files, float32 halves the size
+    :return: the index of the store
+    """
+    if trace_folders is None:
+        trace_folders = TRACE_FOLDERS
+    trace_files = list_trace_files(trace_folders)
+    logger.info('Compiling %d traces into %s' % (len(trace_files), store_path))
+    data, traces = concatenate_traces(trace_files, dtype=dtype)
+    index = {'dtype': dtype,
+             'trace_folders': sorted(os.path.abspath(trace_folder) for trace_folder in trace_folders),
+             'traces': traces}
+
+    store_folder = os.path.dirname(store_path)
+    if store_folder != '' and not os.path.exists(store_folder):
+        os.makedirs(store_folder)
+    # Write to temporary files first so that readers never see a half written store
+    with open(store_path + '.npy.tmp', 'wb') as data_file:
+        np.save(data_file, data)
+    os.replace(store_path + '.npy.tmp', store_path + '.npy')
+    with open(store_path + '.json.tmp', 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(store_path + '.json.tmp', store_path + '.json')
+    write_trace_features(data, traces, store_path)
+    return index
+
+
+class TraceStore:
+    """
+    Read only view on the compiled traces
+    """
+
+    def __init__(self, trace_folders=None, store_path=TRACE_STORE_PATH, dtype='float64'):
+        """
+        :param trace_folders: folders which are walked for traces, defaults to TRACE_FOLDERS
+        :param store_path: path of the store without extension
+        :param dtype: dtype of the store, a store with a different dtype is recompiled
+        """
+        if trace_folders is None:
+            trace_folders = TRACE_FOLDERS
+        self.trace_folders = trace_folders
+        self.store_path = store_path
+        self.dtype = dtype
+        if self.is_stale():
+            compile_traces(trace_folders=self.trace_folders, store_path=self.store_path, dtype=self.dtype)
+        with open(self.store_path + '.json', 'r') as index_file:
+            self.index = json.load(index_file)
+        self.data = np.load(self.store_path + '.npy', mmap_mode='r')
+        self.features = None
+
+    def is_stale(self):
+        if not os.path.exists(self.store_path + '.npy') or not os.path.exists(self.store_path + '.json'):
+            return True
+        with open(self.store_path + '.json', 'r') as index_file:
+            index = json.load(index_file)
+        if index['dtype'] != self.dtype:
+            return True
+        if index['trace_folders'] != sorted(os.path.abspath(trace_folder) for trace_folder in self.trace_folders):
+            return True
+        trace_files = list_trace_files(self.trace_folders)
+        if len(trace_files) != len(index['traces']):
+            return True
+        for trace_file in trace_files:
+            if trace_file not in index['traces']:
+                return True
+            if os.stat(trace_file).st_mtime_ns != index['traces'][trace_file]['mtime_ns']:
+                return True
+        return False
+
+    def __contains__(self, file_path):
+        return os.path.abspath(file_path) in self.index['traces']
+
+    def __len__(self):
+        return len(self.index['traces'])
+
+    def trace_files(self):
+        return sorted(self.index['traces'].keys())
+
+    def get_features(self):
+        """
+        :return: dataframe with the statistics of every trace (see compute_trace_features), computed from the store
+        if it was compiled without them
+        """
+        if self.features is None:
+            if os.path.exists(self.store_path + FEATURES_SUFFIX):
+                self.features = pd.read_csv(self.store_path + FEATURES_SUFFIX)
+            else:
+                self.features = write_trace_features(self.data, self.index['traces'], self.store_path)
+        return self.features
+
+    def select(self, expression, trace_folder=None):
+        """
+        :param expression: condition on the feature columns for DataFrame.query, e.g. 'median_mbit < 2'
+        :param trace_folder: only traces in this folder, their file names are returned relative to it (as
+        keep_traces of load_trace and trace_files of SweepRunner expect them)
+        :return: sorted paths of the matching traces
+        """
+        trace_files = self.get_features().query(expression)['trace_file'].tolist()
+        if trace_folder is None:
+            return sorted(trace_files)
+        trace_folder = os.path.abspath(trace_folder)
+        return sorted(os.path.relpath(trace_file, trace_folder) for trace_file in trace_files
+                      if trace_file.startswith(trace_folder + os.sep))
+
+    def get(self, file_path):
+        """
+        :param file_path: path of the source trace
+        :return: zero copy views on the time stamps and the bandwidths of the trace
+        """
+        entry = self.index['traces'][os.path.abspath(file_path)]
+        offset, length = entry['offset'], entry['length']
+        return self.data[0, offset:offset + length], self.data[1, offset:offset + length]
+
+
+if __name__ == '__main__':
+    # python -m OfflineSimulator.TraceStore Data/Traces/ VimeoMobile/resources/traces/
+    folders = sys.argv[1:] if len(sys.argv) > 1 else TRACE_FOLDERS
+    store = TraceStore(trace_folders=folders)
+    logger.info('%d traces in %s.npy' % (len(store), store.store_path))
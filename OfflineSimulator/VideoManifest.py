@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+def extract_sorted(key_str, column):
+    column = list(filter(lambda c: key_str in c, column))
+    column = sorted(column,
+                    key=lambda c: np.array(c.split('_')[0].split('x')).astype(float).prod()
+                    )
+    return column
+
+
+class VideoManifest:
+    """
+    Parsed *_video_info file. Quality levels are sorted by the number of pixels of the representation, every per chunk
+    value is kept in a contiguous (n_chunks,n_levels) array so that lookups don't go through pandas.
+    """
+
+    def __init__(self, video_information_csv):
+        """
+        :param video_information_csv: path to the *_video_info file
+        """
+        self.path = video_information_csv
+        self.video_information_csv = pd.read_csv(video_information_csv)
+        self.video_information_csv['time_s'] = self.video_information_csv.seg_len_s.cumsum()
+        columns = self.video_information_csv.columns
+        self.byte_size_columns = extract_sorted('byte', columns)
+        self.vmaf_columns = extract_sorted('vmaf', columns)
+        self.bitrate_columns = extract_sorted('bitrate', columns)
+
+        self.byte_size = np.ascontiguousarray(self.video_information_csv[self.byte_size_columns].values)
+        self.vmaf = np.ascontiguousarray(self.video_information_csv[self.vmaf_columns].values)
+        self.bitrate = np.ascontiguousarray(self.video_information_csv[self.bitrate_columns].values)
+        self.seg_len_s = np.ascontiguousarray(self.video_information_csv.seg_len_s.values)
+        self.time_s = np.ascontiguousarray(self.video_information_csv.time_s.values)
+
+        self.n_chunks, self.n_levels = self.byte_size.shape
+        self.max_quality_level = self.n_levels - 1
+        self.video_duration = self.video_information_csv.seg_len_s.sum()
+
+    @classmethod
+    def from_arrays(cls, path, byte_size, vmaf, bitrate, seg_len_s, time_s, video_duration, byte_size_columns=None,
+                    vmaf_columns=None, bitrate_columns=None):
+        """
+        Builds a manifest around existing arrays (e.g. views on shared memory) without reading the csv, the
+        dataframe itself is not available on such a manifest
+        """
+        manifest = cls.__new__(cls)
+        manifest.path = path
+        manifest.video_information_csv = None
+        manifest.byte_size_columns = byte_size_columns
+        manifest.vmaf_columns = vmaf_columns
+        manifest.bitrate_columns = bitrate_columns
+        manifest.byte_size = byte_size
+        manifest.vmaf = vmaf
+        manifest.bitrate = bitrate
+        manifest.seg_len_s = seg_len_s
+        manifest.time_s = time_s
+        manifest.n_chunks, manifest.n_levels = byte_size.shape
+        manifest.max_quality_level = manifest.n_levels - 1
+        manifest.video_duration = video_duration
+        return manifest
+
+
+def load_quality_mapper(video_quality_mapper):
+    """
+    :param video_quality_mapper: path to the *_video_quality_mapper file
+    :return: dataframe with contained_in_url parsed into lists
+    """
+    video_quality_mapper = pd.read_csv(video_quality_mapper, index_col=0)
+    video_quality_mapper.contained_in_url = video_quality_mapper.contained_in_url.map(
+        lambda cnt_url: [x.strip()[1:-1] for x in cnt_url[1:-1].split(',')] if
+        cnt_url.startswith('[') else [cnt_url])
+    return video_quality_mapper
+
+
+class RangeMapper:
+    """
+    Parsed *_video_info_range_mapper file of the providers with dynamic chunk sizes, maps byte offsets of a quality
+    level to playback time
+    """
+
+    def __init__(self, video_range_mapper):
+        """
+        :param video_range_mapper: path to the *_video_info_range_mapper file
+        """
+        self.path = video_range_mapper
+        self.range_mapper = pd.read_csv(video_range_mapper, index_col=0)
+        self.range_mapper['quality_level'] = self.range_mapper.reset_index()['itag'].map({v: k for k, v in enumerate(
+            self.range_mapper.groupby('itag').vmaf_score.mean().sort_values().index.values)}).astype(int).values
+        self.quality_byte_mapper = {k: group.byterange.sort_values().values for k, group in self.range_mapper.groupby(
+            'quality_level')}
+        # playback time and byte offset of every frame per quality level
+        self.time_s = {}
+        self.byte_offset = {}
+        for k, group in self.range_mapper.groupby('quality_level'):
+            group = group.sort_values('time_s')
+            self.time_s[k] = np.ascontiguousarray(group.time_s.values)
+            self.byte_offset[k] = np.ascontiguousarray(group.byterange.values)
+        self.n_levels = len(self.time_s)
+        self.video_duration = min(time_s[-1] for time_s in self.time_s.values())
+        self.range_mapper = self.range_mapper.reset_index().set_index(['byterange', 'quality_level'])
+
+    def map_byte_to_time(self, byte, quality_level):
+        closest_index = np.searchsorted(self.quality_byte_mapper[quality_level], byte)
+        closest_value = self.quality_byte_mapper[quality_level][closest_index]
+        return self.range_mapper.loc[(closest_value, quality_level)].time_s
+
+    def map_time_to_frame(self, time_s, quality_level):
+        """
+        :return: index of the first frame of the quality level which starts at or after time_s
+        """
+        return min(np.searchsorted(self.time_s[quality_level], time_s), len(self.time_s[quality_level]) - 1)
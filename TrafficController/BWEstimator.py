@@ -4,17 +4,31 @@ from collections import deque
 
 import psutil
 
+from OfflineSimulator.ThroughputPredictor import make_predictor
+
 
 class BWEstimator:
     """
     Reads out the received and sent bytes from the given interface
     """
 
-    def __init__(self, BW_Estimator_Rate=3, network_interface='wlp4s0'):
+    def __init__(self, BW_Estimator_Rate=3, network_interface='wlp4s0', predictor=None, predictor_parameters=None,
+                 robust=False):
+        """
+        :param predictor: optional key of ThroughputPredictor.PREDICTORS, every rate sample is fed into it and
+        obtain_prediction returns its prediction (the same predictors as in the offline MPC)
+        :param predictor_parameters: passed on to the predictor
+        :param robust: discount the prediction by the recent prediction errors (robustMPC)
+        """
         self.dt = BW_Estimator_Rate
         self.interface = network_interface
         self.transfer_rate_queue = deque(maxlen=3)
         self.run_calculation = False
+        self.predictor = None
+        self.predictor_lock = threading.Lock()
+        if predictor is not None:
+            self.predictor = make_predictor(predictor, robust=robust,
+                                            **(predictor_parameters if predictor_parameters is not None else {}))
 
     def stop(self):
         """
@@ -39,6 +53,12 @@ class BWEstimator:
         except:
             return -1
 
+    def obtain_prediction(self):
+        if self.predictor is None or len(self.transfer_rate_queue) == 0:
+            return -1
+        with self.predictor_lock:
+            return float(self.predictor.predict()[0])
+
     def calculate_download_speed(self):
         """
         Simple download speed calculation
@@ -54,6 +74,9 @@ class BWEstimator:
             download_rate *= 8e-6  # to mbit/s
             if download_rate > .1:
                 self.transfer_rate_queue.append(download_rate)
+                if self.predictor is not None:
+                    with self.predictor_lock:
+                        self.predictor.update(download_rate)
                 last_download_counter = current_download_counter
 
     def print_rate(self):
@@ -9,9 +9,13 @@ class TCControllerFilePolicy(TCPolicy):
     Load the file given and adapts its policy according to that
     """
 
-    def __init__(self, name, file, sep):
+    def __init__(self, name, file, sep, trace_store=None):
         super().__init__(name)
-        self.sample_file = pd.read_csv(file, sep=sep, names=['time', 'mbit'])
+        if trace_store is not None and file in trace_store:
+            cooked_time, cooked_bw = trace_store.get(file)
+            self.sample_file = pd.DataFrame({'time': cooked_time, 'mbit': cooked_bw})
+        else:
+            self.sample_file = pd.read_csv(file, sep=sep, names=['time', 'mbit'])
         self.sample_counter = 0
         self.time_now = 0
         self.name = name
@@ -8,6 +8,8 @@ import blist
 import numpy as np
 import pandas as pd
 
+from OfflineSimulator.ManifestRegistry import get_video_manifest, get_quality_mapper
+
 LOGGING_LEVEL = logging.INFO
 
 handler = logging.StreamHandler()
@@ -58,6 +60,7 @@ class TCFeedbackControllerChunk(ABC):
         self.current_throttle_mbit = float(base_throttle_mbit)
         self.base_latency_ms = base_latency_ms
         self.byte_size_match = None
+        self.video_manifest = None
         if pw is None:
             pw = ''
         logger.info('Set password to %s,len() = %d' % (pw, len(pw)))
@@ -154,36 +157,19 @@ class TCFeedbackControllerChunk(ABC):
 
     def load_video_information(self, path_video_id):
         path_to_csv = path_video_id + '_video_info'
+        self.video_manifest = get_video_manifest(path_to_csv)
+        self.video_information_csv = self.video_manifest.video_information_csv
+        self.byte_size_match = self.video_manifest.byte_size
+        self.vmaf_match = self.video_manifest.vmaf
+        self.bitrate_match = self.video_manifest.bitrate
+        self.bitrate_encoded_mapper = {k: v for k, v in enumerate(np.nanmean(self.bitrate_match, axis=0))}
 
-        def extract_sorted(key_str, column):
-            column = list(filter(lambda c: key_str in c, column))
-            column = sorted(column,
-                            key=lambda c: np.array(c.split('_')[0].split('x')).astype(float).prod()
-                            )
-            return column
-
-        self.video_information_csv = pd.read_csv(path_to_csv)
-        self.video_information_csv['time_s'] = self.video_information_csv.seg_len_s.cumsum()
-        self.byte_size_match = extract_sorted('byte', self.video_information_csv.columns)
-        self.byte_size_match = self.video_information_csv[self.byte_size_match]
-
-        self.vmaf_match = extract_sorted('vmaf', self.video_information_csv.columns)
-        self.vmaf_match = self.video_information_csv[self.vmaf_match]
-
-        self.bitrate_match = extract_sorted('bitrate', self.video_information_csv.columns)
-        self.bitrate_match = self.video_information_csv[self.bitrate_match]
-        self.bitrate_encoded_mapper = {k: v for k, v in enumerate(self.bitrate_match.mean(0).values)}
-
-        self.max_quality_level = self.byte_size_match.shape[1] - 1
-        self.video_duration = self.video_information_csv.seg_len_s.sum()
-
+        self.max_quality_level = self.video_manifest.max_quality_level
+        self.video_duration = self.video_manifest.video_duration
 
     def load_quality_mapper(self, path_video_id):
         quality_mapper = path_video_id + '_video_quality_mapper'
-        self.video_quality_mapper = pd.read_csv(quality_mapper, index_col=0)
-        self.video_quality_mapper.contained_in_url = self.video_quality_mapper.contained_in_url.map(
-            lambda cnt_url: [x.strip()[1:-1] for x in cnt_url[1:-1].split(',')] if
-            cnt_url.startswith('[') else [cnt_url])
+        self.video_quality_mapper = get_quality_mapper(quality_mapper)
 
     def parse_newly_downloaded(self, newly_downloaded):
         parsed_entry_index = 0
@@ -202,7 +188,7 @@ class TCFeedbackControllerChunk(ABC):
                 newly_downloaded.remove(parsed_entry)
                 logger.info('Removed entry still have %d new entries' % (len(newly_downloaded)))
                 continue
-            seg_len_s = self.video_information_csv.seg_len_s.iloc[n_segment]
+            seg_len_s = self.video_manifest.seg_len_s[n_segment]
             quality_level_chosen = self.video_quality_mapper.contained_in_url.map(lambda cnt_url: sum(
                 [True if c in parsed_entry['url'] else False for c in cnt_url]) > 0)
             if quality_level_chosen.values.sum() != 1:
@@ -214,12 +200,12 @@ class TCFeedbackControllerChunk(ABC):
 
             parsed_entry_index += 1
             parsed_entry['seg_len_s'] = seg_len_s
-            parsed_entry['t_start'] = np.around(self.video_information_csv.time_s.iloc[n_segment] - seg_len_s, 2)
+            parsed_entry['t_start'] = np.around(self.video_manifest.time_s[n_segment] - seg_len_s, 2)
             parsed_entry['t_end'] = np.around(parsed_entry['t_start'] + seg_len_s, 2)
             quality_level_chosen = self.video_quality_mapper.quality_level[quality_level_chosen].values[0]
             parsed_entry['quality_level_chosen'] = quality_level_chosen
-            parsed_entry['bitrate_level'] = self.bitrate_match.iloc[n_segment].values[quality_level_chosen]
-            parsed_entry['vmaf_level'] = self.vmaf_match.iloc[n_segment].values[quality_level_chosen]
+            parsed_entry['bitrate_level'] = self.bitrate_match[n_segment, quality_level_chosen]
+            parsed_entry['vmaf_level'] = self.vmaf_match[n_segment, quality_level_chosen]
 
     def parse_newly_recorded(self, newly_recorded):
         logger.debug('Parsing newly recorded files %d' % len(newly_recorded))
@@ -291,15 +277,10 @@ class TCFeedbackControllerChunk(ABC):
                                   a_max=self.max_quality_level)
         for shift_index, actual_shift in zip(self.shifts, possible_shifts):
             if n_segment < len(self.byte_size_match):
-                parsed_entry['quality_shift_byte_%d' % shift_index] = self.byte_size_match.iloc[
-                    n_segment].values[
-                    actual_shift]
-                parsed_entry['quality_shift_vmaf_%d' % shift_index] = self.vmaf_match.iloc[
-                    n_segment].values[
-                    actual_shift]
-                parsed_entry['quality_shift_bitrate_%d' % shift_index] = self.bitrate_match.iloc[
-                    n_segment].values[
-                    actual_shift]
+                parsed_entry['quality_shift_byte_%d' % shift_index] = self.byte_size_match[n_segment, actual_shift]
+                parsed_entry['quality_shift_vmaf_%d' % shift_index] = self.vmaf_match[n_segment, actual_shift]
+                parsed_entry['quality_shift_bitrate_%d' % shift_index] = self.bitrate_match[
+                    n_segment, actual_shift]
             else:
                 parsed_entry['quality_shift_byte_%d' % shift_index] = np.nan
                 parsed_entry['quality_shift_vmaf_%d' % shift_index] = np.nan
@@ -721,12 +702,13 @@ class TCFeedbackControllerFile(TCFeedbackControllerChunkSampler):
     def __init__(self, file_paths, separator, network_interface='wlp4s0', pw=None, logging=True,
                  model_instance_type='default', base_latency_ms='200', base_throttle_mbit='3.', min_bandwidth_mbit=0.75,
                  max_bandwidth_mbit=8., max_shift=2, buffer_inaccuarcy_s=0.5, throttle_type='selenium',
-                 mode='iterative'):
+                 mode='iterative', trace_store=None):
 
         super().__init__(network_interface, pw, logging, model_instance_type, base_latency_ms, base_throttle_mbit,
                          min_bandwidth_mbit, max_bandwidth_mbit, max_shift, buffer_inaccuarcy_s, throttle_type)
         self.file_paths = file_paths
         self.separator = separator
+        self.trace_store = trace_store  # OfflineSimulator.TraceStore, used instead of parsing the files if given
         accepted_modes = ['iterative', 'random']
         assert mode in accepted_modes, 'Choose an accepted mode from %s' % accepted_modes
         self.mode = mode
@@ -752,7 +734,11 @@ class TCFeedbackControllerFile(TCFeedbackControllerChunkSampler):
         self.set_sample_file(self.file_paths[self.current_index])
 
     def set_sample_file(self, file_path):
-        self.sample_file = pd.read_csv(file_path, sep=self.separator, names=['time', 'mbit'])
+        if self.trace_store is not None and file_path in self.trace_store:
+            cooked_time, cooked_bw = self.trace_store.get(file_path)
+            self.sample_file = pd.DataFrame({'time': cooked_time, 'mbit': cooked_bw})
+        else:
+            self.sample_file = pd.read_csv(file_path, sep=self.separator, names=['time', 'mbit'])
         logger.info('Setting next %s traces' % file_path)
         first_time = self.sample_file.time.values[0]
         self.sample_file.time = self.sample_file.time.diff().fillna(first_time)
@@ -2,8 +2,8 @@ import logging
 from abc import ABC
 
 import numpy as np
-import pandas as pd
 
+from OfflineSimulator.ManifestRegistry import get_range_mapper
 from TrafficController.TCFeedbackControllerChunk import TCFeedbackControllerChunk, \
     TCFeedbackControllerFile, TCFeedbackControllerChunkConstant
 
@@ -36,18 +36,13 @@ class TCFeedbackControllerContinuous(TCFeedbackControllerChunk, ABC):
     def load_range_mapper(self, path_video_id):
         path_to_csv = path_video_id + '_video_info_range_mapper'
         logger.debug('Loading %s as range mapper' % path_video_id)
-        self.range_mapper = pd.read_csv(path_to_csv, index_col=0)
-        self.range_mapper['quality_level'] = self.range_mapper.reset_index()['itag'].map({v: k for k, v in enumerate(
-            self.range_mapper.groupby('itag').mean().sort_values('vmaf_score').index.values)}).astype(int).values
-        self.quality_byte_mapper = {k: group.byterange.sort_values().values for k, group in self.range_mapper.groupby(
-            'quality_level')}
+        self.video_range_mapper = get_range_mapper(path_to_csv)
+        self.range_mapper = self.video_range_mapper.range_mapper
+        self.quality_byte_mapper = self.video_range_mapper.quality_byte_mapper
         logger.debug('Available quality levels %s' % self.quality_byte_mapper.keys())
-        self.range_mapper = self.range_mapper.reset_index().set_index(['byterange', 'quality_level'])
 
     def map_byte_to_time(self, byte, quality_level):
-        closest_index = np.searchsorted(self.quality_byte_mapper[quality_level], byte)
-        closest_value = self.quality_byte_mapper[quality_level][closest_index]
-        return self.range_mapper.loc[(closest_value, quality_level)].time_s
+        return self.video_range_mapper.map_byte_to_time(byte, quality_level)
 
     def parse_newly_downloaded(self, newly_downloaded):
         parsed_entry_index = 0
@@ -71,10 +66,10 @@ class TCFeedbackControllerContinuous(TCFeedbackControllerChunk, ABC):
                                                 2)
             parsed_entry['t_end'] = np.around(self.map_byte_to_time(parsed_entry['byte_end'], quality_level_chosen), 2)
             parsed_entry['seg_len_s'] = parsed_entry['t_end'] - parsed_entry['t_start']
-            n_segment = np.searchsorted(self.video_information_csv.time_s, parsed_entry['t_start'])
+            n_segment = np.searchsorted(self.video_manifest.time_s, parsed_entry['t_start'])
             parsed_entry['n_segment'] = n_segment
-            parsed_entry['bitrate_level'] = self.bitrate_match.iloc[n_segment].values[quality_level_chosen]
-            parsed_entry['vmaf_level'] = self.vmaf_match.iloc[n_segment].values[quality_level_chosen]
+            parsed_entry['bitrate_level'] = self.bitrate_match[n_segment, quality_level_chosen]
+            parsed_entry['vmaf_level'] = self.vmaf_match[n_segment, quality_level_chosen]
 
 
 class TCFeedbackControllerContinuousConstant(TCFeedbackControllerChunkConstant, TCFeedbackControllerContinuous):
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from OfflineSimulator.LookaheadSolver import BranchAndBoundLookahead, VectorizedLookahead
+from OfflineSimulator.MPC import MPC, BitrateQoE, VMAFQoE
+from OfflineSimulator.OfflineSimulator import Environment
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VIDEO_INFORMATION_CSV = os.path.join(REPOSITORY, 'Data/VideoInformation/Vimeo_Info/105646584_video_info')
+
+
+@pytest.mark.parametrize('reward_function', [BitrateQoE(), VMAFQoE()])
+@pytest.mark.parametrize('lookahead', [8, 9])
+def test_branch_and_bound_agrees_with_vectorized(reward_function, lookahead):
+    net_env = Environment(all_cooked_time=[[0., 1.]], all_cooked_bw=[[1., 1.]],
+                          video_information_csv=VIDEO_INFORMATION_CSV)
+    branch_and_bound = BranchAndBoundLookahead()
+    vectorized = VectorizedLookahead()
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        net_env.video_chunk_counter = int(rng.integers(1, net_env.manifest.n_chunks))
+        last_level = int(rng.integers(0, net_env.max_quality_level + 1))
+        future_bandwidth = float(rng.uniform(0.2, 8.))
+        current_buffer = float(rng.uniform(0., 20000.))
+        _, exact_level = vectorized.solve(net_env, reward_function, lookahead, last_level=last_level,
+                                          future_bandwidth=future_bandwidth, current_buffer=current_buffer)
+        _, level = branch_and_bound.solve(net_env, reward_function, lookahead, last_level=last_level,
+                                          future_bandwidth=future_bandwidth, current_buffer=current_buffer)
+        assert level == exact_level
+    assert branch_and_bound.total_nodes_expanded > 0
+
+
+def test_nodes_expanded_are_reported_per_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('traces/')
+    for trace_file in sorted(os.listdir(os.path.join(REPOSITORY, 'Data/Traces')))[:2]:
+        shutil.copy(os.path.join(REPOSITORY, 'Data/Traces', trace_file), 'traces/')
+    logs = {}
+    for solver in ['vectorized', 'branch_and_bound']:
+        MPC(solver, VMAFQoE(), last_n_probes=5, lookahead=8, solver=solver, timing=True).evaluate_video(
+            'traces/', VIDEO_INFORMATION_CSV, '105646584')
+        result_folder = 'Data/Results/%s/Vimeo_Info/' % solver
+        logs[solver] = {file_name: open(result_folder + file_name).read() for file_name in
+                        os.listdir(result_folder) if file_name.startswith('video_')}
+    assert logs['vectorized'] == logs['branch_and_bound']
+
+    with open('Data/Results/branch_and_bound/Vimeo_Info/stage_timings.jsonl', 'r') as timing_file:
+        sessions = [json.loads(line) for line in timing_file]
+    assert len(sessions) == 2
+    assert all(session['nodes_expanded'] > 0 for session in sessions)
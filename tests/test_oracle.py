@@ -0,0 +1,65 @@
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from OfflineSimulator.BatchSimulator import BatchEnvironment
+from OfflineSimulator.MonteCarlo import run_windows
+from OfflineSimulator.MPC import BitrateQoE, VMAFQoE
+from OfflineSimulator.Oracle import OfflineOracle
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VIDEO_INFORMATION_CSV = os.path.join(REPOSITORY, 'Data/VideoInformation/Vimeo_Info/105646584_video_info')
+N_CHUNKS = 7
+BUFFER_THRESH = 12000.
+
+
+def synthetic_trace():
+    # a trace on which merging by buffer alone misses the optimum
+    random_state = np.random.RandomState(10)
+    return np.arange(1., 121.) * 0.5, random_state.choice([0.3, 1., 4., 12.], 120)
+
+
+def brute_force(cooked_time, cooked_bw, reward_function, last_chunk_as_first):
+    environment = BatchEnvironment([cooked_time], [cooked_bw], VIDEO_INFORMATION_CSV, video_chunk_limit=N_CHUNKS,
+                                   BUFFER_THRESH=BUFFER_THRESH)
+    trajectories = np.array(list(itertools.product(range(environment.max_quality_level + 1), repeat=N_CHUNKS)))
+    environment = BatchEnvironment([cooked_time], [cooked_bw], VIDEO_INFORMATION_CSV,
+                                   trace_indices=np.zeros(len(trajectories), dtype=np.int64),
+                                   video_chunk_limit=N_CHUNKS, BUFFER_THRESH=BUFFER_THRESH)
+    qoe = np.zeros(len(trajectories))
+    for chunk in range(N_CHUNKS):
+        rebuf = environment.get_video_chunk(trajectories[:, chunk])[3]
+        reward_index = 0 if last_chunk_as_first and chunk == N_CHUNKS - 1 else chunk
+        qoe += reward_function.return_reward_batch(environment.manifest, reward_index,
+                                                   trajectories[:, max(chunk - 1, 0)], trajectories[:, chunk], rebuf)
+    return qoe.max()
+
+
+@pytest.mark.parametrize('reward_function', [BitrateQoE(), VMAFQoE()])
+@pytest.mark.parametrize('last_chunk_as_first', [False, True])
+def test_oracle_finds_the_optimum(reward_function, last_chunk_as_first):
+    cooked_time, cooked_bw = synthetic_trace()
+    environment = BatchEnvironment([cooked_time], [cooked_bw], VIDEO_INFORMATION_CSV, video_chunk_limit=N_CHUNKS,
+                                   BUFFER_THRESH=BUFFER_THRESH)
+    optimum = brute_force(cooked_time, cooked_bw, reward_function, last_chunk_as_first)
+    solution = OfflineOracle(reward_function, buffer_bucket_ms=1., time_bucket_ms=1.,
+                             last_chunk_as_first=last_chunk_as_first).solve(environment)
+    assert np.isclose(solution.qoe_lower_bound[0], optimum)
+
+
+def test_oracle_qoe_matches_run_windows():
+    cooked_time, cooked_bw = synthetic_trace()
+    environment = BatchEnvironment([cooked_time, cooked_time], [cooked_bw, cooked_bw * 0.5],
+                                   VIDEO_INFORMATION_CSV, video_chunk_limit=N_CHUNKS, BUFFER_THRESH=BUFFER_THRESH)
+    reward_function = VMAFQoE()
+    solution = OfflineOracle(reward_function, last_chunk_as_first=True).solve(environment)
+
+    def replay(batch_environment, observation):
+        chunk = np.minimum(batch_environment.video_chunk_counter, N_CHUNKS - 1)
+        return solution.levels[np.arange(batch_environment.n_sessions), chunk]
+
+    result = run_windows(environment, replay, reward_function, first_level=solution.levels[:, 0])
+    assert np.allclose(result['qoe'].values, solution.qoe_lower_bound)
+    assert np.allclose(result['rebuffer_s'].values, solution.rebuffer_s)
@@ -0,0 +1,28 @@
+import os
+import shutil
+
+from OfflineSimulator.MPC import MPC, BitrateQoE
+from OfflineSimulator.QoEScoring import load_offline_trajectories, score_sessions
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VIDEO_INFORMATION_CSV = os.path.join(REPOSITORY, 'Data/VideoInformation/Vimeo_Info/105646584_video_info')
+
+
+def test_partial_text_logs_are_not_scored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('traces/')
+    trace_files = sorted(os.listdir(os.path.join(REPOSITORY, 'Data/Traces')))[:2]
+    for trace_file in trace_files:
+        shutil.copy(os.path.join(REPOSITORY, 'Data/Traces', trace_file), 'traces/')
+    MPC('scoring', BitrateQoE(), last_n_probes=5, lookahead=3).evaluate_video('traces/', VIDEO_INFORMATION_CSV,
+                                                                              '105646584')
+    result_folder = 'Data/Results/scoring/Vimeo_Info/'
+    # a session which was interrupted after three chunks
+    with open(os.path.join(result_folder, 'video_105646584_file_id_%s' % trace_files[0]), 'r') as log_file:
+        lines = log_file.readlines()[:3]
+    with open(os.path.join(result_folder, 'video_105646584_file_id_interrupted'), 'w') as log_file:
+        log_file.writelines(lines)
+
+    sessions = score_sessions(load_offline_trajectories('Data/Results/scoring/'), {'bitrate': BitrateQoE()})
+    assert sorted(os.path.basename(session) for session in sessions.index) == [
+        'video_105646584_file_id_%s' % trace_file for trace_file in trace_files]
@@ -0,0 +1,15 @@
+from OfflineSimulator.SessionLog import read_session_log, SessionLogWriter
+
+
+def test_read_session_log_keeps_duplicate_sessions_once(tmp_path):
+    values = [0.5, 1.0, 50.0, 4.0, 0.0, 1000, 4.0, 10.0, 1, 1.0]
+    for partition_sessions in [['video_x_file_id_a', 'video_x_file_id_b'], ['video_x_file_id_b', 'video_x_file_id_c']]:
+        writer = SessionLogWriter(str(tmp_path))
+        for session_name in partition_sessions:
+            writer.start_session(session_name)
+            for chunk in range(3 if session_name.endswith('b') else 2):
+                writer.add_chunk(*values)
+            writer.end_session()
+        writer.close()
+    session_log = read_session_log(str(tmp_path))
+    assert session_log.groupby('session', observed=True).size().tolist() == [2, 3, 2]
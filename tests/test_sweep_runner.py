@@ -0,0 +1,81 @@
+import os
+import shutil
+
+from OfflineSimulator.MPC import MPC, BitrateQoE
+from OfflineSimulator.SessionLog import list_partitions, read_session_log, read_text_log, PARTITION_SUFFIX
+from OfflineSimulator.SweepRunner import SweepRunner
+from OfflineSimulator.TraceStore import TraceStore
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VIDEO_INFORMATION_CSV = os.path.join(REPOSITORY, 'Data/VideoInformation/Vimeo_Info/105646584_video_info')
+N_TRACES = 6
+
+
+def copy_traces(folder):
+    os.makedirs(folder)
+    trace_files = sorted(os.listdir(os.path.join(REPOSITORY, 'Data/Traces')))[::20][:N_TRACES]
+    for trace_file in trace_files:
+        shutil.copy(os.path.join(REPOSITORY, 'Data/Traces', trace_file), folder)
+    return trace_files
+
+
+def test_npz_sweep_writes_few_large_partitions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    trace_files = copy_traces('traces/')
+    configs = [{'name': 'npz_sweep', 'reward_function': BitrateQoE(), 'last_n_probes': 5, 'lookahead': 3,
+                'log_format': 'npz'}]
+    SweepRunner(configs, [VIDEO_INFORMATION_CSV], 'traces/', n_processes=2, use_shared_pool=False,
+                sessions_per_partition=4).run()
+
+    result_folder = 'Data/Results/npz_sweep/Vimeo_Info/'
+    partitions = list_partitions(result_folder)
+    # every job wrote its own partition, the 6 sessions are merged into partitions of at most 4 sessions
+    assert len(partitions) == 2
+    session_log = read_session_log(result_folder)
+    assert session_log['session'].nunique() == N_TRACES
+
+    # the sessions are the same as the ones of a sequential run
+    for trace_file in trace_files:
+        MPC('text_reference', BitrateQoE(), last_n_probes=5, lookahead=3).evaluate_video(
+            'traces/', VIDEO_INFORMATION_CSV, '105646584', filter_traces=[trace_file])
+    for trace_file in trace_files:
+        session_name = 'video_105646584_file_id_%s' % trace_file
+        text_log = read_text_log('Data/Results/text_reference/Vimeo_Info/' + session_name)
+        session = session_log[session_log['session'] == os.path.join(result_folder, session_name)]
+        assert (session.drop(columns='session').values == text_log.values).all()
+
+
+def test_compaction_resumes_without_duplicates(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    copy_traces('traces/')
+    configs = [{'name': 'npz_sweep', 'reward_function': BitrateQoE(), 'last_n_probes': 5, 'lookahead': 3,
+                'log_format': 'npz'}]
+    runner = SweepRunner(configs, [VIDEO_INFORMATION_CSV], 'traces/', n_processes=2, use_shared_pool=False,
+                         sessions_per_partition=100)
+    runner.run()
+    result_folder = 'Data/Results/npz_sweep/Vimeo_Info/'
+    partitions = list_partitions(result_folder)
+    assert len(partitions) == 1
+
+    # a compaction interrupted before it removed the small partitions leaves the sessions twice
+    session_names = sorted(os.listdir(result_folder))
+    duplicate = os.path.join(result_folder, 'video_105646584_file_id_copy' + PARTITION_SUFFIX)
+    shutil.copy(partitions[0], duplicate)
+    runner.run()
+    assert len(list_partitions(result_folder)) == 1
+    assert read_session_log(result_folder)['session'].nunique() == N_TRACES
+    assert len(read_session_log(result_folder)) == len(read_session_log(partitions[0]))
+    assert sorted(os.listdir(result_folder)) == session_names
+
+
+def test_config_with_trace_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    copy_traces('traces/')
+    trace_store = TraceStore(trace_folders=['traces/'], store_path='trace_store/traces')
+    for use_shared_pool in [True, False]:
+        name = 'trace_store_%s' % use_shared_pool
+        configs = [{'name': name, 'reward_function': BitrateQoE(), 'last_n_probes': 5, 'lookahead': 3,
+                    'trace_store': trace_store}]
+        SweepRunner(configs, [VIDEO_INFORMATION_CSV], 'traces/', n_processes=2,
+                    use_shared_pool=use_shared_pool).run()
+        assert len(os.listdir('Data/Results/%s/Vimeo_Info/' % name)) == N_TRACES + 1